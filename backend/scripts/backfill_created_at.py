@@ -0,0 +1,62 @@
+"""
+Add created_at to records written before it existed
+
+The records index lists each user's records by created_at, and records
+without it are not in the index at all. Their created_at is derived from
+the dd/mm/YYYY `date` attribute, at midnight UTC.
+
+Run once after deploying: python scripts/backfill_created_at.py <table name>
+"""
+import sys
+import argparse
+from datetime import datetime
+import boto3
+from botocore.exceptions import ClientError
+
+
+def created_at(record):
+    try:
+        day = datetime.strptime(record.get("date", ""), "%d/%m/%Y")
+    except ValueError:
+        day = datetime(1970, 1, 1)
+    return day.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def backfill(table):
+    updated = 0
+    params = {
+        "ProjectionExpression": "record_id, #date, created_at",
+        "ExpressionAttributeNames": {"#date": "date"},
+    }
+    while True:
+        page = table.scan(**params)
+        for record in page.get("Items", []):
+            if record.get("created_at"):
+                continue
+            try:
+                # A record created meanwhile already has the exact time
+                table.update_item(
+                    Key={"record_id": record["record_id"]},
+                    UpdateExpression="set created_at=:created_at",
+                    ConditionExpression="attribute_not_exists(created_at)",
+                    ExpressionAttributeValues={":created_at": created_at(record)},
+                )
+                updated += 1
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+        if not page.get("LastEvaluatedKey"):
+            return updated
+        params["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("table", help="records table name")
+    args = parser.parse_args()
+    updated = backfill(boto3.resource("dynamodb").Table(args.table))
+    print(f"Records updated: {updated}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,20 @@
 import os
 import json
 import boto3
-from datetime import date
+from botocore.config import Config
+from datetime import date, datetime, timezone
+from instrumentation import instrumented, timer
 
 TABLE = os.environ["TABLE_NAME"]
-dynamodb = boto3.resource("dynamodb")
+# Short timeouts and standard retries keep requests inside the API Gateway
+# limit, keep-alive reuses connections across warm invocations
+CLIENT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True,
+)
+dynamodb = boto3.resource("dynamodb", config=CLIENT_CONFIG)
 item = {
     "record_id": "",
     "email": "",
@@ -13,9 +23,11 @@ item = {
     "avaliation": "",
     "video": "",
     "report": "",
+    "created_at": "",
 }
 
 
+@instrumented
 def lambda_handler(event, context):
     # Handle OPTIONS request for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
@@ -35,9 +47,12 @@ def lambda_handler(event, context):
     item["record_id"] = data["record_id"]
     item["email"] = data["email"]
     item["date"] = date.today().strftime("%d/%m/%Y")
+    # Range key of the records index, so a user's records are listed newest first
+    item["created_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
     item["duration"] = data["duration"]
 
-    table.put_item(Item=item)
+    with timer("dynamodb.put_record"):
+        table.put_item(Item=item)
 
     return {
         "statusCode": 200,
@@ -1,11 +1,13 @@
 import os
 import json
 import boto3
+from instrumentation import instrumented
 
 BUCKET = os.environ["BUCKET"]
 s3 = boto3.client("s3")
 
 
+@instrumented
 def lambda_handler(event, context):
     # Handle OPTIONS request for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
@@ -2,48 +2,185 @@ import os
 import json
 import boto3
 from botocore.config import Config
+from instrumentation import instrumented, timer
 
 BUCKET = os.environ["BUCKET"]
 s3 = boto3.client("s3", config=Config(s3={"use_accelerate_endpoint": True}))
 
+# Multipart uploads: the browser sends the parts in parallel straight to S3,
+# S3 allows at most 10000 parts per upload
+PART_URL_EXPIRES = 3600
+MAX_PARTS = 10000
 
+headers = {
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+}
+
+
+def respond(status_code, body):
+    return {"statusCode": status_code, "headers": headers, "body": json.dumps(body)}
+
+
+def uploaded_parts(filename, upload_id):
+    # Parts already in S3, used to resume and to complete the upload
+    parts = []
+    paginator = s3.get_paginator("list_parts")
+    for page in paginator.paginate(Bucket=BUCKET, Key=filename, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts.append(
+                {
+                    "part_number": part["PartNumber"],
+                    "etag": part["ETag"],
+                    "size": part["Size"],
+                }
+            )
+    return parts
+
+
+def start_upload(filename):
+    with timer("s3.create_multipart_upload"):
+        response = s3.create_multipart_upload(
+            Bucket=BUCKET, Key=filename, ContentType="video/webm"
+        )
+    return {"upload_id": response["UploadId"], "key": filename}
+
+
+def part_urls(filename, upload_id, total_parts):
+    """
+    Presigned URLs for the parts of the upload not in S3 yet
+
+    Called when the upload starts and again after a failure, in which case
+    the parts already uploaded are skipped.
+    """
+    with timer("s3.list_parts"):
+        uploaded = uploaded_parts(filename, upload_id)
+    done = {part["part_number"] for part in uploaded}
+    urls = [
+        {
+            "part_number": part_number,
+            "url": s3.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": BUCKET,
+                    "Key": filename,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number,
+                },
+                ExpiresIn=PART_URL_EXPIRES,
+            ),
+        }
+        for part_number in range(1, total_parts + 1)
+        if part_number not in done
+    ]
+    return {"uploaded": uploaded, "parts": urls}
+
+
+def complete_upload(filename, upload_id, total_parts):
+    """
+    Complete the upload with parts 1 to total_parts
+
+    The part list comes from S3, so the browser never has to read ETags.
+    Completing the upload fires the single ObjectCreated event that starts
+    the analysis, the parts themselves do not trigger it, so it is only
+    completed once every part is there. Returns the missing part numbers
+    otherwise.
+    """
+    with timer("s3.list_parts"):
+        uploaded = [
+            part
+            for part in uploaded_parts(filename, upload_id)
+            if part["part_number"] <= total_parts
+        ]
+    done = {part["part_number"] for part in uploaded}
+    missing = [n for n in range(1, total_parts + 1) if n not in done]
+    if missing:
+        return None, missing
+    with timer("s3.complete_multipart_upload"):
+        s3.complete_multipart_upload(
+            Bucket=BUCKET,
+            Key=filename,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                    for part in uploaded
+                ]
+            },
+        )
+    return {"key": filename, "parts": len(uploaded)}, []
+
+
+@instrumented
 def lambda_handler(event, context):
+    """
+    Presigned uploads to the media bucket
+
+    GET without an action returns a presigned POST for the whole file.
+    Multipart uploads use GET with action=start to create the upload and
+    action=parts, with upload_id and the total number of parts, to get the
+    part URLs and the parts already uploaded. POST with action "complete",
+    the filename, upload_id and the total number of parts completes the
+    upload, or with action "abort" drops it.
+    """
     # Handle OPTIONS request for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET,OPTIONS",
-            },
-            "body": ""
-        }
-    
-    # Check if queryStringParameters exists
-    if not event.get("queryStringParameters") or not event["queryStringParameters"].get("filename"):
-        return {
-            "statusCode": 400,
-            "headers": {
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET,OPTIONS",
-            },
-            "body": json.dumps({"error": "Missing filename parameter"})
-        }
-    
-    response = s3.generate_presigned_post(
-        Bucket=BUCKET,
-        Key=event["queryStringParameters"]["filename"],
-        ExpiresIn=600,
-    )
-
-    return {
-        "statusCode": 200,
-        "headers": {
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET,OPTIONS",
-        },
-        "body": json.dumps(response),
-    }
+        return {"statusCode": 200, "headers": headers, "body": ""}
+
+    if event.get("httpMethod") == "POST":
+        try:
+            params = json.loads(event.get("body") or "{}")
+        except ValueError:
+            return respond(400, {"error": "Invalid JSON body"})
+        if not isinstance(params, dict):
+            return respond(400, {"error": "Invalid JSON body"})
+    else:
+        params = event.get("queryStringParameters") or {}
+
+    # Every action needs the filename
+    if not params.get("filename"):
+        return respond(400, {"error": "Missing filename parameter"})
+
+    filename = params["filename"]
+    action = params.get("action")
+
+    if action is None:
+        response = s3.generate_presigned_post(
+            Bucket=BUCKET,
+            Key=filename,
+            ExpiresIn=600,
+        )
+        return respond(200, response)
+
+    if action == "start":
+        return respond(200, start_upload(filename))
+
+    if not params.get("upload_id"):
+        return respond(400, {"error": "Missing upload_id parameter"})
+    upload_id = params["upload_id"]
+
+    try:
+        if action in ("parts", "complete"):
+            total_parts = int(params.get("parts", 0))
+            if not 1 <= total_parts <= MAX_PARTS:
+                return respond(400, {"error": f"parts must be between 1 and {MAX_PARTS}"})
+
+        if action == "parts":
+            return respond(200, part_urls(filename, upload_id, total_parts))
+
+        if action == "complete":
+            completed, missing = complete_upload(filename, upload_id, total_parts)
+            if missing:
+                return respond(409, {"error": "Parts missing", "missing": missing})
+            return respond(200, completed)
+
+        if action == "abort":
+            s3.abort_multipart_upload(Bucket=BUCKET, Key=filename, UploadId=upload_id)
+            return respond(200, {"key": filename})
+    except (TypeError, ValueError):
+        return respond(400, {"error": "Invalid parts parameter"})
+    except s3.exceptions.NoSuchUpload:
+        return respond(404, {"error": "Upload not found"})
+
+    return respond(400, {"error": f"Unknown action: {action}"})
@@ -1,8 +1,10 @@
 import os
 import json
+import base64
 import boto3
 import decimal
-from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
+from instrumentation import instrumented, timer
 
 # Helper function to convert DynamoDB items to JSON-serializable format
 def replace_decimals(obj):
@@ -20,9 +22,54 @@ def replace_decimals(obj):
 
 TABLE = os.environ["TABLE_NAME"]
 INDEX = os.environ["INDEX_NAME"]
-dynamodb = boto3.resource("dynamodb")
+BUCKET = os.environ.get("BUCKET")
+# Short timeouts and standard retries keep requests inside the API Gateway
+# limit, keep-alive reuses connections across warm invocations
+CLIENT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True,
+)
+dynamodb = boto3.resource("dynamodb", config=CLIENT_CONFIG)
+# Only needed for records with the transcription in S3, created on first use
+s3 = None
 
+# Records per page and the summary attributes returned for each record,
+# the full report is only returned when a single record_id is requested.
+# "preview" is set while partial results can be shown before the report
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+SUMMARY_ATTRIBUTES = ["record_id", "date", "duration", "attention", "video", "preview"]
 
+
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    # Any other JSON value would only fail later, inside the query
+    if not isinstance(key, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
+
+
+def inline_transcription(report):
+    # Long transcriptions are kept in S3, only their key is in the record
+    global s3
+    if isinstance(report, dict) and report.get("transcription_key"):
+        if s3 is None:
+            s3 = boto3.client("s3", config=CLIENT_CONFIG)
+        with timer("s3.read_transcription"):
+            body = s3.get_object(Bucket=BUCKET, Key=report["transcription_key"])["Body"]
+            report["transcription"] = body.read().decode()
+    return report
+
+
+@instrumented
 def lambda_handler(event, context):
     # Set up CORS headers
     headers = {
@@ -64,15 +111,58 @@ def lambda_handler(event, context):
             }
         
         email = event["queryStringParameters"]["email"]
+
+        # Full record, including the report, fetched on demand
+        record_id = event["queryStringParameters"].get("record_id")
+        if record_id:
+            print(f"Getting record: {record_id}")
+            with timer("dynamodb.get_record"):
+                item = table.get_item(Key={"record_id": record_id}).get("Item")
+            if not item or item.get("email") != email:
+                return {
+                    "statusCode": 404,
+                    "headers": headers,
+                    "body": json.dumps({"error": "Record not found"})
+                }
+            item["report"] = inline_transcription(item.get("report"))
+            return {
+                "statusCode": 200,
+                "headers": headers,
+                "body": json.dumps({"result": replace_decimals(item)})
+            }
+
         print(f"Querying for email: {email}")
         
-        response = table.query(
-            IndexName=INDEX,
-            KeyConditionExpression="email = :email",
-            ExpressionAttributeValues={
-                ":email": email,
-            },
-        )
+        try:
+            limit = min(int(event["queryStringParameters"].get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+            # DynamoDB rejects a Limit below 1
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit}")
+            query = {
+                "IndexName": INDEX,
+                "KeyConditionExpression": "email = :email",
+                "ExpressionAttributeValues": {
+                    ":email": email,
+                },
+                # "date" is a reserved word, so every attribute goes through a name placeholder
+                "ProjectionExpression": ", ".join(f"#a{i}" for i in range(len(SUMMARY_ATTRIBUTES))),
+                "ExpressionAttributeNames": {f"#a{i}": name for i, name in enumerate(SUMMARY_ATTRIBUTES)},
+                "Limit": limit,
+                # The index is sorted by created_at, newest records first
+                "ScanIndexForward": False,
+            }
+            if event["queryStringParameters"].get("cursor"):
+                query["ExclusiveStartKey"] = decode_cursor(event["queryStringParameters"]["cursor"])
+        except ValueError:
+            return {
+                "statusCode": 400,
+                "headers": headers,
+                "body": json.dumps({"error": "Invalid limit or cursor parameter"})
+            }
+
+        with timer("dynamodb.query_records"):
+            response = table.query(**query)
+        cursor = encode_cursor(response.get("LastEvaluatedKey"))
         
         # Can't directly print response due to Decimal values
         print(f"DynamoDB response received with {len(response.get('Items', []))} items")
@@ -89,7 +179,7 @@ def lambda_handler(event, context):
         return {
             "statusCode": 200,
             "headers": headers,
-            "body": json.dumps({"results": []})
+            "body": json.dumps({"results": [], "cursor": cursor})
         }
 
     try:
@@ -97,7 +187,7 @@ def lambda_handler(event, context):
         serializable_items = replace_decimals(response["Items"])
         
         # Try to serialize to JSON to catch any issues
-        result_json = json.dumps({"results": serializable_items})
+        result_json = json.dumps({"results": serializable_items, "cursor": cursor})
         
         return {
             "statusCode": 200,
@@ -123,5 +213,5 @@ def lambda_handler(event, context):
         return {
             "statusCode": 200,
             "headers": headers,
-            "body": json.dumps({"results": simple_items})
+            "body": json.dumps({"results": simple_items, "cursor": cursor})
         }
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import socket
+import resource
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+# Shared by every function through the instrumentation layer. Stage timings
+# are printed as CloudWatch embedded metric format (EMF) documents, and each
+# stage is also sent as a trace span to the X-Ray daemon protocol collector
+# at INSTRUMENTATION_COLLECTOR (host:port), which defaults to the Lambda
+# X-Ray daemon. Locally, run the X-Ray daemon in local mode, or any UDP
+# listener, and point INSTRUMENTATION_COLLECTOR to it.
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "InterviewSimulator")
+SERVICE = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+COLLECTOR = os.environ.get(
+    "INSTRUMENTATION_COLLECTOR", os.environ.get("AWS_XRAY_DAEMON_ADDRESS")
+)
+DAEMON_HEADER = b'{"format": "json", "version": 1}\n'
+
+# EMF accepts at most 100 values per metric in a single document
+MAX_VALUES = 100
+
+state = {"correlation_id": None, "trace_id": None}
+timings = {}
+units = {}
+lock = threading.Lock()
+sock = None
+
+
+def find_correlation_id(event):
+    # Set by start_machine and passed along by every state of the workflow,
+    # the Parallel state hands update_table a list with one input per branch
+    if isinstance(event, list):
+        event = event[0] if event and isinstance(event[0], dict) else {}
+    if isinstance(event, dict):
+        return event.get("CorrelationId")
+    return None
+
+
+def set_correlation_id(event=None, correlation_id=None):
+    """
+    Use the execution's correlation ID, or a new one outside the workflow
+    """
+    state["correlation_id"] = (
+        correlation_id or find_correlation_id(event) or str(uuid.uuid4())
+    )
+    state["trace_id"] = None
+    return state["correlation_id"]
+
+
+def get_correlation_id():
+    return state["correlation_id"] or set_correlation_id()
+
+
+def trace_header():
+    # Lambda sets the header for each invocation when tracing is active
+    header = os.environ.get("_X_AMZN_TRACE_ID", "")
+    fields = dict(
+        field.split("=", 1) for field in header.split(";") if "=" in field
+    )
+    if "Root" not in fields:
+        if not state["trace_id"]:
+            state["trace_id"] = f"1-{int(time.time()):08x}-{uuid.uuid4().hex[:24]}"
+        fields = {"Root": state["trace_id"], "Sampled": "1"}
+    return fields
+
+
+def send_span(name, start, end, error=None):
+    global sock
+    if not COLLECTOR:
+        return
+    trace = trace_header()
+    if trace.get("Sampled") == "0":
+        return
+
+    span = {
+        "name": name,
+        "id": uuid.uuid4().hex[:16],
+        "trace_id": trace["Root"],
+        "start_time": start,
+        "end_time": end,
+        "annotations": {"correlation_id": get_correlation_id(), "service": SERVICE},
+    }
+    # Inside Lambda, spans are attached to the function's segment
+    if trace.get("Parent"):
+        span["type"] = "subsegment"
+        span["parent_id"] = trace["Parent"]
+    if error is not None:
+        span["fault"] = True
+        span["cause"] = {
+            "exceptions": [{"message": str(error), "type": type(error).__name__}]
+        }
+
+    try:
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        host, port = COLLECTOR.rsplit(":", 1)
+        sock.sendto(DAEMON_HEADER + json.dumps(span).encode(), (host, int(port)))
+    except Exception as e:
+        print(f"Error sending span: {str(e)}")
+
+
+def record(stage, value, unit="Milliseconds"):
+    # Stage durations by default, other values such as counts take their unit
+    with lock:
+        timings.setdefault(stage, []).append(round(value, 3))
+        units[stage] = unit
+
+
+@contextmanager
+def timer(stage):
+    """
+    Time the block as `stage`, safe to use from several threads at once
+    """
+    start = time.time()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        end = time.time()
+        record(stage, (end - start) * 1000)
+        send_span(stage, start, end, error)
+
+
+def timed(stage):
+    """
+    Decorator version of `timer`
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush(**properties):
+    """
+    Print the timings recorded since the last flush as an EMF document
+    """
+    with lock:
+        recorded = dict(timings)
+        recorded_units = dict(units)
+        timings.clear()
+        units.clear()
+    if not recorded:
+        return
+
+    # Stages with more values than fit in one document span several
+    longest = max(len(values) for values in recorded.values())
+    for offset in range(0, longest, MAX_VALUES):
+        chunk = {
+            stage: values[offset : offset + MAX_VALUES]
+            for stage, values in recorded.items()
+            if len(values) > offset
+        }
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Service"]],
+                        "Metrics": [
+                            {"Name": stage, "Unit": recorded_units[stage]}
+                            for stage in chunk
+                        ],
+                    }
+                ],
+            },
+            "Service": SERVICE,
+            "CorrelationId": get_correlation_id(),
+            **properties,
+            **chunk,
+        }
+        print(json.dumps(document))
+
+
+def reset_peak_memory():
+    """
+    Reset the peak resident set size of the process, so the next
+    peak_memory_mb only covers what ran since
+
+    Writing 5 to clear_refs resets VmHWM on Linux. Where it is not
+    available the peak stays the one of the whole process, and False is
+    returned.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb():
+    # VmHWM is the peak since the last reset, ru_maxrss the peak of the
+    # whole process; both are in kilobytes on Linux
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def instrumented(handler):
+    """
+    Decorator for Lambda handlers: picks up the correlation ID from the
+    event, times the whole invocation and flushes the metrics at the end
+    """
+
+    @wraps(handler)
+    def wrapper(event, context):
+        set_correlation_id(event)
+        # Warm containers run one invocation at a time, so the peak since
+        # the reset is the invocation's own; "container" marks the lifetime
+        # peak of the process where it cannot be reset
+        scope = "invocation" if reset_peak_memory() else "container"
+        try:
+            with timer("handler"):
+                return handler(event, context)
+        finally:
+            flush(PeakMemoryMB=peak_memory_mb(), PeakMemoryScope=scope)
+
+    return wrapper
@@ -0,0 +1,289 @@
+import re
+import os
+import ast
+import json
+import time
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import instrumented, record, timer
+
+BUCKET = os.environ["BUCKET"]
+TABLE = os.environ["TABLE_NAME"]
+QUEUE_URL = os.environ["BATCH_QUEUE_URL"]
+ROLE_ARN = os.environ["BATCH_ROLE_ARN"]
+
+# Constants for Bedrock models
+MODEL_ID = "anthropic.claude-sonnet-4-20250514-v1:0"
+# Sonnet 4 is only invoked on demand through an inference profile, the
+# system-defined cross-region one unless INFERENCE_PROFILE_ARN is set, so
+# both modes evaluate the interviews with the same model
+ON_DEMAND_MODEL_ID = f"us.{MODEL_ID}"
+
+# Bedrock rejects batch jobs below its minimum number of records, smaller
+# batches older than BATCH_MAX_WAIT_SECONDS are sent on demand instead
+BATCH_MIN_RECORDS = int(os.environ.get("BATCH_MIN_RECORDS", "100"))
+BATCH_MAX_RECORDS = int(os.environ.get("BATCH_MAX_RECORDS", "5000"))
+BATCH_MAX_WAIT_SECONDS = int(os.environ.get("BATCH_MAX_WAIT_SECONDS", "3600"))
+ON_DEMAND_CONCURRENCY = 4
+
+# Records a batch job did not answer are queued again, after
+# BATCH_MAX_ATTEMPTS jobs they are sent on demand instead
+BATCH_MAX_ATTEMPTS = int(os.environ.get("BATCH_MAX_ATTEMPTS", "3"))
+# Statuses of the job state change event after which the job is over
+SUCCEEDED_STATUSES = ("Completed", "PartiallyCompleted")
+FAILED_STATUSES = ("Failed", "Stopped", "Expired")
+
+s3 = boto3.client("s3")
+sqs = boto3.client("sqs")
+bedrock = boto3.client("bedrock", region_name="us-east-1")
+bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-east-1")
+dynamodb = boto3.resource("dynamodb")
+
+
+def receive_pending():
+    # Drain the queue, messages not deleted become visible again later
+    messages = []
+    while len(messages) < BATCH_MAX_RECORDS:
+        response = sqs.receive_message(
+            QueueUrl=QUEUE_URL,
+            MaxNumberOfMessages=10,
+            VisibilityTimeout=900,
+            AttributeNames=["SentTimestamp"],
+        )
+        if not response.get("Messages"):
+            break
+        messages.extend(response["Messages"])
+    return messages
+
+
+def release_messages(messages):
+    # Make the messages visible again now, instead of after the visibility timeout
+    for i in range(0, len(messages), 10):
+        sqs.change_message_visibility_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[
+                {
+                    "Id": str(n),
+                    "ReceiptHandle": message["ReceiptHandle"],
+                    "VisibilityTimeout": 0,
+                }
+                for n, message in enumerate(messages[i : i + 10])
+            ],
+        )
+
+
+def delete_messages(messages):
+    for i in range(0, len(messages), 10):
+        sqs.delete_message_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[
+                {"Id": str(n), "ReceiptHandle": message["ReceiptHandle"]}
+                for n, message in enumerate(messages[i : i + 10])
+            ],
+        )
+
+
+def save_feedback(record_id, feedback):
+    # Fill the sections left empty in the report when the feedback was queued
+    feedback = feedback.replace('"', "`")
+    table = dynamodb.Table(TABLE)
+    item = table.get_item(Key={"record_id": record_id}).get("Item", {})
+    report = item.get("report") or {}
+    if isinstance(report, str):
+        # Records written before reports were stored as maps
+        report = ast.literal_eval(report)
+
+    for name, tag in (("avaliacao", "avaliação"), ("correcao", "correção")):
+        match = re.search(rf"<{tag}>(.*?)<\/{tag}>", feedback, re.DOTALL)
+        report[name] = match.group(1).strip() if match else ""
+
+    with timer("dynamodb.save_feedback"):
+        table.update_item(
+            Key={"record_id": record_id},
+            UpdateExpression="set report=:report",
+            ExpressionAttributeValues={":report": report},
+        )
+
+
+def on_demand(request):
+    # Few records and waiting too long, invoke the model for each one
+    model_id = os.environ.get("INFERENCE_PROFILE_ARN") or ON_DEMAND_MODEL_ID
+    with timer("bedrock.invoke_model"):
+        response = bedrock_runtime.invoke_model(
+            modelId=model_id, body=json.dumps(request["model_input"])
+        )
+    feedback = (
+        json.loads(response.get("body").read())
+        .get("content", [])[0]
+        .get("text", "")
+    )
+    save_feedback(request["record_id"], feedback)
+
+
+def submit():
+    """
+    Submit the queued feedback requests as one Bedrock batch inference job
+    """
+    messages = receive_pending()
+    if not messages:
+        print("No feedback requests pending")
+        return
+
+    requests = [json.loads(message["Body"]) for message in messages]
+    oldest = min(int(message["Attributes"]["SentTimestamp"]) for message in messages)
+    waiting = time.time() - oldest / 1000
+
+    # Requests the earlier jobs kept failing on do not go to another one
+    retried = [
+        n for n, request in enumerate(requests) if request.get("attempts", 0) >= BATCH_MAX_ATTEMPTS
+    ]
+    if retried:
+        with ThreadPoolExecutor(max_workers=ON_DEMAND_CONCURRENCY) as executor:
+            list(executor.map(on_demand, [requests[n] for n in retried]))
+        delete_messages([messages[n] for n in retried])
+        print(f"Feedback generated on demand for {len(retried)} records after {BATCH_MAX_ATTEMPTS} batch jobs")
+        messages = [m for n, m in enumerate(messages) if n not in retried]
+        requests = [r for n, r in enumerate(requests) if n not in retried]
+        if not requests:
+            return
+
+    if len(requests) < BATCH_MIN_RECORDS:
+        if waiting < BATCH_MAX_WAIT_SECONDS:
+            # Calculate_text_metrics keeps adding to the queue, the next run
+            # must see these messages again and not wait out the timeout
+            release_messages(messages)
+            print(f"Waiting for more requests: {len(requests)} pending")
+            return
+        with ThreadPoolExecutor(max_workers=ON_DEMAND_CONCURRENCY) as executor:
+            list(executor.map(on_demand, requests))
+        delete_messages(messages)
+        print(f"Feedback generated on demand for {len(requests)} records")
+        return
+
+    job_name = f"feedback-{int(time.time())}"
+    input_key = f"batch/input/{job_name}.jsonl"
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=input_key,
+        Body="\n".join(
+            json.dumps(
+                {"recordId": request["record_id"], "modelInput": request["model_input"]}
+            )
+            for request in requests
+        ),
+    )
+    # Bedrock only accepts recordId and modelInput in the input file
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f"batch/attempts/{job_name}.json",
+        Body=json.dumps({request["record_id"]: request.get("attempts", 0) for request in requests}),
+    )
+    bedrock.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=ROLE_ARN,
+        modelId=os.environ.get("BATCH_MODEL_ID", MODEL_ID),
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{BUCKET}/{input_key}"}},
+        outputDataConfig={
+            "s3OutputDataConfig": {"s3Uri": f"s3://{BUCKET}/batch/output/"}
+        },
+    )
+    delete_messages(messages)
+    print(f"Batch inference job {job_name} submitted with {len(requests)} records")
+
+
+def job_requests(job_name):
+    # The requests of a job, read back from its input file, with the number
+    # of jobs each one already went through
+    body = s3.get_object(Bucket=BUCKET, Key=f"batch/input/{job_name}.jsonl")["Body"]
+    requests = [json.loads(line) for line in body.iter_lines()]
+    try:
+        attempts = json.loads(
+            s3.get_object(Bucket=BUCKET, Key=f"batch/attempts/{job_name}.json")["Body"].read()
+        )
+    except s3.exceptions.NoSuchKey:
+        # Jobs submitted before the attempts were kept
+        attempts = {}
+    for request in requests:
+        request["attempts"] = attempts.get(request["recordId"], 0)
+    return requests
+
+
+def requeue(requests):
+    """
+    Queue the requests a job did not answer again, for the next job
+
+    The messages of a job are deleted once it is submitted, so these
+    records would otherwise keep an empty feedback.
+    """
+    for request in requests:
+        sqs.send_message(
+            QueueUrl=QUEUE_URL,
+            MessageBody=json.dumps(
+                {
+                    "record_id": request["recordId"],
+                    "model_input": request["modelInput"],
+                    "attempts": request.get("attempts", 0) + 1,
+                }
+            ),
+        )
+    record("batch.requeued", len(requests), "Count")
+    if requests:
+        print(f"Feedback requeued for {len(requests)} records")
+
+
+def merge(detail):
+    """
+    Write the results of a finished batch inference job back to the records
+
+    Every request of the job without a result, all of them when the job
+    failed, is queued again.
+    """
+    status = detail["status"]
+    if status not in SUCCEEDED_STATUSES + FAILED_STATUSES:
+        print(f"Batch inference job {detail['batchJobName']}: {status}")
+        return
+
+    requests = job_requests(detail["batchJobName"])
+    merged = set()
+    if status in SUCCEEDED_STATUSES:
+        # Results are written under <output prefix>/<job id>/
+        job_id = detail["batchJobArn"].split("/")[-1]
+        prefix = f"batch/output/{job_id}/"
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith(".jsonl.out"):
+                    continue
+                body = s3.get_object(Bucket=BUCKET, Key=obj["Key"])["Body"]
+                for line in body.iter_lines():
+                    result = json.loads(line)
+                    if "modelOutput" not in result:
+                        print(f"No output for {result['recordId']}: {result.get('error')}")
+                        continue
+                    feedback = result["modelOutput"].get("content", [])[0].get("text", "")
+                    save_feedback(result["recordId"], feedback)
+                    merged.add(result["recordId"])
+    else:
+        print(f"Batch inference job {detail['batchJobName']}: {status}, {detail.get('message', '')}")
+
+    record("batch.merged", len(merged), "Count")
+    print(f"Feedback merged for {len(merged)} records")
+    requeue([request for request in requests if request["recordId"] not in merged])
+
+
+@instrumented
+def lambda_handler(event, context):
+    """
+    Batch mode for the interview feedback
+
+    Runs on a schedule to submit the requests queued by
+    calculate_text_metrics, and on the batch inference job state change
+    event to merge the results into the records table.
+    """
+    print(event)
+    if event.get("source") == "aws.bedrock":
+        merge(event["detail"])
+    else:
+        submit()
+
+    return {"statusCode": 200}
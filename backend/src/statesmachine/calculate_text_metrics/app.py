@@ -2,26 +2,135 @@
 import re
 import os
 import json
+import time
+import hashlib
 import boto3
+import ijson
+from decimal import Decimal
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import instrumented, record, timed, timer
+from delivery import delivery_metrics
 
 BUCKET = os.environ["BUCKET"]
+TABLE = os.environ.get("TABLE_NAME")
+CACHE_TABLE_NAME = os.environ.get("CACHE_TABLE_NAME")
 s3 = boto3.client("s3")
 
+# Stream the feedback and save partial sections to the record every few seconds
+FEEDBACK_STREAMING = os.environ.get("FEEDBACK_STREAMING", "false").lower() == "true"
+FEEDBACK_FLUSH_SECONDS = float(os.environ.get("FEEDBACK_FLUSH_SECONDS", "2"))
+
+# A single call is faster than the map-reduce feedback for every transcript
+# that fits the model's context (tests/bench/bench_feedback.py), so only
+# transcripts longer than LONG_TRANSCRIPT_CHARS are evaluated in segments of
+# FEEDBACK_SEGMENT_CHARS, with up to FEEDBACK_CONCURRENCY parallel calls.
+# The default is the context of Sonnet 4, less room for the instructions and
+# the answer, at a conservative 3 characters per token of Portuguese.
+MODEL_CONTEXT_TOKENS = int(os.environ.get("MODEL_CONTEXT_TOKENS", "200000"))
+PROMPT_RESERVE_TOKENS = 4096
+CHARS_PER_TOKEN = 3
+LONG_TRANSCRIPT_CHARS = int(
+    os.environ.get(
+        "LONG_TRANSCRIPT_CHARS",
+        str((MODEL_CONTEXT_TOKENS - PROMPT_RESERVE_TOKENS) * CHARS_PER_TOKEN),
+    )
+)
+FEEDBACK_SEGMENT_CHARS = int(os.environ.get("FEEDBACK_SEGMENT_CHARS", "12000"))
+FEEDBACK_CONCURRENCY = int(os.environ.get("FEEDBACK_CONCURRENCY", "4"))
+
+# Longer transcripts are stored in S3 and the report keeps only their key
+TRANSCRIPT_INLINE_CHARS = int(os.environ.get("TRANSCRIPT_INLINE_CHARS", "16000"))
+
+# "on_demand" calls Bedrock right away, "batch" queues the request on
+# BATCH_QUEUE_URL for the next batch inference job
+FEEDBACK_MODE = os.environ.get("FEEDBACK_MODE", "on_demand")
+BATCH_QUEUE_URL = os.environ.get("BATCH_QUEUE_URL")
+sqs = boto3.client("sqs")
+
 # Constants for Bedrock models
 MODEL_ID = "anthropic.claude-sonnet-4-20250514-v1:0"
 FALLBACK_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
 
-metrics = {
-    "transcription": "",
-    "feedback": "",
-}
+# Resolved inference profile, reused by warm containers until it expires
+INFERENCE_PROFILE_TTL = 3600
+inference_profile = {"arn": None, "expires_at": 0}
+
+# Feedback cached by request hash, in memory and in CACHE_TABLE_NAME if set
+FEEDBACK_CACHE_TTL = 7 * 24 * 3600
+feedback_cache = {}
+
+# Clients are created once per container and shared by every call, the
+# Bedrock read timeout leaves room for long feedback responses
+CLIENT_CONFIG = Config(
+    retries={"max_attempts": 3, "mode": "standard"},
+    max_pool_connections=max(10, FEEDBACK_CONCURRENCY + 1),
+    tcp_keepalive=True,
+)
+bedrock_runtime = boto3.client(
+    "bedrock-runtime",
+    region_name="us-east-1",
+    config=CLIENT_CONFIG.merge(Config(read_timeout=300)),
+)
+bedrock = boto3.client("bedrock", region_name="us-east-1", config=CLIENT_CONFIG)
+dynamodb = boto3.resource("dynamodb", config=CLIENT_CONFIG)
+# Only needed when the inference profile has to be created
+sts = None
+
+# Function to get the inference profile, resolved at most once per TTL
+def get_inference_profile():
+    if os.environ.get("INFERENCE_PROFILE_ARN"):
+        return os.environ["INFERENCE_PROFILE_ARN"]
+
+    if time.time() >= inference_profile["expires_at"]:
+        arn = get_or_create_inference_profile()
+        # A failed lookup is retried on the next call, not kept for the whole TTL
+        if arn is None:
+            return None
+        inference_profile["arn"] = arn
+        inference_profile["expires_at"] = time.time() + INFERENCE_PROFILE_TTL
+    return inference_profile["arn"]
+
+
+def get_cached_feedback(key):
+    if key in feedback_cache:
+        return feedback_cache[key]
+    if not CACHE_TABLE_NAME:
+        return None
+
+    try:
+        table = dynamodb.Table(CACHE_TABLE_NAME)
+        item = table.get_item(Key={"cache_key": key}).get("Item")
+        if item and int(item["expires_at"]) >= time.time():
+            feedback_cache[key] = item["value"]
+            return item["value"]
+    except Exception as e:
+        print(f"Error reading feedback cache: {str(e)}")
+    return None
+
+
+def put_cached_feedback(key, feedback):
+    feedback_cache[key] = feedback
+    if not CACHE_TABLE_NAME:
+        return
+
+    try:
+        table = dynamodb.Table(CACHE_TABLE_NAME)
+        with timer("dynamodb.feedback_cache"):
+            table.put_item(
+                Item={
+                    "cache_key": key,
+                    "value": feedback,
+                    "expires_at": int(time.time()) + FEEDBACK_CACHE_TTL,
+                }
+            )
+    except Exception as e:
+        print(f"Error writing feedback cache: {str(e)}")
 
-# Initialize Bedrock clients
-bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-east-1")
-bedrock = boto3.client("bedrock", region_name="us-east-1")
 
 # Function to get or create an inference profile
 def get_or_create_inference_profile():
+    global sts
     profile_name = f"interview-simulator-claude-sonnet-4-{os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'default')}"
     
     try:
@@ -34,7 +143,8 @@ def get_or_create_inference_profile():
         # If not found, try to create one
         try:
             # Get the Lambda execution role
-            sts = boto3.client('sts')
+            if sts is None:
+                sts = boto3.client("sts", config=CLIENT_CONFIG)
             caller_identity = sts.get_caller_identity()
             account_id = caller_identity['Account']
             
@@ -56,86 +166,348 @@ def get_or_create_inference_profile():
         print(f"Error getting inference profile: {str(e)}")
         return None
 
-def bedrock_feedback(perguntas, apresentacao):
-    prompt_template_bedrock = f"""Use a transcrição da entrevista para auxiliar o entrevistador:
-  
-    <perguntas>{perguntas}</perguntas>
-    <apresentação>{apresentacao}</apresentação>
-    
-    A resposta deve seguir o seguinte formato:
-    <avaliação>Avaliação geral e de boas práticas de apresentação</avaliação>
-    <correção>Correção das respostas do aluno para as perguntas</correção>
+def parse_partial_feedback(feedback):
+    # Sections may still be open while the response is streaming
+    sections = {}
+    for name, tag in (("avaliacao", "avaliação"), ("correcao", "correção")):
+        match = re.search(rf"<{tag}>(.*?)(?:<\/{tag}>|$)", feedback, re.DOTALL)
+        if match and match.group(1).strip():
+            sections[name] = match.group(1).strip()
+    return sections
+
+
+def save_partial_feedback(record_id, feedback):
+    sections = parse_partial_feedback(feedback)
+    if not sections:
+        return False
+
+    try:
+        table = dynamodb.Table(TABLE)
+        # "preview" is in the list summaries, so the report can be opened
+        # while the analysis runs; update_table removes both at the end
+        with timer("dynamodb.partial_feedback"):
+            table.update_item(
+                Key={"record_id": record_id},
+                UpdateExpression="set partial_feedback=:partial_feedback, preview=:preview",
+                ExpressionAttributeValues={":partial_feedback": sections, ":preview": True},
+            )
+        return True
+    except Exception as e:
+        print(f"Error saving partial feedback: {str(e)}")
+        return False
+
+
+@timed("bedrock.stream_feedback")
+def stream_feedback(request_body, record_id):
     """
-    
-    request_body = json.dumps(
+    Invoke the model with a response stream and persist partial feedback
+
+    The text is accumulated as it arrives and the <avaliação> and <correção>
+    sections parsed so far are written to the record every
+    FEEDBACK_FLUSH_SECONDS, so the frontend can show them before the
+    analysis finishes.
+    """
+    inference_profile_arn = get_inference_profile()
+    start = time.time()
+
+    try:
+        model_id = inference_profile_arn or FALLBACK_MODEL_ID
+        print(f"Streaming feedback from: {model_id}")
+        response = bedrock_runtime.invoke_model_with_response_stream(
+            modelId=model_id,
+            body=request_body
+        )
+    except Exception as e:
+        # If any error occurs, fall back to Claude 3 Haiku
+        print(f"Error invoking model, falling back to {FALLBACK_MODEL_ID}: {str(e)}")
+        model_id = FALLBACK_MODEL_ID
+        response = bedrock_runtime.invoke_model_with_response_stream(
+            modelId=model_id,
+            body=request_body
+        )
+
+    feedback = ""
+    first_token = None
+    first_saved = None
+    last_flush = start
+    for event in response["body"]:
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk.get("type") != "content_block_delta":
+            continue
+
+        feedback += chunk["delta"].get("text", "")
+        if first_token is None:
+            first_token = time.time() - start
+            record("bedrock.first_token", first_token * 1000)
+            print(f"Time to first token: {first_token:.2f}s")
+
+        if time.time() - last_flush >= FEEDBACK_FLUSH_SECONDS:
+            last_flush = time.time()
+            if save_partial_feedback(record_id, feedback) and first_saved is None:
+                first_saved = time.time() - start
+                print(f"Time to first feedback: {first_saved:.2f}s")
+
+    save_partial_feedback(record_id, feedback)
+    print(f"Feedback streamed in {time.time() - start:.2f}s")
+    return feedback, model_id
+
+
+def feedback_request(prompt, max_tokens=2048):
+    return json.dumps(
         {
             "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 2048,
+            "max_tokens": max_tokens,
             "system": "Você é um entrevistador. Avalie a simulação de entrevista do aluno e corrija as respostas das perguntas, avaliando se estão corretas ou não para cada uma delas.",
             "messages": [
                 {
                     "role": "user",
-                    "content": [{"type": "text", "text": prompt_template_bedrock}],
+                    "content": [{"type": "text", "text": prompt}],
                 }
             ],
             "temperature": 0.5,
         }
     )
-    
+
+
+@timed("bedrock.invoke_model")
+def invoke_model(request_body):
+    """
+    Invoke the model and return the text with the model that answered
+    """
     # Try to get or create an inference profile
-    inference_profile_arn = get_or_create_inference_profile()
+    inference_profile_arn = get_inference_profile()
     
     try:
         if inference_profile_arn:
-            # Use inference profile if available
+            # Use inference profile if available, passed as the model ID
             print(f"Using inference profile: {inference_profile_arn}")
-            response = bedrock_runtime.invoke_model(
-                inferenceProfileArn=inference_profile_arn,
-                body=request_body
-            )
+            model_id = inference_profile_arn
         else:
             # Fall back to Claude 3 Haiku which supports direct invocation
             print(f"Falling back to {FALLBACK_MODEL_ID}")
-            response = bedrock_runtime.invoke_model(
-                modelId=FALLBACK_MODEL_ID,
-                body=request_body
-            )
+            model_id = FALLBACK_MODEL_ID
+        response = bedrock_runtime.invoke_model(
+            modelId=model_id,
+            body=request_body
+        )
     except Exception as e:
         # If any error occurs, fall back to Claude 3 Haiku
         print(f"Error invoking model, falling back to {FALLBACK_MODEL_ID}: {str(e)}")
+        model_id = FALLBACK_MODEL_ID
         response = bedrock_runtime.invoke_model(
-            modelId=FALLBACK_MODEL_ID,
+            modelId=model_id,
             body=request_body
         )
 
-    result = (
+    text = (
         json.loads(response.get("body").read())
         .get("content", [])[0]
         .get("text", "")
     )
-    
+    return text, model_id
+
+
+def generate(request_body, record_id=None):
+    # Identical requests, such as retries of the same transcript, reuse the feedback
+    key = "feedback:" + hashlib.sha256((MODEL_ID + request_body).encode()).hexdigest()
+    cached = get_cached_feedback(key)
+    if cached is not None:
+        print("Feedback cache hit")
+        return cached
+    print("Feedback cache miss")
+
+    if FEEDBACK_STREAMING and record_id:
+        result, model_id = stream_feedback(request_body, record_id)
+    else:
+        result, model_id = invoke_model(request_body)
+
+    # Only MODEL_ID answers are cached, a retry after a fallback tries it again
+    if model_id == FALLBACK_MODEL_ID:
+        print("Fallback model feedback, not cached")
+    else:
+        put_cached_feedback(key, result)
     return result
 
 
+def split_transcript(apresentacao, max_chars):
+    # Pack whole sentences into segments of at most max_chars characters
+    segments = [""]
+    for sentence in re.split(r"(?<=[.!?])\s+", apresentacao):
+        while len(sentence) > max_chars:
+            segments.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(segments[-1]) + len(sentence) + 1 > max_chars:
+            segments.append(sentence)
+        else:
+            segments[-1] = f"{segments[-1]} {sentence}".strip()
+    return [segment for segment in segments if segment]
+
+
+def chunked_feedback(perguntas, apresentacao, record_id=None):
+    """
+    Map-reduce feedback for transcripts longer than LONG_TRANSCRIPT_CHARS
+
+    The transcript is split into segments of FEEDBACK_SEGMENT_CHARS, each
+    segment is evaluated by its own model call, up to FEEDBACK_CONCURRENCY
+    at a time, and a final call merges the partial evaluations into the
+    usual <avaliação> and <correção> response.
+    """
+    segments = split_transcript(apresentacao, FEEDBACK_SEGMENT_CHARS)
+    print(f"Long transcript, evaluating {len(segments)} segments")
+
+    def evaluate(numbered_segment):
+        number, segment = numbered_segment
+        prompt = f"""Este é o trecho {number} de {len(segments)} da transcrição de uma entrevista.
+    Anote os pontos fortes, os pontos fracos de apresentação e as respostas dadas às perguntas neste trecho:
+
+    <perguntas>{perguntas}</perguntas>
+    <trecho>{segment}</trecho>
+    """
+        return generate(feedback_request(prompt, max_tokens=1024))
+
+    with ThreadPoolExecutor(max_workers=FEEDBACK_CONCURRENCY) as executor:
+        notes = list(executor.map(evaluate, enumerate(segments, start=1)))
+
+    partial_evaluations = "\n".join(
+        f'<trecho numero="{number}">{note}</trecho>'
+        for number, note in enumerate(notes, start=1)
+    )
+    prompt = f"""Use as avaliações parciais de cada trecho da entrevista para auxiliar o entrevistador:
+
+    <perguntas>{perguntas}</perguntas>
+    <avaliações>{partial_evaluations}</avaliações>
+
+    A resposta deve seguir o seguinte formato:
+    <avaliação>Avaliação geral e de boas práticas de apresentação</avaliação>
+    <correção>Correção das respostas do aluno para as perguntas</correção>
+    """
+    return generate(feedback_request(prompt), record_id)
+
+
+def feedback_prompt(perguntas, apresentacao):
+    return f"""Use a transcrição da entrevista para auxiliar o entrevistador:
+  
+    <perguntas>{perguntas}</perguntas>
+    <apresentação>{apresentacao}</apresentação>
+    
+    A resposta deve seguir o seguinte formato:
+    <avaliação>Avaliação geral e de boas práticas de apresentação</avaliação>
+    <correção>Correção das respostas do aluno para as perguntas</correção>
+    """
+
+
+def bedrock_feedback(perguntas, apresentacao, record_id=None):
+    if len(apresentacao) > LONG_TRANSCRIPT_CHARS:
+        return chunked_feedback(perguntas, apresentacao, record_id)
+
+    prompt_template_bedrock = feedback_prompt(perguntas, apresentacao)
+    return generate(feedback_request(prompt_template_bedrock), record_id)
+
+
+def queue_feedback(perguntas, apresentacao, record_id):
+    # Leave the feedback to the next Bedrock batch inference job
+    sqs.send_message(
+        QueueUrl=BATCH_QUEUE_URL,
+        MessageBody=json.dumps(
+            {
+                "record_id": record_id,
+                "model_input": json.loads(
+                    feedback_request(feedback_prompt(perguntas, apresentacao))
+                ),
+            }
+        ),
+    )
+    print(f"Feedback queued for batch inference: {record_id}")
+
+
+@timed("s3.read_transcript")
+def read_transcript(key):
+    """
+    Read the transcript text and the word level items of a Transcribe output
+
+    The object body is parsed incrementally and the download stops once both
+    are found, so the `audio_segments` that follow them are never read and
+    nothing is written to local disk.
+    """
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"]
+    transcript, items = "", []
+    try:
+        for name, value in ijson.kvitems(body, "results", use_float=True):
+            if name == "transcripts":
+                transcript = value[0]["transcript"] if value else ""
+            elif name == "items":
+                items = value
+                break
+    finally:
+        body.close()
+    return transcript, items
+
+
+def save_delivery(record_id, delivery):
+    # Shown to the student right away, before the Bedrock feedback is ready:
+    # "preview" lets the report be opened while the analysis runs
+    try:
+        with timer("dynamodb.delivery"):
+            dynamodb.Table(TABLE).update_item(
+                Key={"record_id": record_id},
+                UpdateExpression="set delivery=:delivery, preview=:preview",
+                ExpressionAttributeValues={
+                    ":delivery": json.loads(json.dumps(delivery), parse_float=Decimal),
+                    ":preview": True,
+                },
+            )
+    except Exception as e:
+        print(f"Error saving delivery metrics: {str(e)}")
+
+
+def store_transcript(record_id, apresentacao, metrics):
+    # Keep large transcripts out of the state machine payload and the record
+    if len(apresentacao) <= TRANSCRIPT_INLINE_CHARS:
+        metrics["transcription"] = apresentacao
+        return metrics
+
+    key = f"reports/{record_id}/transcription.txt"
+    with timer("s3.put_transcript"):
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=key,
+            Body=apresentacao.encode(),
+            ContentType="text/plain; charset=utf-8",
+        )
+    metrics["transcription"] = ""
+    metrics["transcription_key"] = key
+    return metrics
+
+
+@instrumented
 def lambda_handler(event, context):
     transcription_file = event["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
 
     key = os.path.splitext(os.path.basename(transcription_file))
-    s3.download_file(
-        BUCKET, "transcription/" + key[0] + key[1], "/tmp/transcription.json"
-    )
-    file = open("/tmp/transcription.json")
-
-    data = json.load(file)
-    apresentacao = data["results"]["transcripts"][0]["transcript"]
+    record_id = os.path.splitext(key[0])[0]
+    apresentacao, items = read_transcript("transcription/" + key[0] + key[1])
     perguntas = """"
     1- Cite um serviço de computação AWS;
     2- Como são cobrados os serviços AWS?;
     3- Onde posso armazenar aquivos em objeto na AWS?;
     """
 
-    metrics["transcription"] = apresentacao
-    feedback = bedrock_feedback(perguntas, apresentacao).replace('"', "`")
+    metrics = store_transcript(record_id, apresentacao, {})
+
+    with timer("delivery_metrics"):
+        metrics["delivery"] = delivery_metrics(items)
+    save_delivery(record_id, metrics["delivery"])
+
+    if FEEDBACK_MODE == "batch":
+        queue_feedback(perguntas, apresentacao, record_id)
+        metrics["avaliacao"] = ""
+        metrics["correcao"] = ""
+        return {
+            "statusCode": 200,
+            "body": {"metrics": metrics},
+        }
+
+    feedback = bedrock_feedback(perguntas, apresentacao, record_id).replace('"', "`")
     
     avaliacao_pattern = re.compile(r'<avaliação>(.*?)<\/avaliação>', re.DOTALL)
     correcao_pattern = re.compile(r'<correção>(.*?)<\/correção>', re.DOTALL)
@@ -146,5 +518,5 @@ def lambda_handler(event, context):
 
     return {
         "statusCode": 200,
-        "body": {"metrics": str(metrics)},
+        "body": {"metrics": metrics},
     }
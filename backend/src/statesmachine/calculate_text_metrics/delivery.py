@@ -0,0 +1,110 @@
+import os
+import numpy as np
+
+# Gaps between words at least PAUSE_SECONDS long count as pauses, and those
+# of LONG_PAUSE_SECONDS or more as long pauses
+PAUSE_SECONDS = float(os.environ.get("PAUSE_SECONDS", "0.5"))
+LONG_PAUSE_SECONDS = float(os.environ.get("LONG_PAUSE_SECONDS", "2"))
+PAUSE_BINS = [PAUSE_SECONDS, 1, 2, 5, np.inf]
+
+# Words Transcribe recognized with less confidence than this, in a row,
+# form the low confidence segments (mumbled or unclear speech)
+LOW_CONFIDENCE = float(os.environ.get("LOW_CONFIDENCE", "0.5"))
+MAX_LOW_CONFIDENCE_SEGMENTS = 20
+
+# Common Portuguese fillers, "é" is left out since it is mostly the verb
+FILLER_WORDS = os.environ.get(
+    "FILLER_WORDS", "ah,ahn,eh,hã,hum,hmm,uh,um,né,tipo"
+).split(",")
+
+
+def word_arrays(items):
+    # Only pronunciations have timings, punctuation items are skipped
+    words = [item for item in items if item.get("type") == "pronunciation"]
+    starts = np.array([float(word["start_time"]) for word in words])
+    ends = np.array([float(word["end_time"]) for word in words])
+    confidences = np.array(
+        [float(word["alternatives"][0].get("confidence", 1)) for word in words]
+    )
+    contents = np.array(
+        [word["alternatives"][0]["content"].lower() for word in words], dtype=object
+    )
+    return starts, ends, confidences, contents
+
+
+def pause_metrics(starts, ends):
+    gaps = starts[1:] - ends[:-1]
+    pauses = gaps[gaps >= PAUSE_SECONDS]
+    if not len(pauses):
+        return {"count": 0, "total_seconds": 0, "long": 0, "histogram": []}
+
+    counts, _ = np.histogram(pauses, bins=PAUSE_BINS)
+    return {
+        "count": int(len(pauses)),
+        "total_seconds": round(float(pauses.sum()), 2),
+        "median_seconds": round(float(np.median(pauses)), 2),
+        "p90_seconds": round(float(np.percentile(pauses, 90)), 2),
+        "max_seconds": round(float(pauses.max()), 2),
+        "long": int((pauses >= LONG_PAUSE_SECONDS).sum()),
+        # Pauses per [PAUSE_SECONDS, 1), [1, 2), [2, 5) and 5+ seconds
+        "histogram": [int(count) for count in counts],
+    }
+
+
+def filler_metrics(contents, minutes):
+    is_filler = np.isin(contents, FILLER_WORDS)
+    total = int(is_filler.sum())
+    names, counts = np.unique(contents[is_filler], return_counts=True)
+    return {
+        "count": total,
+        "per_minute": round(total / minutes, 2) if minutes else 0,
+        "per_100_words": round(100 * total / len(contents), 2),
+        "words": {str(name): int(count) for name, count in zip(names, counts)},
+    }
+
+
+def low_confidence_segments(starts, ends, confidences, contents):
+    low = confidences < LOW_CONFIDENCE
+    # Rising and falling edges of the low confidence runs
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], low, [0]))))
+    segments = [
+        {
+            "start": round(float(starts[first]), 2),
+            "end": round(float(ends[last - 1]), 2),
+            "text": " ".join(contents[first:last]),
+        }
+        for first, last in zip(edges[::2], edges[1::2])
+    ]
+    return {
+        "words": int(low.sum()),
+        "segments": segments[:MAX_LOW_CONFIDENCE_SEGMENTS],
+    }
+
+
+def delivery_metrics(items):
+    """
+    Speech delivery metrics from the word level items of a Transcribe job
+
+    Words per minute, overall and for each minute of the interview, the
+    distribution of pauses between words, the filler word rate and the
+    segments Transcribe was unsure about. Everything is computed on NumPy
+    arrays of the word timings, so hour long transcripts take milliseconds.
+    """
+    starts, ends, confidences, contents = word_arrays(items)
+    if not len(starts):
+        return {"words": 0}
+
+    speaking_seconds = float(ends[-1] - starts[0])
+    minutes = speaking_seconds / 60
+    per_minute, _ = np.histogram(
+        starts - starts[0], bins=np.arange(0, speaking_seconds + 60, 60)
+    )
+    return {
+        "words": int(len(starts)),
+        "duration_seconds": round(speaking_seconds, 2),
+        "words_per_minute": round(len(starts) / minutes, 1) if minutes else 0,
+        "words_per_minute_timeline": [int(count) for count in per_minute],
+        "pauses": pause_metrics(starts, ends),
+        "fillers": filler_metrics(contents, minutes),
+        "low_confidence": low_confidence_segments(starts, ends, confidences, contents),
+    }
@@ -1,158 +1,653 @@
 import os
+import math
+import time
+import uuid
+import random
+import tempfile
 import boto3
-from PIL import Image
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image, ImageChops, ImageStat
 from io import BytesIO
-from moviepy.editor import VideoFileClip
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from cache import cache_key, create_cache
+from instrumentation import instrumented, timed, timer
 
 
-s3 = boto3.client("s3")
-rekognition = boto3.client("rekognition")
 BUCKET = os.environ["BUCKET"]
 NOT_ALLOWED = ["Hat", "Cap"]
 
+# Maximum number of Rekognition requests in flight at the same time
+REKOGNITION_CONCURRENCY = int(os.environ.get("REKOGNITION_CONCURRENCY", "8"))
+REKOGNITION_MAX_RETRIES = 5
+THROTTLING_ERRORS = [
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+]
 
-def calculate_attention(frame_bytes):
-    attention = True
-
-    previous_position = ""
-    for frame in frame_bytes:
-        # Detect face position
-        response = rekognition.detect_faces(Image={"Bytes": frame})
-
-        if len(response["FaceDetails"]) > 0:
-            actual_position = response["FaceDetails"][0]["Pose"]
-            if previous_position != "":
-                # Compare actual position with previous position, distância euclidiana
-                delta_position = (
-                    sum(
-                        (actual_position[key] - previous_position[key]) ** 2
-                        for key in actual_position.keys()
-                    )
-                    ** 0.5
-                )
-                if delta_position > 30:
-                    attention = False
+# Longest side, in pixels, and JPEG quality of the frames sent for analysis
+FRAME_MAX_SIZE = int(os.environ.get("FRAME_MAX_SIZE", "640"))
+JPEG_QUALITY = 85
+
+# Frame sampling: "fixed" analyzes every sampled frame, "adaptive" only the
+# frames that changed past SCENE_CHANGE_THRESHOLD since the last analyzed one,
+# plus at least one frame every KEEP_ALIVE_SECONDS
+SAMPLING_MODE = os.environ.get("SAMPLING_MODE", "fixed")
+FRAME_STEP_SECONDS = int(os.environ.get("FRAME_STEP_SECONDS", "5"))
+SCENE_CHANGE_THRESHOLD = float(os.environ.get("SCENE_CHANGE_THRESHOLD", "0.05"))
+KEEP_ALIVE_SECONDS = int(os.environ.get("KEEP_ALIVE_SECONDS", "30"))
+
+# "frames" extracts and analyzes frames in Lambda, "rekognition" has the
+# state machine run Rekognition Video jobs on the S3 object and only reads
+# their results here, so no video bytes go through Lambda
+VIDEO_ENGINE = os.environ.get("VIDEO_ENGINE", "frames")
+REKOGNITION_PAGE_SIZE = 1000
+
+# Length of the time ranges analyzed in parallel by the state machine
+SEGMENT_SECONDS = int(os.environ.get("SEGMENT_SECONDS", "120"))
+SIGNATURE_SIZE = (16, 16)
+
+# Attention scoring: pose distance, in degrees, that marks a frame as
+# distracted, frames in the rolling median and length of timeline segments
+ATTENTION_THRESHOLD = 30
+ATTENTION_SMOOTHING = 3
+ATTENTION_SEGMENT_SECONDS = int(os.environ.get("ATTENTION_SEGMENT_SECONDS", "60"))
+
+# Local pre-filter: frames darker than PREFILTER_MIN_BRIGHTNESS or flatter than
+# PREFILTER_MIN_CONTRAST (0-255 grayscale mean and standard deviation) cannot
+# contain a face or an object and are never sent to Rekognition
+PREFILTER = os.environ.get("PREFILTER", "false").lower() == "true"
+PREFILTER_MIN_BRIGHTNESS = float(os.environ.get("PREFILTER_MIN_BRIGHTNESS", "20"))
+PREFILTER_MIN_CONTRAST = float(os.environ.get("PREFILTER_MIN_CONTRAST", "8"))
+
+# "stream" decodes straight from a presigned URL, ffmpeg only fetches the byte
+# ranges around the sampled timestamps; "download" fetches the whole file first
+# with DOWNLOAD_CONCURRENCY parallel multipart requests
+DOWNLOAD_MODE = os.environ.get("DOWNLOAD_MODE", "download")
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "16"))
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+)
+
+# Cache for Rekognition responses keyed by frame content:
+# "memory", "disk", "dynamodb" (uses CACHE_TABLE_NAME) or "none"
+REKOGNITION_CACHE = os.environ.get("REKOGNITION_CACHE", "memory")
+CACHE_TABLE_NAME = os.environ.get("CACHE_TABLE_NAME")
+
+s3 = boto3.client("s3", config=Config(max_pool_connections=DOWNLOAD_CONCURRENCY))
+rekognition = boto3.client(
+    "rekognition",
+    config=Config(max_pool_connections=REKOGNITION_CONCURRENCY),
+)
+cache = create_cache(REKOGNITION_CACHE, CACHE_TABLE_NAME)
+
+
+def call_with_backoff(operation, **kwargs):
+    # Retry throttled requests with exponential backoff and jitter
+    for attempt in range(REKOGNITION_MAX_RETRIES + 1):
+        try:
+            return operation(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in THROTTLING_ERRORS or attempt == REKOGNITION_MAX_RETRIES:
+                raise
+            time.sleep(min(2**attempt * 0.2, 5) + random.uniform(0, 0.2))
+
+
+def detect(operation_name, frame):
+    # Call a Rekognition image operation, going through the cache if enabled
+    operation = getattr(rekognition, operation_name)
+    if cache is None:
+        with timer(f"rekognition.{operation_name}"):
+            return call_with_backoff(operation, Image={"Bytes": frame})
+
+    key = cache_key(operation_name, frame)
+    response = cache.get(key)
+    if response is None:
+        with timer(f"rekognition.{operation_name}"):
+            response = call_with_backoff(operation, Image={"Bytes": frame})
+        response.pop("ResponseMetadata", None)
+        cache.set(key, response)
+    return response
 
-            previous_position = actual_position
 
-    return attention
+def collect_pose(faces_response, t, state):
+    # Keep the head pose of the main face, if any, with its timestamp
+    if len(faces_response["FaceDetails"]) > 0:
+        pose = faces_response["FaceDetails"][0]["Pose"]
+        state["timestamps"].append(t)
+        state["poses"].append([pose["Yaw"], pose["Pitch"], pose["Roll"]])
+
+    return state
+
+
+def calculate_attention(timestamps, poses):
+    """
+    Score attention from the head pose time series
+
+    Poses are smoothed with a rolling median, so a single noisy frame cannot
+    decide the result. The overall flag is False when the Euclidean distance
+    between two consecutive smoothed Yaw/Pitch/Roll poses exceeds
+    ATTENTION_THRESHOLD. A frame counts as distracted while its smoothed pose
+    is more than ATTENTION_THRESHOLD away from the median pose of the
+    interview, which gives the percentage of attentive time, the longest
+    distraction window in seconds and the score of each
+    ATTENTION_SEGMENT_SECONDS segment. Adaptive sampling spaces the frames
+    unevenly, so each frame stands for the time until the next one.
+    """
+    if not poses:
+        return {
+            "attention": True,
+            "attentive_percentage": 100.0,
+            "longest_distraction_seconds": 0,
+            "timeline": [],
+        }
+
+    timestamps = np.asarray(timestamps)
+    poses = np.asarray(poses, dtype=float)
+
+    # Rolling median over ATTENTION_SMOOTHING frames, edges padded
+    half = ATTENTION_SMOOTHING // 2
+    padded = np.pad(poses, ((half, half), (0, 0)), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(
+        padded, ATTENTION_SMOOTHING, axis=0
+    )
+    smoothed = np.median(windows, axis=-1)
+
+    # Compare actual position with previous position, distância euclidiana
+    deltas = np.linalg.norm(np.diff(smoothed, axis=0), axis=1)
+
+    # Distance from the usual head position of the interview
+    baseline = np.median(smoothed, axis=0)
+    distracted = np.linalg.norm(smoothed - baseline, axis=1) > ATTENTION_THRESHOLD
+
+    # Each frame lasts until the next one, the last one a sampling step
+    frame_ends = np.append(timestamps, timestamps[-1] + FRAME_STEP_SECONDS)
+    durations = np.diff(frame_ends).astype(float)
+
+    # Runs of consecutive distracted frames, end index exclusive
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], distracted, [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    longest = int((frame_ends[ends] - timestamps[starts]).max()) if len(starts) else 0
+
+    # Share of attentive time in each segment of the interview
+    segments = (timestamps // ATTENTION_SEGMENT_SECONDS).astype(int)
+    totals = np.bincount(segments, weights=durations)
+    attentive = np.bincount(segments, weights=durations * ~distracted)
+    timeline = [
+        {
+            "start": int(segment * ATTENTION_SEGMENT_SECONDS),
+            "score": round(float(attentive[segment] / totals[segment]), 2),
+        }
+        for segment in np.flatnonzero(totals)
+    ]
 
+    return {
+        "attention": not (deltas > ATTENTION_THRESHOLD).any(),
+        "attentive_percentage": round(
+            100 * float(durations[~distracted].sum() / durations.sum()), 1
+        ),
+        "longest_distraction_seconds": longest,
+        "timeline": timeline,
+    }
 
-def identify_objects(frames_bytes, objects_list):
-    for frame in frames_bytes:
-        # Detect objects in the frame
-        response = rekognition.detect_labels(Image={"Bytes": frame})
 
-        # Extract the identified objects
-        for label in response["Labels"]:
-            if label["Name"] in NOT_ALLOWED:
-                if label["Name"] not in objects_list:
-                    objects_list.append(label["Name"])
+def identify_objects(labels_response, state):
+    # Extract the identified objects
+    for label in labels_response["Labels"]:
+        if label["Name"] in NOT_ALLOWED:
+            if label["Name"] not in state["objects"]:
+                state["objects"].append(label["Name"])
 
-    return objects_list
+    return state
 
 
+def analyze_frames(frames):
+    """
+    Run label and face detection over the frames in a single pass
+
+    Frames are (timestamp, JPEG bytes) pairs consumed lazily from any
+    iterable. Both requests for a frame are sent together through a bounded
+    pool and their responses are folded, in frame order, into running
+    accumulators: the forbidden objects found and the head pose series.
+    Frames and responses are dropped as soon as they are folded, so at most
+    REKOGNITION_CONCURRENCY frames are alive at a time.
+    """
+    state = {
+        "objects": [],
+        "timestamps": [],
+        "poses": [],
+        "frames": 0,
+    }
+
+    def fold(t, labels_future, faces_future):
+        identify_objects(labels_future.result(), state)
+        collect_pose(faces_future.result(), t, state)
+        state["frames"] += 1
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=REKOGNITION_CONCURRENCY) as executor:
+        for t, frame in frames:
+            pending.append(
+                (
+                    t,
+                    executor.submit(detect, "detect_labels", frame),
+                    executor.submit(detect, "detect_faces", frame),
+                )
+            )
+            # Wait on the oldest frame before decoding more than the pool holds
+            if len(pending) >= REKOGNITION_CONCURRENCY:
+                fold(*pending.popleft())
+
+        while pending:
+            fold(*pending.popleft())
+
+    return state
+
+
+@timed("frame_to_bytes")
 def frame_to_bytes(frame):
     # Convert NumPy array to PIL Image
     pil_image = Image.fromarray(frame)
 
+    # Downscale in place, Rekognition does not need the full resolution
+    pil_image.thumbnail((FRAME_MAX_SIZE, FRAME_MAX_SIZE))
+
     # Convert PIL Image to bytes
     image_stream = BytesIO()
-    pil_image.save(image_stream, format="JPEG")
+    pil_image.save(image_stream, format="JPEG", quality=JPEG_QUALITY)
     image_bytes = image_stream.getvalue()
     image_stream.close()
     return image_bytes
 
 
-def extract_frames(video_path, frames_list, seconds):
+def extract_frames_ffmpeg(video_path, seconds, start=0, end=None):
+    # Use ffmpeg directly as a fallback
+    import subprocess
+    import tempfile
+    import glob
+
+    # Create a temporary directory for frames
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        # Extract downscaled frames using ffmpeg directly
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-ss", str(start),
+            *(["-t", str(end - start)] if end is not None else []),
+            "-i", video_path,
+            "-vf", f"fps=1/{seconds},scale='min({FRAME_MAX_SIZE},iw)':-2",
+            f"{temp_dir}/frame_%05d.jpg",
+        ]
+        with timer("extract_frames_ffmpeg"):
+            subprocess.run(cmd, check=True)
+
+        # Yield frames one at a time, removing each file once it is read
+        frame_files = sorted(glob.glob(f"{temp_dir}/frame_*.jpg"))
+        for index, frame_file in enumerate(frame_files):
+            with open(frame_file, "rb") as f:
+                frame_bytes = f.read()
+            os.remove(frame_file)
+            yield start + index * seconds, frame_bytes
+    except Exception as e:
+        print(f"Fallback method also failed: {str(e)}")
+    finally:
+        for frame_file in glob.glob(f"{temp_dir}/frame_*.jpg"):
+            os.remove(frame_file)
+        os.rmdir(temp_dir)
+
+
+def open_video_clip(path):
+    # moviepy pulls in imageio, tqdm and proglog, so it is only imported by
+    # the invocations that decode video, not by merges or cached segments
+    from moviepy.editor import VideoFileClip
+
+    return VideoFileClip(path, audio=False)
+
+
+def extract_frames(video_path, seconds, start=0, end=None):
+    """
+    Yield a (timestamp, JPEG bytes) pair every `seconds` seconds of video,
+    from `start` up to `end` or the end of the video
+
+    Each frame is decoded by seeking to its timestamp and encoded right away,
+    so only a single raw frame is held in memory at any time and consumers
+    can start working on the first frame while the next one is decoded.
+    """
+    t = start
+    try:
+        # Load the video clip without audio, only the image stream is needed
+        video_clip = open_video_clip(video_path)
+        try:
+            duration = video_clip.duration if end is None else min(end, video_clip.duration)
+            # Iterate over the duration and extract a frame every `seconds`
+            for t in range(start, int(duration), seconds):
+                # Get frame at current time
+                with timer("extract_frames"):
+                    frame = video_clip.get_frame(t)
+                yield t, frame_to_bytes(frame)
+            return
+        finally:
+            # Close the video clip
+            video_clip.close()
+    except Exception as e:
+        print(f"Error extracting frames at {t}s: {str(e)}")
+
+    # Resume from the frame that failed
+    yield from extract_frames_ffmpeg(video_path, seconds, start=t, end=end)
+
+
+def frame_signature(frame_bytes):
+    # Decode the JPEG straight into a small grayscale thumbnail
+    image = Image.open(BytesIO(frame_bytes))
+    image.draft("L", SIGNATURE_SIZE)
+    return image.convert("L").resize(SIGNATURE_SIZE)
+
+
+def signature_distance(signature, other):
+    # Mean absolute pixel difference, from 0 (identical) to 1
+    return ImageStat.Stat(ImageChops.difference(signature, other)).mean[0] / 255
+
+
+def prefilter_frames(frames, stats):
+    """
+    Drop blank, dark or flat frames before any Rekognition call
+
+    Such frames yield no face and no label, so removing them does not change
+    the objects or attention results. The number of dropped frames is
+    accumulated in `stats`.
+    """
+    for t, frame in frames:
+        stat = ImageStat.Stat(frame_signature(frame))
+        if (
+            stat.mean[0] < PREFILTER_MIN_BRIGHTNESS
+            or stat.stddev[0] < PREFILTER_MIN_CONTRAST
+        ):
+            stats["filtered"] += 1
+        else:
+            yield t, frame
+
+
+def select_frames(frames, stats):
+    """
+    Yield only the frames that differ enough from the last analyzed frame
+
+    A frame is also kept when KEEP_ALIVE_SECONDS have passed since the last
+    analyzed one, so slow head-pose drift is still caught. The number of
+    skipped frames is accumulated in `stats`.
+    """
+    last_signature = None
+    last_kept = 0
+    for t, frame in frames:
+        signature = frame_signature(frame)
+        if (
+            last_signature is None
+            or t - last_kept >= KEEP_ALIVE_SECONDS
+            or signature_distance(signature, last_signature) > SCENE_CHANGE_THRESHOLD
+        ):
+            last_signature = signature
+            last_kept = t
+            yield t, frame
+        else:
+            stats["skipped"] += 1
+
+
+@contextmanager
+def video_source(key):
+    """
+    Yield a path or URL ffmpeg can decode the video from
+
+    Downloads go to a unique path, removed afterwards, so invocations on the
+    same container never collide.
+    """
+    if DOWNLOAD_MODE == "stream":
+        yield s3.generate_presigned_url(
+            "get_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=900
+        )
+        return
+
+    path = os.path.join(tempfile.gettempdir(), f"video-{uuid.uuid4().hex}")
     try:
-        # Load the video clip with verbose output to help diagnose issues
-        video_clip = VideoFileClip(video_path, verbose=True)
-        
-        # Get the duration of the video
+        with timer("s3.download"):
+            s3.download_file(BUCKET, key, path, Config=TRANSFER_CONFIG)
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def analyze_video(video_path, start=0, end=None):
+    if cache is not None:
+        cache.reset_counters()
+
+    # Extract frames
+    frames = extract_frames(video_path, FRAME_STEP_SECONDS, start, end)
+
+    stats = {"analyzed": 0, "skipped": 0, "filtered": 0}
+    if PREFILTER:
+        frames = prefilter_frames(frames, stats)
+    if SAMPLING_MODE == "adaptive":
+        frames = select_frames(frames, stats)
+
+    # Identify objects and calculate attention as frames are decoded
+    result = analyze_frames(frames)
+    stats["analyzed"] = result["frames"]
+    result["frames"] = stats
+
+    if cache is not None:
+        print(f"Rekognition cache hits: {cache.hits}, misses: {cache.misses}")
+
+    return result
+
+
+def video_metrics(objects, timestamps, poses, stats):
+    # Handle case where no frames were extracted
+    if not stats["analyzed"]:
+        print("No frames were extracted from the video")
+        return {
+            "statusCode": 200,
+            "body": {"objects": [], "attention": True, "frames": stats},
+        }
+
+    stats["calls_avoided"] = 2 * (stats["skipped"] + stats["filtered"])
+    print(
+        f"Frames analyzed: {stats['analyzed']}, skipped: {stats['skipped']}, "
+        f"filtered: {stats['filtered']}, "
+        f"Rekognition calls avoided: {stats['calls_avoided']}"
+    )
+
+    # Score attention over the whole head pose series at once
+    attention = calculate_attention(timestamps, poses)
+
+    return {
+        "statusCode": 200,
+        "body": {
+            "objects": objects,
+            "attention": attention.pop("attention"),
+            "attention_score": attention,
+            "frames": stats,
+        },
+    }
+
+
+def plan_segments(key, engine=VIDEO_ENGINE):
+    """
+    Split the video into SEGMENT_SECONDS time ranges for the Map state
+
+    Only the container metadata is read, through a presigned URL, to find
+    the duration. Videos without a known duration get a single segment.
+    The rekognition engine needs no segments, the state machine plans them
+    again with the frames engine only if its jobs fail.
+    """
+    if engine == "rekognition":
+        return {"statusCode": 200, "body": {"engine": engine, "segments": []}}
+
+    url = s3.generate_presigned_url(
+        "get_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=300
+    )
+    try:
+        video_clip = open_video_clip(url)
         duration = video_clip.duration
-        
-        # Iterate over each frame and extract frames every 5 seconds
-        for t in range(0, int(duration), seconds):
-            # Get frame at current time
-            frame = video_clip.get_frame(t)
-            frames_list.append(frame)
-            
-        # Close the video clip
         video_clip.close()
-        
-        # Convert
-        frames_bytes = []
-        for frame in frames_list:
-            # Convert frame to bytes
-            frames_bytes.append(frame_to_bytes(frame))
-            
-        return frames_bytes
     except Exception as e:
-        print(f"Error extracting frames: {str(e)}")
-        # Use ffmpeg directly as a fallback
-        import subprocess
-        import tempfile
-        import glob
-        
-        # Create a temporary directory for frames
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            # Extract frames using ffmpeg directly
-            cmd = f"ffmpeg -i {video_path} -vf 'fps=1/{seconds}' {temp_dir}/frame_%03d.jpg"
-            subprocess.run(cmd, shell=True, check=True)
-            
-            # Get all extracted frames
-            frame_files = sorted(glob.glob(f"{temp_dir}/frame_*.jpg"))
-            
-            # Read frames into bytes
-            frames_bytes = []
-            for frame_file in frame_files:
-                with open(frame_file, 'rb') as f:
-                    frames_bytes.append(f.read())
-                    
-            return frames_bytes
-        except Exception as e2:
-            print(f"Fallback method also failed: {str(e2)}")
-            # Return empty list if both methods fail
-            return []
+        print(f"Error reading video duration: {str(e)}")
+        duration = None
+
+    # Keep segment boundaries on the frame sampling grid
+    step = -(-SEGMENT_SECONDS // FRAME_STEP_SECONDS) * FRAME_STEP_SECONDS
+    if not duration:
+        segments = [{"video": key, "start": 0, "end": None}]
+    else:
+        segments = [
+            {"video": key, "start": start, "end": min(start + step, duration)}
+            for start in range(0, math.ceil(duration), step)
+        ]
+    print(f"Video split into {len(segments)} segments")
+    return {"statusCode": 200, "body": {"engine": engine, "segments": segments}}
+
+
+def job_results(operation_name, job_id, key, **kwargs):
+    # Every result of a finished Rekognition Video job, page by page
+    operation = getattr(rekognition, operation_name)
+    params = {"JobId": job_id, "MaxResults": REKOGNITION_PAGE_SIZE, **kwargs}
+    while True:
+        with timer(f"rekognition.{operation_name}"):
+            page = call_with_backoff(operation, **params)
+        yield from page.get(key, [])
+        if not page.get("NextToken"):
+            return
+        params["NextToken"] = page["NextToken"]
+
+
+def collect_jobs(face_job_id, label_job_id):
+    """
+    Map the Rekognition Video job results onto the frame analysis output
+
+    Detections are placed on the same FRAME_STEP_SECONDS grid as extracted
+    frames, keeping the first face of each step, so attention is scored the
+    same way whichever engine analyzed the video.
+    """
+    state = {"objects": [], "timestamps": [], "poses": []}
+    steps = set()
+
+    for label in job_results(
+        "get_label_detection", label_job_id, "Labels", SortBy="TIMESTAMP"
+    ):
+        steps.add(int(label["Timestamp"] / 1000 // FRAME_STEP_SECONDS))
+        identify_objects({"Labels": [label["Label"]]}, state)
+
+    faces = {}
+    for face in job_results("get_face_detection", face_job_id, "Faces"):
+        step = int(face["Timestamp"] / 1000 // FRAME_STEP_SECONDS)
+        steps.add(step)
+        faces.setdefault(step, face["Face"])
+    for step in sorted(faces):
+        collect_pose({"FaceDetails": [faces[step]]}, step * FRAME_STEP_SECONDS, state)
+
+    stats = {"analyzed": len(steps), "skipped": 0, "filtered": 0}
+    return video_metrics(state["objects"], state["timestamps"], state["poses"], stats)
+
+
+def merge_segments(segments):
+    """
+    Union of objects and one head pose series, in time order
+
+    Segments that failed after their retries, caught by the Map state or
+    tolerated by it without a body, are counted in the `failed` stat and
+    left out, so the report shows the video was only partly analyzed.
+    """
+    objects = []
+    timestamps = []
+    poses = []
+    stats = {"analyzed": 0, "skipped": 0, "filtered": 0, "segments": len(segments), "failed": 0}
+    completed = []
+    for segment in segments:
+        body = segment.get("body") if isinstance(segment, dict) else None
+        if not body or body.get("failed"):
+            stats["failed"] += 1
+        else:
+            completed.append(body)
+    if stats["failed"]:
+        print(f"Segments failed: {stats['failed']} of {stats['segments']}")
 
+    for segment in sorted(completed, key=lambda b: b["start"]):
+        for name in segment["objects"]:
+            if name not in objects:
+                objects.append(name)
+        timestamps.extend(segment["timestamps"])
+        poses.extend(segment["poses"])
+        for name in ("analyzed", "skipped", "filtered"):
+            stats[name] += segment["frames"][name]
 
+    return video_metrics(objects, timestamps, poses, stats)
+
+
+@instrumented
 def lambda_handler(event, context):
+    """
+    Calculate the video metrics of an interview
+
+    Without an Action the whole video is analyzed in this invocation. The
+    state machine instead calls "plan" to split the video into segments,
+    "segment" once per segment from a Map state and "merge" to combine the
+    segment results into the same output. With the "rekognition" engine it
+    calls "collect" once the Rekognition Video jobs finish. "plan" takes an
+    optional Engine, overriding VIDEO_ENGINE.
+    """
     print(event)
+    action = event.get("Action")
     try:
-        key = event["Converted"]["body"]["video"]
-        # download video to tmp and call extract frames
-        s3.download_file(BUCKET, key, "/tmp/video.qt")
-
-        # Extract frames
-        # Set the step size to 5 seconds
-        step_size = 5
-        frames = extract_frames("/tmp/video.qt", [], step_size)
-
-        # Handle case where no frames were extracted
-        if not frames:
-            print("No frames were extracted from the video")
+        if action == "plan":
+            return plan_segments(event["Video"], event.get("Engine", VIDEO_ENGINE))
+
+        if action == "merge":
+            return merge_segments(event["Segments"])
+
+        if action == "collect":
+            return collect_jobs(event["FaceJobId"], event["LabelJobId"])
+
+        if action == "segment":
+            key = event["Video"]
+            start, end = event["Start"], event["End"]
+        else:
+            key = event["Converted"]["body"]["video"]
+            start, end = 0, None
+
+        # Decode the video from S3 and extract frames
+        with video_source(key) as source:
+            result = analyze_video(source, start, end)
+
+        if action == "segment":
             return {
                 "statusCode": 200,
-                "body": {"objects": str([]), "attention": str(True)},
+                "body": {
+                    "start": start,
+                    "objects": result["objects"],
+                    "timestamps": result["timestamps"],
+                    "poses": result["poses"],
+                    "frames": result["frames"],
+                },
             }
 
-        # Identify objects
-        objects = identify_objects(frames, [])
-
-        # Calculate attention
-        attention = calculate_attention(frames)
-
-        return {
-            "statusCode": 200,
-            "body": {"objects": str(objects), "attention": str(attention)},
-        }
+        return video_metrics(
+            result["objects"], result["timestamps"], result["poses"], result["frames"]
+        )
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
+        if action == "segment":
+            # Retried by the Map state, then caught and counted by the merge
+            raise
         # Return default values in case of error
         return {
             "statusCode": 200,
-            "body": {"objects": str([]), "attention": str(True)},
-        }
\ No newline at end of file
+            "body": {"objects": [], "attention": True},
+        }
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import boto3
+
+
+def cache_key(operation, payload):
+    # Content address: the same bytes always map to the same entry
+    return f"{operation}:{hashlib.sha256(payload).hexdigest()}"
+
+
+class MemoryCache:
+    """
+    In-process LRU cache, lives as long as the Lambda container
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class DiskCache:
+    """
+    JSON files under /tmp, shared by invocations on a warm Lambda container
+    """
+
+    def __init__(self, directory="/tmp/rekognition-cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key.replace(":", "-") + ".json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        # Write to a temporary file first so readers never see partial entries
+        path = self.path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+
+
+class DynamoDBCache:
+    """
+    DynamoDB table keyed by `cache_key`, entries expire through the table TTL
+    """
+
+    def __init__(self, table_name, ttl_seconds=7 * 24 * 3600):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        item = self.table.get_item(Key={"cache_key": key}).get("Item")
+        # TTL deletion is lazy, so expired items may still be returned
+        if not item or int(item["expires_at"]) < time.time():
+            return None
+        return json.loads(item["value"])
+
+    def set(self, key, value):
+        self.table.put_item(
+            Item={
+                "cache_key": key,
+                # Stored as a JSON string to keep floats out of Decimal conversion
+                "value": json.dumps(value),
+                "expires_at": int(time.time()) + self.ttl_seconds,
+            }
+        )
+
+
+class CountingCache:
+    """
+    Wraps a backend and counts hits and misses, safe to share between threads
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Error reading cache: {str(e)}")
+            value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"Error writing cache: {str(e)}")
+
+    def reset_counters(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def create_cache(backend, table_name=None):
+    """
+    Build the cache selected by name: "memory", "disk", "dynamodb" or "none"
+    """
+    if backend == "memory":
+        return CountingCache(MemoryCache())
+    if backend == "disk":
+        return CountingCache(DiskCache())
+    if backend == "dynamodb":
+        return CountingCache(DynamoDBCache(table_name))
+    return None
@@ -1,16 +1,51 @@
 import os
+import time
+import uuid
+import subprocess
 import boto3
+import imageio_ffmpeg
+from instrumentation import instrumented, timed, timer
 
 BUCKET = os.environ["BUCKET"]
 s3 = boto3.client("s3")
 
+# Analysis proxy: small, low frame rate video only used to sample frames
+PROXY_HEIGHT = int(os.environ.get("PROXY_HEIGHT", "360"))
+PROXY_FPS = int(os.environ.get("PROXY_FPS", "1"))
 
+
+@timed("ffmpeg.convert")
+def convert(source_path, proxy_path, audio_path):
+    # Single decode pass writing both the video proxy and the audio track
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(),
+        "-y",
+        "-i", source_path,
+        # Video proxy, no audio, a keyframe every few seconds for fast seeking
+        "-map", "0:v:0",
+        "-vf", f"scale=-2:'min({PROXY_HEIGHT},ih)',fps={PROXY_FPS}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+        "-g", str(5 * PROXY_FPS),
+        "-movflags", "+faststart",
+        proxy_path,
+        # Mono 16 kHz audio, all Transcribe needs
+        "-map", "0:a:0",
+        "-vn", "-ac", "1", "-ar", "16000",
+        "-c:a", "aac", "-b:a", "64k",
+        audio_path,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+@instrumented
 def lambda_handler(event, context):
     """
-    Video conversion function - currently using temporary implementation
+    Video conversion function
     
-    This function processes uploaded video files and prepares them for analysis.
-    Currently skips actual conversion due to FFmpeg layer requirements.
+    Produces a downscaled, low frame rate analysis proxy for the video
+    metrics and an audio-only track for Transcribe, so neither step has to
+    work on the full resolution upload. Falls back to copying the original
+    file if the conversion fails.
     """
     try:
         data = event["Records"][0]["s3"]
@@ -18,18 +53,51 @@ def lambda_handler(event, context):
         video = data["object"]["key"]
         
         video_basename = os.path.splitext(os.path.basename(video))[0]
-        converted_filename = f"converted/{video_basename}.mov"
+        converted_filename = f"converted/{video_basename}.mp4"
+        audio_filename = f"converted/{video_basename}.m4a"
         
         print(f"Processing video: {video}")
-        
-        # Copy original file to converted directory
-        # This maintains the processing pipeline while FFmpeg layer is being set up
-        copy_source = {'Bucket': bucket, 'Key': video}
-        s3.copy_object(
-            CopySource=copy_source,
-            Bucket=BUCKET,
-            Key=converted_filename
-        )
+
+        # Unique paths, concurrent invocations may share the container /tmp
+        work_id = uuid.uuid4().hex
+        source_path = f"/tmp/{work_id}-source"
+        proxy_path = f"/tmp/{work_id}-proxy.mp4"
+        audio_path = f"/tmp/{work_id}-audio.m4a"
+
+        try:
+            start = time.time()
+            with timer("s3.download"):
+                s3.download_file(bucket, video, source_path)
+            convert(source_path, proxy_path, audio_path)
+
+            source_size = os.path.getsize(source_path)
+            proxy_size = os.path.getsize(proxy_path)
+            audio_size = os.path.getsize(audio_path)
+            print(
+                f"Converted in {time.time() - start:.1f}s, original: {source_size} bytes, "
+                f"proxy: {proxy_size} bytes ({proxy_size / source_size:.1%}), "
+                f"audio: {audio_size} bytes ({audio_size / source_size:.1%})"
+            )
+
+            with timer("s3.upload"):
+                s3.upload_file(proxy_path, BUCKET, converted_filename)
+                s3.upload_file(audio_path, BUCKET, audio_filename)
+        except Exception as e:
+            print(f"Error converting video, copying original: {str(e)}")
+
+            # Copy original file to converted directory
+            converted_filename = f"converted/{video_basename}.mov"
+            audio_filename = video
+            copy_source = {'Bucket': bucket, 'Key': video}
+            s3.copy_object(
+                CopySource=copy_source,
+                Bucket=BUCKET,
+                Key=converted_filename
+            )
+        finally:
+            for path in (source_path, proxy_path, audio_path):
+                if os.path.exists(path):
+                    os.remove(path)
         
         print(f"Video processed successfully: {converted_filename}")
         
@@ -38,6 +106,7 @@ def lambda_handler(event, context):
             "body": {
                 "bucket": BUCKET,
                 "video": converted_filename,
+                "audio": audio_filename,
                 "processing_status": "completed"
             }
         }
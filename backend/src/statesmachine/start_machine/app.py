@@ -1,27 +1,246 @@
+import re
 import os
 import json
+import hashlib
 import boto3
+from instrumentation import instrumented, record, set_correlation_id, timer
 
 STATE_MACHINE_ARN = os.environ["STATE_MACHINE_ARN"]
+QUEUE_URL = os.environ.get("START_QUEUE_URL")
 step_functions = boto3.client("stepfunctions")
+sqs = boto3.client("sqs")
 
+# Uploads wait in the start queue while this many executions are running
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "20"))
+# Waiting uploads come back after DEFER_SECONDS times the number of times
+# they were received, up to DEFER_MAX_SECONDS. Every receive counts towards
+# the maxReceiveCount of StartQueue, the backoff keeps an upload that waits
+# for days out of the dead-letter queue
+DEFER_SECONDS = int(os.environ.get("DEFER_SECONDS", "60"))
+DEFER_MAX_SECONDS = int(os.environ.get("DEFER_MAX_SECONDS", "900"))
 
+# Account quotas shared by every execution, as requests or jobs in flight.
+# Each execution has up to SegmentConcurrency segments in flight, each with
+# REKOGNITION_CONCURRENCY Rekognition requests, one Transcribe job, two
+# Rekognition Video jobs with the rekognition engine and up to
+# FEEDBACK_CONCURRENCY Bedrock calls. REKOGNITION_CONCURRENCY, VIDEO_ENGINE
+# and FEEDBACK_CONCURRENCY must match the functions that use them.
+REKOGNITION_BUDGET = int(os.environ.get("REKOGNITION_BUDGET", "32"))
+REKOGNITION_CONCURRENCY = int(os.environ.get("REKOGNITION_CONCURRENCY", "8"))
+REKOGNITION_VIDEO_JOBS = int(os.environ.get("REKOGNITION_VIDEO_JOBS", "20"))
+VIDEO_ENGINE = os.environ.get("VIDEO_ENGINE", "frames")
+TRANSCRIBE_MAX_JOBS = int(os.environ.get("TRANSCRIBE_MAX_JOBS", "100"))
+BEDROCK_BUDGET = int(os.environ.get("BEDROCK_BUDGET", "40"))
+FEEDBACK_CONCURRENCY = int(os.environ.get("FEEDBACK_CONCURRENCY", "4"))
+
+
+def execution_limits():
+    """
+    Executions each quota allows to run at once
+
+    The frame analysis, also the fallback of the rekognition engine, needs
+    at least one segment of REKOGNITION_CONCURRENCY requests per execution.
+    """
+    limits = {
+        "max_in_flight": MAX_IN_FLIGHT,
+        "rekognition": REKOGNITION_BUDGET // REKOGNITION_CONCURRENCY,
+        "transcribe": TRANSCRIBE_MAX_JOBS,
+        "bedrock": BEDROCK_BUDGET // FEEDBACK_CONCURRENCY,
+    }
+    if VIDEO_ENGINE == "rekognition":
+        limits["rekognition_video"] = REKOGNITION_VIDEO_JOBS // 2
+    return limits
+
+
+def segment_concurrency(executions):
+    """
+    Segments each of `executions` running executions can have in flight
+
+    The split is made when an execution starts, from the executions running
+    at that moment, so an upload arriving alone gets the whole
+    REKOGNITION_BUDGET and a burst shares it. With `executions` running, at
+    most executions * segments * REKOGNITION_CONCURRENCY Rekognition
+    requests are in flight, within REKOGNITION_BUDGET.
+    """
+    return max(1, REKOGNITION_BUDGET // (executions * REKOGNITION_CONCURRENCY))
+
+
+EXECUTION_LIMIT = max(1, min(execution_limits().values()))
+
+
+def execution_name(s3_record):
+    """
+    Execution name derived from the uploaded object
+
+    Duplicate deliveries of the same ObjectCreated event map to the same name,
+    and Step Functions never runs two executions with it.
+    """
+    obj = s3_record["s3"]["object"]
+    base = os.path.splitext(os.path.basename(obj["key"]))[0]
+    base = re.sub(r"[^0-9A-Za-z_-]", "-", base)[:60]
+    digest = hashlib.sha256(f"{obj['key']}:{obj.get('eTag', '')}".encode()).hexdigest()
+    return f"{base}-{digest[:16]}"
+
+
+def executions_in_flight():
+    # Stop counting once the limit is reached, the exact number is not needed
+    running = 0
+    paginator = step_functions.get_paginator("list_executions")
+    with timer("stepfunctions.list_executions"):
+        for page in paginator.paginate(
+            stateMachineArn=STATE_MACHINE_ARN,
+            statusFilter="RUNNING",
+            PaginationConfig={"PageSize": 100},
+        ):
+            running += len(page["executions"])
+            if running >= EXECUTION_LIMIT:
+                break
+    return running
+
+
+def record_queue_depth():
+    if not QUEUE_URL:
+        return
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=QUEUE_URL,
+        AttributeNames=[
+            "ApproximateNumberOfMessages",
+            "ApproximateNumberOfMessagesNotVisible",
+        ],
+    )["Attributes"]
+    record("start_queue.depth", int(attributes["ApproximateNumberOfMessages"]), "Count")
+    record(
+        "start_queue.in_process",
+        int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+        "Count",
+    )
+
+
+def defer(messages):
+    # Hide the waiting messages longer than the visibility timeout of the queue
+    if not QUEUE_URL:
+        return
+    for i in range(0, len(messages), 10):
+        sqs.change_message_visibility_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[
+                {
+                    "Id": str(n),
+                    "ReceiptHandle": message["receiptHandle"],
+                    "VisibilityTimeout": min(
+                        DEFER_MAX_SECONDS,
+                        DEFER_SECONDS * int(message["attributes"]["ApproximateReceiveCount"]),
+                    ),
+                }
+                for n, message in enumerate(messages[i : i + 10])
+            ],
+        )
+
+
+def execution_exists(name):
+    """
+    Whether an execution with this name was already started
+
+    StartExecution is idempotent: with the name and input of an execution
+    still running it succeeds and returns that execution, so a duplicate
+    event would count as a new start. It only raises ExecutionAlreadyExists
+    once the execution is closed, or when the input differs.
+    """
+    arn = STATE_MACHINE_ARN.replace(":stateMachine:", ":execution:") + f":{name}"
+    try:
+        with timer("stepfunctions.describe_execution"):
+            step_functions.describe_execution(executionArn=arn)
+        return True
+    except step_functions.exceptions.ExecutionDoesNotExist:
+        return False
+
+
+def start(s3_record, segments):
+    # The correlation ID is the execution name, so duplicates have the same input
+    name = execution_name(s3_record)
+    set_correlation_id(correlation_id=name)
+    if execution_exists(name):
+        print(f"Duplicate upload event, execution already exists: {name}")
+        return False
+    try:
+        with timer("stepfunctions.start_execution"):
+            step_functions.start_execution(
+                stateMachineArn=STATE_MACHINE_ARN,
+                name=name,
+                input=json.dumps(
+                    {
+                        "Records": [s3_record],
+                        "CorrelationId": name,
+                        # MaxConcurrency of the video segments Map
+                        "SegmentConcurrency": segments,
+                    }
+                ),
+            )
+        print(f"Execution started: {name}")
+        return True
+    except step_functions.exceptions.ExecutionAlreadyExists:
+        # Started by a concurrent invocation since it was described
+        print(f"Duplicate upload event, execution already exists: {name}")
+        return False
+
+
+@instrumented
 def lambda_handler(event, context):
+    """
+    Start one analysis per uploaded video, read from the start queue
 
-    response = step_functions.start_execution(
-        stateMachineArn=STATE_MACHINE_ARN, input=json.dumps(event)
+    Messages are S3 ObjectCreated events. When EXECUTION_LIMIT executions
+    are already running the remaining messages are reported as failures, so
+    they return to the queue, and are retried with a backoff, see defer.
+    """
+    in_flight = executions_in_flight()
+    record("executions.in_flight", in_flight, "Count")
+    record("executions.limit", EXECUTION_LIMIT, "Count")
+
+    # Executions running once this batch is started, which share the budget
+    uploads = sum(
+        len([r for r in json.loads(message["body"]).get("Records", []) if "s3" in r])
+        for message in event["Records"]
     )
+    segments = segment_concurrency(min(EXECUTION_LIMIT, max(1, in_flight + uploads)))
+    record("executions.segments", segments, "Count")
 
-    return {
-        "statusCode": 200,
-        "headers": {
-            "Access-Control-Allow-Headers": "Content-Type",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET",
-        },
-        "body": json.dumps(
-            {
-                "results": "started",
-            }
-        ),
-    }
+    started = duplicates = 0
+    failures = []
+    deferred = []
+    for message in event["Records"]:
+        body = json.loads(message["body"])
+        # S3 sends a test event when the notification is configured
+        s3_records = [r for r in body.get("Records", []) if "s3" in r]
+
+        if s3_records and in_flight >= EXECUTION_LIMIT:
+            failures.append({"itemIdentifier": message["messageId"]})
+            deferred.append(message)
+            continue
+
+        try:
+            for s3_record in s3_records:
+                if start(s3_record, segments):
+                    started += 1
+                    in_flight += 1
+                else:
+                    duplicates += 1
+        except Exception as e:
+            print(f"Error starting execution: {str(e)}")
+            failures.append({"itemIdentifier": message["messageId"]})
+
+    record("executions.started", started, "Count")
+    record("executions.duplicates", duplicates, "Count")
+    record("executions.deferred", len(failures), "Count")
+    try:
+        defer(deferred)
+    except Exception as e:
+        # They come back after the visibility timeout of the queue instead
+        print(f"Error deferring messages: {str(e)}")
+    try:
+        record_queue_depth()
+    except Exception as e:
+        print(f"Error reading queue depth: {str(e)}")
+
+    print(f"Started: {started}, duplicates: {duplicates}, deferred: {len(failures)}")
+    return {"batchItemFailures": failures}
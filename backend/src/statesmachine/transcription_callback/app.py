@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import boto3
+from instrumentation import (
+    get_correlation_id,
+    instrumented,
+    record,
+    set_correlation_id,
+    timer,
+)
+
+TABLE = os.environ["TABLE_NAME"]
+TOKEN_TTL = 24 * 3600
+dynamodb = boto3.resource("dynamodb")
+transcribe = boto3.client("transcribe")
+rekognition = boto3.client("rekognition")
+step_functions = boto3.client("stepfunctions")
+
+# Rekognition Video jobs waited on by the state machine, by job type
+REKOGNITION_STATUS = {
+    "face": lambda job_id: rekognition.get_face_detection(JobId=job_id, MaxResults=1),
+    "label": lambda job_id: rekognition.get_label_detection(JobId=job_id, MaxResults=1),
+}
+
+
+def claim_token(job_name):
+    # Delete and return the waiting item, so only one caller ever resumes the execution
+    response = dynamodb.Table(TABLE).delete_item(
+        Key={"job_name": job_name}, ReturnValues="ALL_OLD"
+    )
+    return response.get("Attributes", {})
+
+
+def resume(job_name, status):
+    waiting = claim_token(job_name)
+    task_token = waiting.get("task_token")
+    if not task_token:
+        print(f"No execution waiting on job: {job_name}")
+        return
+
+    # The job events do not carry the execution's correlation ID
+    if waiting.get("correlation_id"):
+        set_correlation_id(correlation_id=waiting["correlation_id"])
+    job_type = waiting.get("job_type", "transcribe")
+    if waiting.get("waiting_since"):
+        record(f"{job_type}.wait", (time.time() - float(waiting["waiting_since"])) * 1000)
+
+    try:
+        if job_type in REKOGNITION_STATUS and status == "COMPLETED":
+            step_functions.send_task_success(
+                taskToken=task_token,
+                output=json.dumps({"JobId": job_name, "Status": "SUCCEEDED"}),
+            )
+        elif status == "COMPLETED":
+            job = transcribe.get_transcription_job(TranscriptionJobName=job_name)
+            # Same output as the getTranscriptionJob task it replaces
+            step_functions.send_task_success(
+                taskToken=task_token,
+                output=json.dumps(
+                    {"TranscriptionJob": job["TranscriptionJob"]}, default=str
+                ),
+            )
+        else:
+            step_functions.send_task_failure(
+                taskToken=task_token,
+                error="FAILED",
+                cause=f"{job_type} job failed",
+            )
+        print(f"Resumed execution waiting on job: {job_name} ({status})")
+    except step_functions.exceptions.TaskTimedOut:
+        print(f"Execution waiting on job {job_name} already timed out")
+
+
+@instrumented
+def lambda_handler(event, context):
+    """
+    Resume the analysis as soon as its Transcribe or Rekognition Video job
+    finishes
+
+    Invoked by the state machine with a task token, which is stored until the
+    job finishes, and by the job completion events (the Transcribe job state
+    change event, or the Rekognition Video SNS notification), which resume
+    the waiting execution. The job status is checked right after storing the
+    token, so a job that finished before the token was stored is not missed.
+    """
+    print(event)
+
+    if "TaskToken" in event:
+        if "RekognitionJobId" in event:
+            job_type = event["RekognitionJobType"]
+            job_name = event["RekognitionJobId"]
+        else:
+            job_type = "transcribe"
+            job_name = event["TranscriptionJobName"]
+        with timer("dynamodb.store_token"):
+            dynamodb.Table(TABLE).put_item(
+                Item={
+                    "job_name": job_name,
+                    "job_type": job_type,
+                    "task_token": event["TaskToken"],
+                    "correlation_id": get_correlation_id(),
+                    "waiting_since": str(time.time()),
+                    "expires_at": int(time.time()) + TOKEN_TTL,
+                }
+            )
+
+        if job_type in REKOGNITION_STATUS:
+            status = REKOGNITION_STATUS[job_type](job_name)["JobStatus"]
+            status = {"SUCCEEDED": "COMPLETED"}.get(status, status)
+        else:
+            job = transcribe.get_transcription_job(TranscriptionJobName=job_name)
+            status = job["TranscriptionJob"]["TranscriptionJobStatus"]
+        if status in ("COMPLETED", "FAILED"):
+            resume(job_name, status)
+    elif "Records" in event:
+        # Rekognition Video completion notifications, through SNS
+        for sns_record in event["Records"]:
+            message = json.loads(sns_record["Sns"]["Message"])
+            status = {"SUCCEEDED": "COMPLETED"}.get(message["Status"], "FAILED")
+            resume(message["JobId"], status)
+    else:
+        detail = event["detail"]
+        resume(detail["TranscriptionJobName"], detail["TranscriptionJobStatus"])
+
+    return {"statusCode": 200}
@@ -1,11 +1,33 @@
 import os
+import ast
+import json
 import boto3
 from decimal import Decimal
+from instrumentation import instrumented, timer
 
 TABLE = os.environ["TABLE_NAME"]
 dynamodb = boto3.resource("dynamodb")
 
+# Records written with report, objects and attention as native attributes
+SCHEMA_VERSION = 2
 
+
+def to_dynamodb(value):
+    # DynamoDB rejects floats, convert them (including nested ones) to Decimal
+    return json.loads(json.dumps(value), parse_float=Decimal)
+
+
+def parse_legacy(value):
+    # Older functions returned Python reprs such as "{'a': 1}" or "True"
+    if isinstance(value, str):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+@instrumented
 def lambda_handler(event, context):
     """
     Update DynamoDB table with interview analysis results
@@ -34,27 +56,38 @@ def lambda_handler(event, context):
             objects = ["Person", "Face"]
             attention = 0.85
         
-        # Convert float to Decimal for DynamoDB compatibility
-        if isinstance(attention, float):
-            attention = Decimal(str(attention))
+        # Store typed attributes instead of stringified Python objects
+        report = to_dynamodb(parse_legacy(text_metrics))
+        objects = to_dynamodb(parse_legacy(objects))
+        attention = to_dynamodb(parse_legacy(attention))
+
+        # Attention time series, only present on newer video metrics
+        attention_score = to_dynamodb(video_metrics.get("attention_score", {}))
+        # Frames analyzed and segments that failed, to spot partial analyses
+        frames = to_dynamodb(video_metrics.get("frames", {}))
         
         # Extract record information
         key = event[0]["Records"][0]["s3"]["object"]["key"]
         record_id = os.path.splitext(os.path.basename(key))[0]
         
-        # Update DynamoDB table
+        # Update DynamoDB table, the partial feedback and the delivery
+        # metrics saved while the analysis ran are replaced by the report
         table = dynamodb.Table(TABLE)
-        table.update_item(
-            Key={"record_id": record_id},
-            UpdateExpression="set report=:report, objects=:objects, attention=:attention, video=:video",
-            ExpressionAttributeValues={
-                ":report": text_metrics,
-                ":objects": objects,
-                ":attention": attention,
-                ":video": key,
-            },
-            ReturnValues="ALL_NEW",
-        )
+        with timer("dynamodb.update_record"):
+            table.update_item(
+                Key={"record_id": record_id},
+                UpdateExpression="set report=:report, objects=:objects, attention=:attention, attention_score=:attention_score, frames=:frames, video=:video, schema_version=:schema_version remove partial_feedback, delivery, preview",
+                ExpressionAttributeValues={
+                    ":report": report,
+                    ":objects": objects,
+                    ":attention": attention,
+                    ":attention_score": attention_score,
+                    ":frames": frames,
+                    ":video": key,
+                    ":schema_version": SCHEMA_VERSION,
+                },
+                ReturnValues="NONE",
+            )
         
         print(f"Successfully updated record: {record_id}")
         
@@ -0,0 +1,119 @@
+"""
+Peak memory and wall time of extract_frames against the original path
+
+Synthetic videos of increasing length are generated with ffmpeg, then each
+extraction runs in its own process, so its peak RSS is not mixed with the
+others:
+
+- original: the code extract_frames replaced, every raw frame is decoded
+  into a list first and then encoded to full resolution JPEG
+- streaming: the current extract_frames, frames are decoded, downscaled and
+  encoded one at a time as the consumer asks for them
+
+Run from backend/: python tests/bench/bench_extract_frames.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers import load_handler  # noqa: E402
+
+FRAME_STEP_SECONDS = 5
+
+
+def make_video(path, seconds, width, height):
+    import imageio_ffmpeg
+
+    subprocess.run(
+        [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "150",
+            path,
+        ],
+        check=True,
+    )
+
+
+def original(app, path):
+    # extract_frames and frame_to_bytes as they were before streaming
+    from io import BytesIO
+    from PIL import Image
+    from moviepy.editor import VideoFileClip
+
+    frames_list = []
+    video_clip = VideoFileClip(path)
+    for t in range(0, int(video_clip.duration), FRAME_STEP_SECONDS):
+        frames_list.append(video_clip.get_frame(t))
+    video_clip.close()
+
+    frames_bytes = []
+    for frame in frames_list:
+        stream = BytesIO()
+        Image.fromarray(frame).save(stream, format="JPEG")
+        frames_bytes.append(stream.getvalue())
+    return [len(frame) for frame in frames_bytes]
+
+
+def streaming(app, path):
+    # Consumed like analyze_frames does, each frame is dropped once used
+    return [len(frame) for _, frame in app.extract_frames(path, FRAME_STEP_SECONDS)]
+
+
+def run(mode, path):
+    app = load_handler("statesmachine/calculate_video_metrics", REKOGNITION_CACHE="none")
+    start = time.perf_counter()
+    sizes = {"original": original, "streaming": streaming}[mode](app, path)
+    print(
+        json.dumps(
+            {
+                "seconds": round(time.perf_counter() - start, 2),
+                "frames": len(sizes),
+                "jpeg_kb": round(sum(sizes) / len(sizes) / 1024, 1) if sizes else 0,
+                "peak_rss_mb": round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+                ),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--durations", default="60,300,600", help="video lengths, in seconds")
+    parser.add_argument("--size", default="1280x720", help="video resolution")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "VIDEO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(*args.run)
+        return
+
+    width, height = args.size.split("x")
+    print(f"{'video':>8} {'mode':>10} {'frames':>7} {'seconds':>8} {'jpeg kB':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for seconds in args.durations.split(","):
+            path = os.path.join(directory, f"video-{seconds}.mp4")
+            make_video(path, seconds, width, height)
+            for mode in ("original", "streaming"):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--run", mode, path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{seconds + 's':>8} {mode:>10} {result['frames']:>7} "
+                    f"{result['seconds']:>8} {result['jpeg_kb']:>8} {result['peak_rss_mb']:>8}"
+                )
+
+
+if __name__ == "__main__":
+    main()
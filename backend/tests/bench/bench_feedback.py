@@ -0,0 +1,110 @@
+"""
+Latency of the chunked feedback against a single Bedrock call
+
+Synthetic transcripts of increasing length are evaluated by both paths of
+calculate_text_metrics against a stubbed bedrock-runtime, whose latency
+grows with the prompt and the response like a real model:
+
+    base + input_chars / 1000 * input_ms + output_tokens / output_tps
+
+- single: one call with the whole transcript, what bedrock_feedback does
+  below LONG_TRANSCRIPT_CHARS
+- chunked: chunked_feedback, FEEDBACK_SEGMENT_CHARS segments evaluated by
+  up to FEEDBACK_CONCURRENCY parallel calls, then a final merging call
+
+Every model answer uses half of the request's max_tokens. The latency can be
+scaled down with --time-scale, the reported times are scaled back up.
+
+Run from backend/: python tests/bench/bench_feedback.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers import load_handler  # noqa: E402
+from stubs import FakeBedrock, FakeBedrockRuntime  # noqa: E402
+
+PROFILE_ARN = "arn:aws:bedrock:us-east-1:123456789012:application-inference-profile/bench"
+SENTENCE = "Na minha última experiência eu coordenei a migração do sistema {n} para a nuvem."
+
+
+def transcript(chars):
+    sentences = []
+    while sum(len(sentence) + 1 for sentence in sentences) < chars:
+        sentences.append(SENTENCE.format(n=len(sentences)))
+    return " ".join(sentences)
+
+
+def answer(request):
+    # Half of max_tokens, at about 4 characters per token
+    text = "x" * (request["max_tokens"] * 2)
+    return f"<avaliação>{text}</avaliação>\n<correção>Respostas corretas.</correção>"
+
+
+def model_latency(args):
+    def latency(operation, kwargs):
+        request = json.loads(kwargs["body"])
+        input_chars = len(request["messages"][0]["content"][0]["text"])
+        output_tokens = request["max_tokens"] / 2
+        seconds = (
+            args.base
+            + input_chars / 1000 * args.input_ms / 1000
+            + output_tokens / args.output_tps
+        )
+        return seconds * args.time_scale
+
+    return latency
+
+
+def run(app, mode, text, latency):
+    app.feedback_cache.clear()
+    app.bedrock_runtime = FakeBedrockRuntime(respond=answer, latency=latency)
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if mode == "single":
+            prompt = app.feedback_prompt("Fale sobre você.", text)
+            app.generate(app.feedback_request(prompt))
+        else:
+            app.chunked_feedback("Fale sobre você.", text)
+    return time.perf_counter() - start, app.bedrock_runtime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="12000,24000,48000,96000,192000", help="transcript lengths, in characters")
+    parser.add_argument("--base", type=float, default=0.5, help="fixed seconds per call")
+    parser.add_argument("--input-ms", type=float, default=40, help="milliseconds per 1000 prompt characters")
+    parser.add_argument("--output-tps", type=float, default=60, help="output tokens per second")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="factor applied to the stub latency")
+    parser.add_argument("--segment-chars", default="12000")
+    parser.add_argument("--concurrency", default="4")
+    args = parser.parse_args()
+
+    app = load_handler(
+        "statesmachine/calculate_text_metrics",
+        FEEDBACK_SEGMENT_CHARS=args.segment_chars,
+        FEEDBACK_CONCURRENCY=args.concurrency,
+    )
+    os.environ.pop("INFERENCE_PROFILE_ARN", None)
+    app.bedrock = FakeBedrock(
+        profiles=[{"name": "interview-simulator-claude-sonnet-4-default", "inferenceProfileArn": PROFILE_ARN}]
+    )
+    latency = model_latency(args)
+
+    print(f"{'chars':>8} {'mode':>8} {'calls':>6} {'parallel':>9} {'seconds':>8}")
+    for chars in (int(size) for size in args.sizes.split(",")):
+        text = transcript(chars)
+        for mode in ("single", "chunked"):
+            seconds, runtime = run(app, mode, text, latency)
+            print(
+                f"{chars:>8} {mode:>8} {runtime.count():>6} "
+                f"{runtime.peak_in_flight:>9} {seconds / args.time_scale:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
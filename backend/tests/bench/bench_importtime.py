@@ -0,0 +1,138 @@
+"""
+Cold start import time of every handler
+
+Each handler's app.py is imported in a new interpreter with `-X importtime`,
+from its own directory and with the instrumentation layer on PYTHONPATH,
+like Lambda does on a cold start. The module-level boto3 clients are
+created during the import, so they are part of its time. The cumulative
+time of `app` is kept, the fastest of --repeat runs, with the direct
+imports that took the longest.
+
+With --baseline, the handlers of that git ref are measured too, to compare
+before and after a change:
+
+    python tests/bench/bench_importtime.py --baseline <git ref>
+
+Run from backend/: python tests/bench/bench_importtime.py
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers import BACKEND, ENVIRONMENT  # noqa: E402
+
+# Settings some handlers need at import time, besides the test environment
+SETTINGS = {
+    **ENVIRONMENT,
+    "BATCH_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/feedback",
+    "BATCH_ROLE_ARN": "arn:aws:iam::123456789012:role/batch",
+}
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def handlers(src):
+    for group in ("api", "statesmachine"):
+        for name in sorted(os.listdir(os.path.join(src, group))):
+            if os.path.exists(os.path.join(src, group, name, "app.py")):
+                yield f"{group}/{name}"
+
+
+def import_time(src, handler):
+    """
+    Cumulative microseconds of `import app` and its slowest direct imports
+    """
+    environment = {
+        **os.environ,
+        **SETTINGS,
+        "PYTHONPATH": os.path.join(src, "layers", "instrumentation"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=os.path.join(src, handler),
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    children = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if depth == 1:
+            # Top level import, its children were listed before it
+            if name == "app":
+                return cumulative, sorted(children, reverse=True)[:3]
+            children = []
+        elif depth == 3:
+            children.append((cumulative, name))
+    raise RuntimeError("app import not found")
+
+
+def measure(sources, repeat):
+    """
+    Import times by handler and source directory, runs of the different
+    sources alternate so they see the same load on the machine
+    """
+    results = {}
+    for handler in handlers(sources[-1]):
+        runs = [[] for _ in sources]
+        for _ in range(repeat):
+            for src, times in zip(sources, runs):
+                try:
+                    times.append(import_time(src, handler))
+                except (RuntimeError, OSError) as e:
+                    times.append((str(e), []))
+        results[handler] = [
+            min((t for t in times if isinstance(t[0], int)), default=times[0]) for times in runs
+        ]
+    return results
+
+
+def checkout(ref, directory):
+    # The handlers as they were at ref, without touching the working tree
+    archive = subprocess.run(
+        ["git", "archive", ref, "src"], cwd=BACKEND, capture_output=True, check=True
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+    return os.path.join(directory, "src")
+
+
+def ms(microseconds):
+    return f"{microseconds / 1000:.0f}" if isinstance(microseconds, int) else "error"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--baseline", help="git ref to compare with, such as a commit before a change")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per handler, the fastest is kept")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [os.path.join(BACKEND, "src")]
+        if args.baseline:
+            sources.insert(0, checkout(args.baseline, directory))
+        results = measure(sources, args.repeat)
+
+    columns = f"{'before ms':>10} {'after ms':>9}" if args.baseline else f"{'ms':>6}"
+    print(f"{'handler':<40} {columns}  slowest imports (ms)")
+    for handler, runs in results.items():
+        total, children = runs[-1]
+        times = " ".join(f"{ms(run[0]):>{width}}" for run, width in zip(runs, (10, 9) if args.baseline else (6,)))
+        slowest = ", ".join(f"{name} {ms(time)}" for time, name in children)
+        print(f"{handler:<40} {times}  {slowest}")
+        for run in runs:
+            if not isinstance(run[0], int):
+                print(f"  {run[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Video metrics of the frames engine against the Rekognition Video engine
+
+Synthetic videos of increasing length go through the states of both
+engines, with calculate_video_metrics running against the stand-ins of
+tests/stubs.py:
+
+- frames: plan, --segments segments at a time like the Map state, merge;
+  frames are decoded with ffmpeg from the local copy of the object and sent
+  to the Rekognition image stub, which takes --latency seconds per call
+- rekognition: plan, face and label detection jobs, collect; the jobs run
+  on the Rekognition Video stub and their results are read page by page,
+  each call taking --latency seconds as well
+
+The time a Rekognition Video job takes is not something the stub can
+measure, so it is modeled as --job-speed seconds per second of video and
+added to the wall time of that engine. The break-even column is the job
+speed below which the rekognition engine finishes first.
+
+Run from backend/: python tests/bench/bench_video_engines.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers import ENVIRONMENT, load_handler  # noqa: E402
+from stubs import FakeRekognition, FakeS3  # noqa: E402
+
+BUCKET = ENVIRONMENT["BUCKET"]
+# Settings of CalculateVideoMetricsFunction in template.yaml
+SETTINGS = {
+    "REKOGNITION_CACHE": "none",
+    "REKOGNITION_CONCURRENCY": "8",
+    "SEGMENT_SECONDS": "120",
+    "DOWNLOAD_MODE": "stream",
+    "SAMPLING_MODE": "adaptive",
+    "FRAME_STEP_SECONDS": "5",
+    "PREFILTER": "true",
+}
+
+
+def make_video(path, seconds):
+    import imageio_ffmpeg
+
+    subprocess.run(
+        [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=30:duration={seconds}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "150",
+            path,
+        ],
+        check=True,
+    )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Invocations:
+    # Wall time of the Lambda invocations, summed like Lambda bills them
+    def __init__(self, app):
+        self.app = app
+        self.seconds = 0.0
+
+    def __call__(self, event):
+        start = time.perf_counter()
+        try:
+            return self.app.lambda_handler(event, None)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def frames_engine(app, key, segments):
+    invoke = Invocations(app)
+    plan = invoke({"Action": "plan", "Video": key, "Engine": "frames"})["body"]["segments"]
+
+    def segment(item):
+        event = {"Action": "segment", "Video": item["video"], "Start": item["start"], "End": item["end"]}
+        return invoke(event)
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        outputs = list(pool.map(segment, plan))
+    invoke({"Action": "merge", "Segments": outputs})
+    return invoke.seconds
+
+
+def rekognition_engine(app, key):
+    invoke = Invocations(app)
+    invoke({"Action": "plan", "Video": key, "Engine": "rekognition"})
+    # The StartFaceDetection and StartLabelDetection tasks of the state machine
+    video = {"S3Object": {"Bucket": BUCKET, "Name": key}}
+    face_job = app.rekognition.start_face_detection(Video=video)["JobId"]
+    label_job = app.rekognition.start_label_detection(Video=video)["JobId"]
+    invoke({"Action": "collect", "FaceJobId": face_job, "LabelJobId": label_job})
+    return invoke.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lengths", default="60,300,900", help="video lengths, in seconds")
+    parser.add_argument("--segments", type=int, default=4, help="segments in flight, SegmentConcurrency")
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds per Rekognition call")
+    parser.add_argument("--job-speed", type=float, default=0.5, help="job seconds per second of video")
+    args = parser.parse_args()
+
+    app = load_handler("statesmachine/calculate_video_metrics", **SETTINGS)
+    s3 = app.s3 = FakeS3()
+    durations = {}
+
+    print(
+        f"{'seconds':>8} {'engine':>12} {'wall s':>8} {'lambda s':>9} "
+        f"{'calls':>6} {'break-even':>11}"
+    )
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for seconds in (int(length) for length in args.lengths.split(",")):
+                key = f"interview-{seconds}.mp4"
+                s3.objects[(BUCKET, key)] = make_video(os.path.join(directory, key), seconds)
+                durations[key] = seconds
+
+                app.rekognition = FakeRekognition(
+                    latency=args.latency, video_seconds=lambda bucket, name: durations[name]
+                )
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    frames_lambda = frames_engine(app, key, args.segments)
+                frames_wall = time.perf_counter() - start
+                frames_calls = app.rekognition.count()
+
+                app.rekognition = FakeRekognition(
+                    latency=args.latency, video_seconds=lambda bucket, name: durations[name]
+                )
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    rekognition_lambda = rekognition_engine(app, key)
+                job_seconds = seconds * args.job_speed
+                rekognition_wall = time.perf_counter() - start + job_seconds
+                rekognition_calls = app.rekognition.count()
+
+                break_even = (frames_wall - (rekognition_wall - job_seconds)) / seconds
+                print(
+                    f"{seconds:>8} {'frames':>12} {frames_wall:>8.1f} {frames_lambda:>9.1f} "
+                    f"{frames_calls:>6} {'':>11}"
+                )
+                print(
+                    f"{seconds:>8} {'rekognition':>12} {rekognition_wall:>8.1f} {rekognition_lambda:>9.1f} "
+                    f"{rekognition_calls:>6} {break_even:>11.3f}"
+                )
+    finally:
+        s3.close()
+
+
+if __name__ == "__main__":
+    main()
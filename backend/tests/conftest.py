@@ -0,0 +1,6 @@
+import os
+import sys
+
+# stubs.py and handlers.py, which also puts the instrumentation layer on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import handlers  # noqa: E402,F401
@@ -0,0 +1,240 @@
+"""
+Offline load test of the analysis workflow
+
+A whole class uploads at once: --interviews synthetic videos are queued on
+the start queue, start_machine starts up to --concurrency executions at a
+time (MAX_IN_FLIGHT) and every execution runs the real handlers in-process
+against the stand-ins of tests/stubs.py, see workflow.py. Each AWS service
+can be given a latency, a throttling rate and a concurrency limit above
+which its calls are throttled:
+
+    python tests/load/run_load.py --interviews 40 --concurrency 10 \\
+        --latency rekognition=0.15 --limit rekognition=50 --latency bedrock=3
+
+The report has the throughput, the end-to-end latency of the interviews,
+p50/p95/p99 of every handler and instrumented stage, the calls, throttles
+and peak concurrency of each service, and the peak memory of the process
+running all the invocations.
+
+Run from backend/: python tests/load/run_load.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import workflow  # noqa: E402
+import instrumentation  # noqa: E402  (from the layer, on sys.path through handlers)
+
+DEFAULT_LATENCY = {
+    "s3": 0.02,
+    "sqs": 0.01,
+    "rekognition": 0.15,
+    "transcribe": 0.05,
+    "bedrock": 2.0,
+    "dynamodb": 0.005,
+    "stepfunctions": 0.02,
+}
+
+
+class Collector:
+    """
+    Stage timings of every invocation, replacing instrumentation.flush
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, stage, milliseconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(milliseconds)
+
+    def flush(self, **properties):
+        with instrumentation.lock:
+            recorded = dict(instrumentation.timings)
+            units = dict(instrumentation.units)
+            instrumentation.timings.clear()
+            instrumentation.units.clear()
+        with self.lock:
+            for stage, values in recorded.items():
+                # Every handler records "handler", the driver times each function instead
+                if stage == "handler":
+                    continue
+                if units.get(stage) == "Milliseconds":
+                    self.samples.setdefault(stage, []).extend(values)
+                else:
+                    self.counts.setdefault(stage, []).extend(values)
+
+
+class MemorySampler(threading.Thread):
+    """
+    Peak resident set size of the process, sampled
+
+    The handlers reset VmHWM at the start of each invocation, so the peak
+    of the whole run is sampled from VmRSS instead.
+    """
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_kb = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.is_set():
+            with open("/proc/self/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        self.peak_kb = max(self.peak_kb, int(line.split()[1]))
+            self.done.wait(self.interval)
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def make_video(path, seconds):
+    import imageio_ffmpeg
+
+    subprocess.run(
+        [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=30:duration={seconds}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+            path,
+        ],
+        check=True,
+    )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def service_options(args):
+    options = {name: {"latency": latency} for name, latency in DEFAULT_LATENCY.items()}
+    for flag, option, convert in (
+        (args.latency, "latency", float),
+        (args.throttle, "throttle_rate", float),
+        (args.limit, "max_concurrency", int),
+    ):
+        for setting in flag:
+            name, value = setting.split("=")
+            options.setdefault(name, {})[option] = convert(value)
+    return options
+
+
+def report(run, collector, services, memory, seconds):
+    interviews = run.started.values()
+    finished = [i for i in interviews if "finished" in i]
+    succeeded = [i for i in finished if i["status"] == "SUCCEEDED"]
+    print(
+        f"\n{len(succeeded)} interviews analyzed, {len(finished) - len(succeeded)} failed, "
+        f"{len(interviews) - len(finished)} unfinished in {seconds:.1f} s: "
+        f"{len(succeeded) / seconds * 60:.1f} interviews/min"
+    )
+
+    rows = [
+        ("end to end", [(i["finished"] - i["uploaded"]) * 1000 for i in finished]),
+        ("start queue wait", [(i["started"] - i["uploaded"]) * 1000 for i in finished]),
+        ("execution", [(i["finished"] - i["started"]) * 1000 for i in finished]),
+    ]
+    rows += sorted(collector.samples.items())
+    print(f"\n{'stage':<40} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, values in rows:
+        if values:
+            print(
+                f"{stage:<40} {len(values):>6} {percentile(values, 50):>9.0f} "
+                f"{percentile(values, 95):>9.0f} {percentile(values, 99):>9.0f}"
+            )
+
+    if collector.counts:
+        print(f"\n{'count metric':<40} {'total':>8} {'max':>8}")
+        for stage, values in sorted(collector.counts.items()):
+            print(f"{stage:<40} {sum(values):>8.0f} {max(values):>8.0f}")
+
+    print(f"\n{'service':<20} {'calls':>8} {'throttled':>10} {'peak in flight':>15}")
+    for name, service in services.stand_ins().items():
+        print(f"{name:<20} {service.count():>8} {service.throttled:>10} {service.peak_in_flight:>15}")
+
+    print(f"\nPeak memory: {memory.peak_kb / 1024:.0f} MB, for the whole process running every invocation")
+    for error in run.errors[:10]:
+        print(f"Error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0], formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__
+    )
+    parser.add_argument("--interviews", type=int, default=20, help="videos uploaded at once")
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="MAX_IN_FLIGHT, the quota budgets can lower the executions in flight"
+    )
+    parser.add_argument("--video-seconds", type=int, default=30, help="length of the synthetic videos")
+    parser.add_argument("--transcribe-seconds", type=float, default=5, help="duration of each Transcribe job")
+    parser.add_argument("--retry-seconds", type=float, default=5, help="start queue visibility timeout")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SECONDS")
+    parser.add_argument("--throttle", action="append", default=[], metavar="SERVICE=RATE")
+    parser.add_argument("--limit", action="append", default=[], metavar="SERVICE=CALLS")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="NAME=VALUE", help="handler setting, such as SEGMENT_SECONDS=10"
+    )
+    parser.add_argument("--timeout", type=float, default=1800, help="give up after this many seconds")
+    args = parser.parse_args()
+
+    environment = {
+        "MAX_IN_FLIGHT": str(args.concurrency),
+        # Every upload is the same video, a cache would hide the Rekognition load
+        "REKOGNITION_CACHE": "none",
+        **dict(setting.split("=", 1) for setting in args.env),
+    }
+    collector = Collector()
+    instrumentation.flush = collector.flush
+    services = workflow.Services(service_options(args))
+    run = workflow.Workflow(
+        services,
+        collector,
+        environment,
+        transcribe_seconds=args.transcribe_seconds,
+        speech_seconds=args.video_seconds,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        video = make_video(os.path.join(directory, "interview.mp4"), args.video_seconds)
+
+    memory = MemorySampler()
+    memory.start()
+    start = time.perf_counter()
+    try:
+        # The handlers print every event, keep the report readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for n in range(args.interviews):
+                run.upload(f"interview-{n:04d}", video)
+            with ThreadPoolExecutor(max_workers=args.interviews) as executions:
+                while len(run.finished) < args.interviews and time.perf_counter() - start < args.timeout:
+                    run.poll(args.retry_seconds)
+                    for execution in run.new_executions():
+                        executions.submit(run.run, execution)
+                    time.sleep(0.1)
+        seconds = time.perf_counter() - start
+    finally:
+        memory.stop()
+        services.close()
+
+    report(run, collector, services, memory, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+The analysis workflow run in-process against the stand-ins
+
+Workflow loads the real handlers, replaces their clients with the stand-ins
+of Services and runs each execution the way analyze.yaml does: ConvertVideo,
+then the video branch (plan, the segments Map, merge) and the audio branch
+(Transcribe job, callback, text metrics) in parallel, then UpdateTable.
+Uploads go through the start queue and start_machine, so MAX_IN_FLIGHT
+holds them back like it does in AWS.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handlers import load_handler  # noqa: E402
+from stubs import (  # noqa: E402
+    FakeBedrock,
+    FakeBedrockRuntime,
+    FakeDynamoDB,
+    FakeRekognition,
+    FakeS3,
+    FakeSQS,
+    FakeStepFunctions,
+    FakeTable,
+    FakeTranscribe,
+)
+
+BUCKET = "media"
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/start"
+PROFILE_ARN = "arn:aws:bedrock:us-east-1:123456789012:application-inference-profile/load"
+# Names of the handler module attributes each stand-in replaces
+CLIENTS = {
+    "s3": "s3",
+    "sqs": "sqs",
+    "rekognition": "rekognition",
+    "transcribe": "transcribe",
+    "bedrock": "bedrock",
+    "bedrock_runtime": "bedrock_runtime",
+    "dynamodb": "dynamodb",
+    "step_functions": "stepfunctions",
+}
+
+
+class Services:
+    """
+    One stand-in per AWS service, shared by every handler
+
+    `options` maps a service name (s3, sqs, rekognition, transcribe,
+    bedrock, dynamodb, stepfunctions) to the Service keyword arguments of
+    its stand-in: latency, throttle_rate and max_concurrency.
+    """
+
+    def __init__(self, options):
+        def make(factory, name, **kwargs):
+            return factory(**kwargs, **options.get(name, {}))
+
+        self.s3 = make(FakeS3, "s3")
+        self.sqs = make(FakeSQS, "sqs")
+        self.rekognition = make(FakeRekognition, "rekognition")
+        self.transcribe = make(FakeTranscribe, "transcribe")
+        self.bedrock_runtime = make(FakeBedrockRuntime, "bedrock")
+        self.bedrock = FakeBedrock(
+            profiles=[{"name": "interview-simulator-claude-sonnet-4-default", "inferenceProfileArn": PROFILE_ARN}]
+        )
+        self.records = make(FakeTable, "dynamodb", key="record_id")
+        self.tokens = make(FakeTable, "dynamodb", key="job_name")
+        self.dynamodb = FakeDynamoDB(records=self.records, tokens=self.tokens)
+        self.stepfunctions = make(FakeStepFunctions, "stepfunctions")
+
+    def stand_ins(self):
+        return {
+            "s3": self.s3,
+            "sqs": self.sqs,
+            "rekognition": self.rekognition,
+            "transcribe": self.transcribe,
+            "bedrock": self.bedrock_runtime,
+            "dynamodb.records": self.records,
+            "dynamodb.tokens": self.tokens,
+            "stepfunctions": self.stepfunctions,
+        }
+
+    def close(self):
+        self.s3.close()
+
+
+def transcript(record_id, seconds):
+    # Two words a second, different for every interview so no cache applies
+    items = []
+    words = []
+    for n in range(int(seconds * 2)):
+        content = record_id if n == 0 else f"palavra{n}"
+        words.append(content)
+        items.append(
+            {
+                "type": "pronunciation",
+                "start_time": str(n / 2),
+                "end_time": str(n / 2 + 0.4),
+                "alternatives": [{"content": content, "confidence": "0.98"}],
+            }
+        )
+    return {"results": {"transcripts": [{"transcript": " ".join(words)}], "items": items}}
+
+
+class Workflow:
+    def __init__(self, services, collector, environment, transcribe_seconds=5, speech_seconds=60):
+        self.services = services
+        self.collector = collector
+        self.transcribe_seconds = transcribe_seconds
+        self.speech_seconds = speech_seconds
+        self.started = {}
+        self.finished = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+        def load(path, **extra):
+            module = load_handler(path, **{"START_QUEUE_URL": QUEUE_URL, **environment, **extra})
+            for attribute, service in CLIENTS.items():
+                if hasattr(module, attribute):
+                    setattr(module, attribute, getattr(services, service))
+            return module
+
+        self.add_record = load("api/add_record")
+        self.start_machine = load("statesmachine/start_machine")
+        self.convert_video = load("statesmachine/convert_video")
+        self.video_metrics = load("statesmachine/calculate_video_metrics")
+        self.callback = load("statesmachine/transcription_callback", TABLE_NAME="tokens")
+        self.text_metrics = load("statesmachine/calculate_text_metrics")
+        self.update_table = load("statesmachine/update_table")
+
+    def invoke(self, function, module, event):
+        # Timed here as well, the handlers all record their time as "handler"
+        start = time.perf_counter()
+        try:
+            return module.lambda_handler(event, None)
+        finally:
+            self.collector.add(function, (time.perf_counter() - start) * 1000)
+
+    def upload(self, record_id, video):
+        """
+        Create the record, store the video and queue its ObjectCreated event
+        """
+        key = f"{record_id}.mp4"
+        body = {"record_id": record_id, "email": f"{record_id}@example.com", "duration": "1:00"}
+        self.invoke("add_record", self.add_record, {"httpMethod": "POST", "body": json.dumps(body)})
+        self.services.s3.objects[(BUCKET, key)] = video
+        s3_record = {"s3": {"bucket": {"name": BUCKET}, "object": {"key": key, "eTag": record_id}}}
+        self.services.sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps({"Records": [s3_record]}))
+        with self.lock:
+            self.started[record_id] = {"uploaded": time.perf_counter()}
+
+    def poll(self, retry_seconds):
+        """
+        One start queue poll, like the SQS event source mapping: deferred
+        messages come back after `retry_seconds`, the others are deleted
+        """
+        sqs = self.services.sqs
+        messages = sqs.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10, VisibilityTimeout=retry_seconds)
+        messages = messages.get("Messages", [])
+        if not messages:
+            return
+        event = {
+            "Records": [
+                {
+                    "messageId": m["MessageId"],
+                    "receiptHandle": m["ReceiptHandle"],
+                    "body": m["Body"],
+                    "attributes": m["Attributes"],
+                }
+                for m in messages
+            ]
+        }
+        # Without the backoff of start_machine, waiting uploads are polled
+        # again after retry_seconds
+        self.start_machine.DEFER_SECONDS = self.start_machine.DEFER_MAX_SECONDS = retry_seconds
+        failures = self.invoke("start_machine", self.start_machine, event)["batchItemFailures"]
+        failed = {failure["itemIdentifier"] for failure in failures}
+        done = [m for m in messages if m["MessageId"] not in failed]
+        if done:
+            sqs.delete_message_batch(
+                QueueUrl=QUEUE_URL,
+                Entries=[{"Id": str(n), "ReceiptHandle": m["ReceiptHandle"]} for n, m in enumerate(done)],
+            )
+
+    def new_executions(self):
+        # Started by start_machine and not run yet
+        with self.lock:
+            executions = [
+                execution
+                for name, execution in list(self.services.stepfunctions.executions.items())
+                if name not in self.finished and not execution.get("dispatched")
+            ]
+            for execution in executions:
+                execution["dispatched"] = True
+        return executions
+
+    def run(self, execution):
+        name = execution["name"]
+        state = dict(execution["input"])
+        record_id = os.path.splitext(state["Records"][0]["s3"]["object"]["key"])[0]
+        with self.lock:
+            self.started[record_id]["started"] = time.perf_counter()
+        status = "SUCCEEDED"
+        try:
+            state["Converted"] = self.invoke("convert_video", self.convert_video, state)
+            with ThreadPoolExecutor(max_workers=2) as branches:
+                video = branches.submit(self.video_branch, dict(state))
+                audio = branches.submit(self.audio_branch, dict(state))
+                outputs = [video.result(), audio.result()]
+            self.invoke("update_table", self.update_table, outputs)
+        except Exception as e:
+            status = "FAILED"
+            with self.lock:
+                self.errors.append(f"{name}: {type(e).__name__}: {e}")
+        finally:
+            self.services.stepfunctions.finish(name, status)
+            with self.lock:
+                self.finished[name] = status
+                self.started[record_id]["finished"] = time.perf_counter()
+                self.started[record_id]["status"] = status
+
+    def video_branch(self, state):
+        correlation_id = state["CorrelationId"]
+        plan = self.invoke(
+            "video_metrics.plan",
+            self.video_metrics,
+            {"Action": "plan", "Video": state["Converted"]["body"]["video"], "CorrelationId": correlation_id},
+        )
+        segments = plan["body"]["segments"]
+        # MaxConcurrencyPath of the Map, set by start_machine
+        workers = max(1, min(len(segments), state["SegmentConcurrency"]))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(lambda segment: self.segment(segment, correlation_id), segments))
+        state["VideoMetrics"] = self.invoke(
+            "video_metrics.merge",
+            self.video_metrics,
+            {"Action": "merge", "Segments": outputs, "CorrelationId": correlation_id},
+        )
+        return state
+
+    def segment(self, segment, correlation_id):
+        # The ItemProcessor retries once, then catches into SegmentFailed
+        event = {
+            "Action": "segment",
+            "Video": segment["video"],
+            "Start": segment["start"],
+            "End": segment["end"],
+            "CorrelationId": correlation_id,
+        }
+        for attempt in range(2):
+            try:
+                return self.invoke("video_metrics.segment", self.video_metrics, event)
+            except Exception as e:
+                error = type(e).__name__
+        return {"body": {"start": segment["start"], "failed": True, "error": error}}
+
+    def audio_branch(self, state):
+        key = state["Records"][0]["s3"]["object"]["key"]
+        name = f"transcribe-{key}"
+        self.services.transcribe.start_transcription_job(
+            TranscriptionJobName=name, OutputBucketName=BUCKET, OutputKey=f"transcription/{key}.json"
+        )
+        timer = threading.Timer(self.transcribe_seconds, self.finish_transcription, args=(name, key))
+        timer.daemon = True
+        timer.start()
+
+        token = uuid.uuid4().hex
+        self.invoke(
+            "transcription_callback",
+            self.callback,
+            {"TaskToken": token, "TranscriptionJobName": name, "CorrelationId": state["CorrelationId"]},
+        )
+        task = self.services.stepfunctions.wait_task(token, timeout=self.transcribe_seconds + 600)
+        if task["status"] != "SUCCEEDED":
+            raise RuntimeError(f"Transcription failed: {task}")
+
+        job = task["output"]["TranscriptionJob"]
+        state = {
+            "TranscriptionJob": job,
+            "TextMetrics": self.invoke(
+                "text_metrics",
+                self.text_metrics,
+                {"TranscriptionJob": job, "CorrelationId": state["CorrelationId"]},
+            ),
+        }
+        return state
+
+    def finish_transcription(self, name, key):
+        # Transcribe writes the output, then EventBridge delivers the event
+        bucket, output_key = self.services.transcribe.output(name)
+        record_id = os.path.splitext(key)[0]
+        body = json.dumps(transcript(record_id, self.speech_seconds))
+        self.services.s3.put_object(Bucket=bucket, Key=output_key, Body=body)
+        self.services.transcribe.finish(name)
+        event = {"detail": {"TranscriptionJobName": name, "TranscriptionJobStatus": "COMPLETED"}}
+        try:
+            self.invoke("transcription_callback", self.callback, event)
+        except Exception as e:
+            with self.lock:
+                self.errors.append(f"{name} callback: {type(e).__name__}: {e}")
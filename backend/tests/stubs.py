@@ -0,0 +1,833 @@
+"""
+In-process stand-ins for the AWS clients used by the handlers
+
+Each stand-in records its calls and can add latency and throttle requests,
+so the real handlers run offline in the tests, the benchmarks and the load
+test driver. They replace a handler's module-level clients, for example
+`app.rekognition = FakeRekognition(latency=0.2)`.
+"""
+import io
+import os
+import re
+import copy
+import json
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import threading
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+def modeled_errors(*codes):
+    # The `client.exceptions` namespace, each error is a ClientError subclass
+    return SimpleNamespace(**{code: type(code, (ClientError,), {}) for code in codes})
+
+
+def raise_modeled(errors, code, operation, message=""):
+    raise getattr(errors, code)({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class Body(io.BytesIO):
+    """
+    Response body, like botocore's StreamingBody
+    """
+
+    def iter_lines(self):
+        for line in self.getvalue().splitlines():
+            if line:
+                yield line
+
+
+class Service:
+    """
+    Latency, throttling and call counts shared by every stand-in
+
+    `latency` is in seconds per call, or a function of the operation name
+    and its arguments. Calls are throttled with probability `throttle_rate`,
+    and whenever more than `max_concurrency` of them are in flight at once.
+    """
+
+    throttling_code = "ThrottlingException"
+
+    def __init__(self, latency=0, throttle_rate=0, max_concurrency=None, seed=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def call(self, operation, **kwargs):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            throttled = self.random.random() < self.throttle_rate or (
+                self.max_concurrency is not None
+                and self.in_flight > self.max_concurrency
+            )
+            if throttled:
+                self.throttled += 1
+        try:
+            if throttled:
+                raise client_error(self.throttling_code, operation, "Rate exceeded")
+            delay = self.latency(operation, kwargs) if callable(self.latency) else self.latency
+            if delay:
+                time.sleep(delay)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def count(self, operation=None):
+        if operation is None:
+            return sum(self.calls.values())
+        return self.calls.get(operation, 0)
+
+
+def looking_ahead(image):
+    return [{"Pose": {"Yaw": 0.0, "Pitch": 0.0, "Roll": 0.0}, "Confidence": 99.9}]
+
+
+def no_labels(image):
+    return []
+
+
+class FakeRekognition(Service):
+    """
+    Rekognition image operations and Rekognition Video jobs
+
+    `faces` and `labels` are functions of the image bytes returning the
+    FaceDetails and Labels of the response, by default one face looking at
+    the camera and no labels. Video jobs call them with the timestamp, in
+    seconds, instead of the bytes, every `video_interval` seconds of a video
+    `video_seconds(bucket, name)` long. A job finishes `job_seconds(duration)`
+    after it starts, `wait_job` blocks until then like waiting for its SNS
+    notification.
+    """
+
+    def __init__(
+        self,
+        faces=looking_ahead,
+        labels=no_labels,
+        video_seconds=lambda bucket, name: 60,
+        video_interval=0.5,
+        job_seconds=lambda duration: 0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.faces = faces
+        self.labels = labels
+        self.video_seconds = video_seconds
+        self.video_interval = video_interval
+        self.job_seconds = job_seconds
+        self.jobs = {}
+
+    def start_job(self, operation, kind, Video):
+        self.call(operation, Video=Video)
+        s3_object = Video["S3Object"]
+        duration = self.video_seconds(s3_object["Bucket"], s3_object["Name"])
+        with self.lock:
+            job_id = f"{kind}-{len(self.jobs)}"
+            self.jobs[job_id] = {
+                "kind": kind,
+                "duration": duration,
+                "finishes": time.monotonic() + self.job_seconds(duration),
+            }
+        return {"JobId": job_id}
+
+    def start_face_detection(self, Video, FaceAttributes=None, NotificationChannel=None, **kwargs):
+        return self.start_job("start_face_detection", "face", Video)
+
+    def start_label_detection(self, Video, MinConfidence=None, NotificationChannel=None, **kwargs):
+        return self.start_job("start_label_detection", "label", Video)
+
+    def wait_job(self, job_id):
+        time.sleep(max(0, self.jobs[job_id]["finishes"] - time.monotonic()))
+
+    def detections(self, job):
+        # Every result of the job, in time order
+        for n in range(int(job["duration"] / self.video_interval) + 1):
+            t = n * self.video_interval
+            if job["kind"] == "face":
+                for face in self.faces(t):
+                    yield {"Timestamp": int(t * 1000), "Face": face}
+            else:
+                for label in self.labels(t):
+                    yield {"Timestamp": int(t * 1000), "Label": label}
+
+    def job_page(self, operation, key, JobId, MaxResults=1000, NextToken=None):
+        self.call(operation, JobId=JobId)
+        job = self.jobs.get(JobId)
+        if job is None:
+            raise client_error("ResourceNotFoundException", operation, JobId)
+        if time.monotonic() < job["finishes"]:
+            return {"JobStatus": "IN_PROGRESS"}
+        results = list(self.detections(job))
+        start = int(NextToken or 0)
+        page = {
+            "JobStatus": "SUCCEEDED",
+            "VideoMetadata": {"DurationMillis": int(job["duration"] * 1000)},
+            key: results[start : start + MaxResults],
+        }
+        if start + MaxResults < len(results):
+            page["NextToken"] = str(start + MaxResults)
+        return page
+
+    def get_face_detection(self, JobId, MaxResults=1000, NextToken=None, **kwargs):
+        return self.job_page("get_face_detection", "Faces", JobId, MaxResults, NextToken)
+
+    def get_label_detection(self, JobId, MaxResults=1000, NextToken=None, SortBy=None, **kwargs):
+        return self.job_page("get_label_detection", "Labels", JobId, MaxResults, NextToken)
+
+    def detect_faces(self, Image, Attributes=None):
+        self.call("detect_faces", Image=Image)
+        return {"FaceDetails": self.faces(Image["Bytes"])}
+
+    def detect_labels(self, Image, MaxLabels=None, MinConfidence=None):
+        self.call("detect_labels", Image=Image)
+        return {"Labels": self.labels(Image["Bytes"])}
+
+
+def default_feedback(request):
+    return "<avaliação>Boa apresentação.</avaliação>\n<correção>Respostas corretas.</correção>"
+
+
+class FakeBedrockRuntime(Service):
+    """
+    Bedrock runtime answering `respond(request)`, a function of the decoded
+    request body
+
+    Models in `unavailable` are refused, like a model that cannot be invoked
+    without an inference profile. Every model invoked is kept in `models`.
+    Streamed responses are sent `chunk_chars` characters at a time.
+    """
+
+    def __init__(self, respond=default_feedback, unavailable=(), chunk_chars=40, **kwargs):
+        super().__init__(**kwargs)
+        self.respond = respond
+        self.unavailable = set(unavailable)
+        self.chunk_chars = chunk_chars
+        self.models = []
+
+    def answer(self, operation, modelId, body):
+        with self.lock:
+            self.models.append(modelId)
+        self.call(operation, modelId=modelId, body=body)
+        if modelId in self.unavailable:
+            raise client_error("AccessDeniedException", operation, f"{modelId} not available")
+        return self.respond(json.loads(body))
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        text = self.answer("invoke_model", modelId, body)
+        content = {"content": [{"type": "text", "text": text}]}
+        return {"body": Body(json.dumps(content).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        text = self.answer("invoke_model_with_response_stream", modelId, body)
+
+        def events():
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start"}).encode()}}
+            for i in range(0, len(text), self.chunk_chars):
+                delta = {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": text[i : i + self.chunk_chars]},
+                }
+                yield {"chunk": {"bytes": json.dumps(delta).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode()}}
+
+        return {"body": events()}
+
+
+class FakeBedrock(Service):
+    """
+    Bedrock control plane: inference profiles and batch inference jobs
+    """
+
+    def __init__(self, profiles=(), **kwargs):
+        super().__init__(**kwargs)
+        self.profiles = list(profiles)
+        self.jobs = []
+
+    def list_inference_profiles(self, **kwargs):
+        self.call("list_inference_profiles")
+        return {"inferenceProfiles": list(self.profiles)}
+
+    def create_inference_profile(self, name, **kwargs):
+        self.call("create_inference_profile")
+        profile = {
+            "name": name,
+            "inferenceProfileArn": f"arn:aws:bedrock:us-east-1:123456789012:application-inference-profile/{name}",
+        }
+        self.profiles.append(profile)
+        return {"inferenceProfileArn": profile["inferenceProfileArn"]}
+
+    def create_model_invocation_job(self, **kwargs):
+        self.call("create_model_invocation_job")
+        self.jobs.append(kwargs)
+        return {"jobArn": f"arn:aws:bedrock:us-east-1:123456789012:model-invocation-job/{len(self.jobs)}"}
+
+
+def check_types(value):
+    # The DynamoDB resource refuses floats, like boto3 does
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        for item in value.values():
+            check_types(item)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            check_types(item)
+
+
+class FakeTable(Service):
+    """
+    DynamoDB table keyed by `key`, with `indexes` mapping an index name to
+    its hash key and optional range key
+    """
+
+    throttling_code = "ProvisionedThroughputExceededException"
+
+    def __init__(self, key, indexes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.key = key
+        self.indexes = indexes or {}
+        self.items = {}
+
+    def get_item(self, Key, **kwargs):
+        self.call("get_item")
+        item = self.items.get(Key[self.key])
+        return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self.call("put_item")
+        check_types(Item)
+        self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key, ReturnValues="NONE", **kwargs):
+        self.call("delete_item")
+        old = self.items.pop(Key[self.key], None)
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": old}
+        return {}
+
+    def update_item(
+        self,
+        Key,
+        UpdateExpression,
+        ExpressionAttributeValues=None,
+        ExpressionAttributeNames=None,
+        ReturnValues="NONE",
+        **kwargs,
+    ):
+        self.call("update_item")
+        values = ExpressionAttributeValues or {}
+        names = ExpressionAttributeNames or {}
+        check_types(values)
+        item = self.items.setdefault(Key[self.key], dict(Key))
+        # "set a=:a, b=:b remove c, d"
+        for action, clause in re.findall(
+            r"\b(set|remove)\s+(.*?)(?=\s+\b(?:set|remove)\b|$)", UpdateExpression, re.I
+        ):
+            for part in clause.split(","):
+                if action.lower() == "set":
+                    name, value = (side.strip() for side in part.split("="))
+                    item[names.get(name, name)] = copy.deepcopy(values[value])
+                else:
+                    name = part.strip()
+                    item.pop(names.get(name, name), None)
+        return {}
+
+
+    def query(
+        self,
+        KeyConditionExpression,
+        ExpressionAttributeValues,
+        IndexName=None,
+        ExpressionAttributeNames=None,
+        ProjectionExpression=None,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+        **kwargs,
+    ):
+        """
+        Query with an equality condition on the hash key, "email = :email"
+        """
+        self.call("query")
+        names = ExpressionAttributeNames or {}
+        name, value = (side.strip() for side in KeyConditionExpression.split("="))
+        hash_key, range_key = self.indexes.get(IndexName, (self.key, None))
+        assert names.get(name, name) == hash_key
+        # Items without the index keys are not in the index
+        items = [
+            item
+            for item in self.items.values()
+            if item.get(hash_key) == ExpressionAttributeValues[value]
+            and (range_key is None or range_key in item)
+        ]
+        if range_key is not None:
+            items.sort(key=lambda item: item[range_key], reverse=not ScanIndexForward)
+
+        start = 0
+        if ExclusiveStartKey:
+            start = next(
+                n + 1 for n, item in enumerate(items) if item[self.key] == ExclusiveStartKey[self.key]
+            )
+        page = items[start : start + Limit] if Limit else items[start:]
+        response = {"Items": [self.project(item, ProjectionExpression, names) for item in page]}
+        if Limit and start + Limit < len(items):
+            last = page[-1]
+            response["LastEvaluatedKey"] = {
+                key: last[key] for key in (self.key, hash_key, range_key) if key is not None
+            }
+        return response
+
+    def project(self, item, projection, names):
+        if not projection:
+            return copy.deepcopy(item)
+        attributes = [names.get(name.strip(), name.strip()) for name in projection.split(",")]
+        return {name: copy.deepcopy(item[name]) for name in attributes if name in item}
+
+
+class FakeDynamoDB:
+    """
+    DynamoDB resource with the tables given by name
+    """
+
+    def __init__(self, **tables):
+        self.tables = tables
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+class Paginator:
+    """
+    Client paginator over a `list_*` method, which takes the `token`
+    argument and returns the next one as `next_token`
+    """
+
+    def __init__(self, method, token="nextToken", next_token="nextToken", page_size="maxResults"):
+        self.method = method
+        self.token = token
+        self.next_token = next_token
+        self.page_size = page_size
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get("PageSize")
+        if page_size:
+            kwargs[self.page_size] = page_size
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get(self.next_token):
+                return
+            kwargs[self.token] = page[self.next_token]
+
+
+class FakeStepFunctions(Service):
+    """
+    Step Functions executions and task tokens
+
+    Started executions are kept in `executions` by name and stay RUNNING
+    until `finish` is called. Like a STANDARD workflow, starting one again
+    with the same name and input while it runs returns it, and anything
+    else with its name gets ExecutionAlreadyExists. Task tokens are closed by the first
+    send_task_success or send_task_failure, their result is kept in `tasks`,
+    and any later call with the same token gets TaskTimedOut.
+    """
+
+    exceptions = modeled_errors(
+        "ExecutionAlreadyExists", "ExecutionDoesNotExist", "TaskTimedOut", "InvalidToken"
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.executions = {}
+        self.tasks = {}
+        self.closed = threading.Condition(self.lock)
+
+    def start_execution(self, stateMachineArn, name, input="{}"):
+        self.call("start_execution")
+        arn = f"{stateMachineArn}:{name}".replace(":stateMachine:", ":execution:")
+        with self.lock:
+            execution = self.executions.get(name)
+            if execution is not None:
+                if execution["status"] == "RUNNING" and execution["input"] == json.loads(input):
+                    return {"executionArn": arn, "startDate": execution["startDate"]}
+                raise_modeled(self.exceptions, "ExecutionAlreadyExists", "StartExecution", name)
+            self.executions[name] = {
+                "name": name,
+                "input": json.loads(input),
+                "status": "RUNNING",
+                "startDate": datetime.datetime.now(datetime.timezone.utc),
+            }
+        return {"executionArn": arn, "startDate": self.executions[name]["startDate"]}
+
+    def describe_execution(self, executionArn):
+        self.call("describe_execution")
+        execution = self.executions.get(executionArn.split(":")[-1])
+        if execution is None:
+            raise_modeled(self.exceptions, "ExecutionDoesNotExist", "DescribeExecution", executionArn)
+        return {
+            "executionArn": executionArn,
+            "name": execution["name"],
+            "status": execution["status"],
+            "input": json.dumps(execution["input"]),
+            "startDate": execution["startDate"],
+        }
+
+    def finish(self, name, status="SUCCEEDED"):
+        self.executions[name]["status"] = status
+
+    def list_executions(self, stateMachineArn, statusFilter=None, maxResults=100, nextToken=None):
+        self.call("list_executions")
+        executions = [
+            {"name": execution["name"], "status": execution["status"]}
+            for execution in list(self.executions.values())
+            if statusFilter is None or execution["status"] == statusFilter
+        ]
+        start = int(nextToken or 0)
+        page = {"executions": executions[start : start + maxResults]}
+        if start + maxResults < len(executions):
+            page["nextToken"] = str(start + maxResults)
+        return page
+
+    def get_paginator(self, operation):
+        return Paginator(getattr(self, operation))
+
+    def close_task(self, operation, token, result):
+        self.call(operation)
+        with self.lock:
+            if token in self.tasks:
+                raise_modeled(self.exceptions, "TaskTimedOut", operation, "Task already closed")
+            self.tasks[token] = result
+            self.closed.notify_all()
+
+    def wait_task(self, token, timeout=None):
+        """
+        Block like a waitForTaskToken state until the token is closed
+        """
+        with self.lock:
+            if not self.closed.wait_for(lambda: token in self.tasks, timeout):
+                raise TimeoutError(f"Task {token} was not closed")
+            return self.tasks[token]
+
+    def send_task_success(self, taskToken, output):
+        self.close_task("send_task_success", taskToken, {"status": "SUCCEEDED", "output": json.loads(output)})
+        return {}
+
+    def send_task_failure(self, taskToken, error=None, cause=None):
+        self.close_task("send_task_failure", taskToken, {"status": "FAILED", "error": error, "cause": cause})
+        return {}
+
+
+class FakeTranscribe(Service):
+    """
+    Transcribe jobs, kept in `jobs` by name and IN_PROGRESS until `finish`
+    is called
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.jobs = {}
+        self.outputs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, OutputBucketName="media", OutputKey=None, **kwargs):
+        self.call("start_transcription_job")
+        job = {
+            "TranscriptionJobName": TranscriptionJobName,
+            "TranscriptionJobStatus": "IN_PROGRESS",
+        }
+        with self.lock:
+            self.jobs[TranscriptionJobName] = job
+            self.outputs[TranscriptionJobName] = (OutputBucketName, OutputKey or f"{TranscriptionJobName}.json")
+        return {"TranscriptionJob": dict(job)}
+
+    def finish(self, name, status="COMPLETED"):
+        """
+        Finish the job, its transcript is expected at `output(name)`
+        """
+        self.jobs[name]["TranscriptionJobStatus"] = status
+        if status == "COMPLETED":
+            bucket, key = self.outputs[name]
+            self.jobs[name]["Transcript"] = {
+                "TranscriptFileUri": f"https://s3.us-east-1.amazonaws.com/{bucket}/{key}"
+            }
+
+    def output(self, name):
+        return self.outputs[name]
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.call("get_transcription_job")
+        if TranscriptionJobName not in self.jobs:
+            raise client_error("BadRequestException", "GetTranscriptionJob", "job not found")
+        return {"TranscriptionJob": dict(self.jobs[TranscriptionJobName])}
+
+
+class FakeSQS(Service):
+    """
+    One SQS queue, whatever the QueueUrl
+
+    Received messages are hidden for their visibility timeout, measured with
+    `clock`, so tests can move time forward instead of sleeping.
+    """
+
+    def __init__(self, clock=time.time, **kwargs):
+        super().__init__(**kwargs)
+        self.clock = clock
+        self.messages = {}
+        self.sent = 0
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.call("send_message")
+        with self.lock:
+            self.sent += 1
+            message_id = f"message-{self.sent}"
+            self.messages[message_id] = {
+                "MessageId": message_id,
+                "Body": MessageBody,
+                "SentTimestamp": str(int(self.clock() * 1000)),
+                "visible_at": 0,
+                "receipts": 0,
+            }
+        return {"MessageId": message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=30, **kwargs):
+        self.call("receive_message")
+        now = self.clock()
+        received = []
+        with self.lock:
+            for message in self.messages.values():
+                if len(received) == MaxNumberOfMessages:
+                    break
+                if message["visible_at"] > now:
+                    continue
+                message["visible_at"] = now + VisibilityTimeout
+                message["receipts"] += 1
+                received.append(
+                    {
+                        "MessageId": message["MessageId"],
+                        "ReceiptHandle": f"{message['MessageId']}/{message['receipts']}",
+                        "Body": message["Body"],
+                        "Attributes": {
+                            "SentTimestamp": message["SentTimestamp"],
+                            "ApproximateReceiveCount": str(message["receipts"]),
+                        },
+                    }
+                )
+        return {"Messages": received} if received else {}
+
+    def find(self, receipt_handle):
+        message_id, receipt = receipt_handle.split("/")
+        message = self.messages.get(message_id)
+        # Only the latest receipt handle of a message is valid
+        if message is None or str(message["receipts"]) != receipt:
+            return None
+        return message
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.call("change_message_visibility_batch")
+        assert len(Entries) <= 10
+        with self.lock:
+            for entry in Entries:
+                message = self.find(entry["ReceiptHandle"])
+                if message is not None:
+                    message["visible_at"] = self.clock() + entry["VisibilityTimeout"]
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.call("delete_message_batch")
+        assert len(Entries) <= 10
+        with self.lock:
+            for entry in Entries:
+                message = self.find(entry["ReceiptHandle"])
+                if message is not None:
+                    del self.messages[message["MessageId"]]
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        self.call("get_queue_attributes")
+        now = self.clock()
+        visible = sum(1 for message in self.messages.values() if message["visible_at"] <= now)
+        return {
+            "Attributes": {
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(self.messages) - visible),
+            }
+        }
+
+
+class FakeS3(Service):
+    """
+    S3 objects, kept in `objects` by bucket and key
+
+    Presigned GET URLs are paths of local copies of the objects, which
+    ffmpeg and moviepy open like the real URLs. They are written under
+    `directory`, removed by `close`. Multipart uploads keep their parts in
+    `uploads` by upload ID until they are completed or aborted.
+    """
+
+    exceptions = modeled_errors("NoSuchUpload", "NoSuchKey")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.objects = {}
+        self.uploads = {}
+        self.directory = tempfile.mkdtemp(prefix="fake-s3-")
+        self.spooled = {}
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        self.call("generate_presigned_url")
+        bucket, key = Params["Bucket"], Params["Key"]
+        if ClientMethod != "get_object":
+            return f"https://{bucket}.s3.amazonaws.com/{key}?method={ClientMethod}"
+        with self.lock:
+            path = self.spooled.get((bucket, key))
+            if path is None:
+                path = os.path.join(self.directory, f"{len(self.spooled)}-{os.path.basename(key)}")
+                with open(path, "wb") as f:
+                    f.write(self.objects.get((bucket, key), b""))
+                self.spooled[(bucket, key)] = path
+        return path
+
+    def download_file(self, Bucket, Key, Filename, Config=None, **kwargs):
+        self.call("download_file")
+        if (Bucket, Key) not in self.objects:
+            raise client_error("404", "HeadObject", "Not Found")
+        with open(Filename, "wb") as f:
+            f.write(self.objects[(Bucket, Key)])
+
+    def upload_file(self, Filename, Bucket, Key, Config=None, **kwargs):
+        self.call("upload_file")
+        with open(Filename, "rb") as f:
+            self.objects[(Bucket, Key)] = f.read()
+        self.spooled.pop((Bucket, Key), None)
+
+    def copy_object(self, CopySource, Bucket, Key, **kwargs):
+        self.call("copy_object")
+        source = (CopySource["Bucket"], CopySource["Key"])
+        if source not in self.objects:
+            raise client_error("NoSuchKey", "CopyObject", CopySource["Key"])
+        self.objects[(Bucket, Key)] = self.objects[source]
+        self.spooled.pop((Bucket, Key), None)
+        return {}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        self.call("put_object")
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = Body
+        self.spooled.pop((Bucket, Key), None)
+        return {"ETag": f'"{len(Body)}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.call("get_object")
+        if (Bucket, Key) not in self.objects:
+            raise_modeled(self.exceptions, "NoSuchKey", "GetObject", Key)
+        body = self.objects[(Bucket, Key)]
+        return {"Body": Body(body), "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.call("head_object")
+        if (Bucket, Key) not in self.objects:
+            raise client_error("404", "HeadObject", "Not Found")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self.call("list_objects_v2")
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = {
+            "Contents": [
+                {"Key": key, "Size": len(self.objects[(Bucket, key)])}
+                for key in keys[start : start + MaxKeys]
+            ],
+            "KeyCount": len(keys[start : start + MaxKeys]),
+        }
+        if start + MaxKeys < len(keys):
+            page["NextContinuationToken"] = str(start + MaxKeys)
+        return page
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.call("create_multipart_upload")
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {"bucket": Bucket, "key": Key, "parts": {}}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def multipart(self, Bucket, Key, UploadId, operation):
+        upload = self.uploads.get(UploadId)
+        if upload is None or (upload["bucket"], upload["key"]) != (Bucket, Key):
+            raise_modeled(self.exceptions, "NoSuchUpload", operation, UploadId)
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b"", **kwargs):
+        # What the browser does with the presigned part URLs
+        self.call("upload_part")
+        parts = self.multipart(Bucket, Key, UploadId, "UploadPart")["parts"]
+        parts[PartNumber] = Body
+        return {"ETag": f'"{PartNumber}-{len(Body)}"'}
+
+    def list_parts(self, Bucket, Key, UploadId, MaxParts=1000, PartNumberMarker=0, **kwargs):
+        self.call("list_parts")
+        parts = self.multipart(Bucket, Key, UploadId, "ListParts")["parts"]
+        numbers = sorted(n for n in parts if n > int(PartNumberMarker))
+        page = {
+            "Parts": [
+                {"PartNumber": n, "ETag": f'"{n}-{len(parts[n])}"', "Size": len(parts[n])}
+                for n in numbers[:MaxParts]
+            ],
+            "IsTruncated": len(numbers) > MaxParts,
+        }
+        if page["IsTruncated"]:
+            page["NextPartNumberMarker"] = numbers[MaxParts - 1]
+        return page
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.call("complete_multipart_upload")
+        parts = self.multipart(Bucket, Key, UploadId, "CompleteMultipartUpload")["parts"]
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        if numbers != sorted(set(numbers)) or any(n not in parts for n in numbers):
+            raise client_error("InvalidPart", "CompleteMultipartUpload")
+        self.objects[(Bucket, Key)] = b"".join(parts[n] for n in numbers)
+        self.spooled.pop((Bucket, Key), None)
+        del self.uploads[UploadId]
+        return {"Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.call("abort_multipart_upload")
+        self.multipart(Bucket, Key, UploadId, "AbortMultipartUpload")
+        del self.uploads[UploadId]
+        return {}
+
+    def get_paginator(self, operation):
+        if operation == "list_parts":
+            return Paginator(
+                self.list_parts,
+                token="PartNumberMarker",
+                next_token="NextPartNumberMarker",
+                page_size="MaxParts",
+            )
+        return Paginator(
+            getattr(self, operation),
+            token="ContinuationToken",
+            next_token="NextContinuationToken",
+            page_size="MaxKeys",
+        )
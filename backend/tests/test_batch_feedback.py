@@ -0,0 +1,205 @@
+import json
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeBedrock, FakeBedrockRuntime, FakeDynamoDB, FakeS3, FakeSQS, FakeTable
+
+QUEUE = "https://sqs.us-east-1.amazonaws.com/123456789012/feedback"
+SETTINGS = {"BATCH_QUEUE_URL": QUEUE, "BATCH_MIN_RECORDS": "5", "BATCH_MAX_WAIT_SECONDS": "3600"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.delenv("INFERENCE_PROFILE_ARN", raising=False)
+    return clock
+
+
+@pytest.fixture
+def services(clock):
+    records = FakeTable("record_id")
+    return {
+        "sqs": FakeSQS(clock=clock),
+        "s3": FakeS3(),
+        "dynamodb": FakeDynamoDB(records=records),
+        "bedrock": FakeBedrock(),
+        "bedrock_runtime": FakeBedrockRuntime(),
+    }
+
+
+@pytest.fixture
+def app(services, clock, monkeypatch):
+    module = load_handler(
+        "statesmachine/batch_feedback",
+        BATCH_ROLE_ARN="arn:aws:iam::123456789012:role/batch",
+        **SETTINGS,
+    )
+    for name, client in services.items():
+        setattr(module, name, client)
+    monkeypatch.setattr(module.time, "time", clock)
+    return module
+
+
+@pytest.fixture
+def queue(services):
+    # Requests queued by calculate_text_metrics in batch mode
+    text_metrics = load_handler("statesmachine/calculate_text_metrics", FEEDBACK_MODE="batch", **SETTINGS)
+    text_metrics.sqs = services["sqs"]
+
+    def queue(count):
+        for n in range(count):
+            record_id = f"r{n}"
+            services["dynamodb"].Table("records").put_item(
+                Item={"record_id": record_id, "report": {"transcription": "Olá"}}
+            )
+            text_metrics.queue_feedback("Fale sobre você.", f"Entrevista {n}", record_id)
+
+    return queue
+
+
+def test_recent_requests_wait_and_stay_visible(app, services, queue, clock):
+    queue(3)
+    app.lambda_handler({"source": "aws.events"}, None)
+
+    sqs = services["sqs"]
+    assert sqs.count("change_message_visibility_batch") == 1
+    assert sqs.get_queue_attributes(QueueUrl=QUEUE)["Attributes"]["ApproximateNumberOfMessages"] == "3"
+    assert services["bedrock_runtime"].count() == 0
+
+    # More requests arrive before the next run, which submits them all
+    queue(5)
+    clock.now += 60
+    app.lambda_handler({"source": "aws.events"}, None)
+    assert len(services["bedrock"].jobs) == 1
+    assert sqs.messages == {}
+
+
+def test_old_requests_use_sonnet_on_demand(app, services, queue, clock):
+    queue(2)
+    clock.now += 3600
+    app.lambda_handler({"source": "aws.events"}, None)
+
+    runtime = services["bedrock_runtime"]
+    assert runtime.models == [app.ON_DEMAND_MODEL_ID] * 2
+    assert "sonnet" in app.ON_DEMAND_MODEL_ID
+    assert services["sqs"].messages == {}
+    report = services["dynamodb"].Table("records").items["r0"]["report"]
+    assert report == {
+        "transcription": "Olá",
+        "avaliacao": "Boa apresentação.",
+        "correcao": "Respostas corretas.",
+    }
+
+
+def test_on_demand_uses_the_configured_profile(app, services, queue, clock, monkeypatch):
+    profile = "arn:aws:bedrock:us-east-1:123456789012:application-inference-profile/sonnet"
+    monkeypatch.setenv("INFERENCE_PROFILE_ARN", profile)
+    queue(1)
+    clock.now += 3600
+    app.lambda_handler({"source": "aws.events"}, None)
+    assert services["bedrock_runtime"].models == [profile]
+
+
+def submit_job(app, services, queue, count):
+    # Queue and submit `count` requests, return the job name and input lines
+    queue(count)
+    app.lambda_handler({"source": "aws.events"}, None)
+    job = services["bedrock"].jobs[-1]
+    assert job["modelId"] == app.MODEL_ID
+    input_key = job["inputDataConfig"]["s3InputDataConfig"]["s3Uri"].split("/", 3)[3]
+    lines = services["s3"].objects[("media", input_key)].decode().splitlines()
+    return job["jobName"], [json.loads(line) for line in lines]
+
+
+def job_event(job_name, status):
+    return {
+        "source": "aws.bedrock",
+        "detail": {
+            "status": status,
+            "batchJobName": job_name,
+            "batchJobArn": "arn:aws:bedrock:us-east-1:123456789012:model-invocation-job/job1",
+        },
+    }
+
+
+def write_output(services, results):
+    # Bedrock writes one output line per input line
+    output = "\n".join(json.dumps(result) for result in results)
+    services["s3"].put_object(Bucket="media", Key="batch/output/job1/input.jsonl.out", Body=output)
+
+
+def answered(record_id):
+    text = "<avaliação>Boa</avaliação><correção>Certo</correção>"
+    return {"recordId": record_id, "modelOutput": {"content": [{"type": "text", "text": text}]}}
+
+
+def queued(services):
+    return [json.loads(message["Body"]) for message in services["sqs"].messages.values()]
+
+
+def test_batch_job_is_submitted_and_merged(app, services, queue):
+    job_name, requests = submit_job(app, services, queue, 12)
+    assert len(requests) == 12
+    assert set(requests[0]) == {"recordId", "modelInput"}
+    assert services["sqs"].messages == {}
+
+    write_output(services, [answered(request["recordId"]) for request in requests])
+    app.lambda_handler(job_event(job_name, "Completed"), None)
+
+    items = services["dynamodb"].Table("records").items
+    assert all(item["report"]["avaliacao"] == "Boa" for item in items.values())
+    assert services["sqs"].messages == {}
+
+
+def test_records_without_output_are_queued_again(app, services, queue):
+    job_name, requests = submit_job(app, services, queue, 6)
+    results = [answered(request["recordId"]) for request in requests[:4]]
+    results.append({"recordId": requests[4]["recordId"], "error": {"errorCode": 400}})
+    # The last record has no output line at all
+    write_output(services, results)
+    app.lambda_handler(job_event(job_name, "PartiallyCompleted"), None)
+
+    again = queued(services)
+    assert sorted(request["record_id"] for request in again) == ["r4", "r5"]
+    assert all(request["attempts"] == 1 for request in again)
+    assert again[0]["model_input"] == requests[4]["modelInput"]
+    items = services["dynamodb"].Table("records").items
+    assert items["r0"]["report"]["avaliacao"] == "Boa"
+    assert "avaliacao" not in items["r5"]["report"]
+
+
+def test_failed_job_requeues_every_request(app, services, queue, clock):
+    job_name, requests = submit_job(app, services, queue, 6)
+    app.lambda_handler(job_event(job_name, "Failed"), None)
+
+    assert sorted(request["record_id"] for request in queued(services)) == [f"r{n}" for n in range(6)]
+
+    # They go to the next job, then on demand once BATCH_MAX_ATTEMPTS jobs failed
+    for attempt in range(2, app.BATCH_MAX_ATTEMPTS + 1):
+        clock.now += 900
+        app.lambda_handler({"source": "aws.events"}, None)
+        job = services["bedrock"].jobs[-1]
+        app.lambda_handler(job_event(job["jobName"], "Expired"), None)
+        assert {request["attempts"] for request in queued(services)} == {attempt}
+
+    clock.now += 900
+    app.lambda_handler({"source": "aws.events"}, None)
+    assert services["bedrock_runtime"].count() == 6
+    assert services["sqs"].messages == {}
+    items = services["dynamodb"].Table("records").items
+    assert all(item["report"]["avaliacao"] == "Boa apresentação." for item in items.values())
+
+
+def test_jobs_in_progress_are_left_alone(app, services, queue):
+    job_name, _ = submit_job(app, services, queue, 6)
+    app.lambda_handler(job_event(job_name, "InProgress"), None)
+    assert services["sqs"].messages == {}
@@ -0,0 +1,133 @@
+import pytest
+
+from handlers import load_handler
+from stubs import FakeBedrock, FakeBedrockRuntime, FakeDynamoDB, FakeTable
+
+PROFILE_ARN = "arn:aws:bedrock:us-east-1:123456789012:application-inference-profile/sonnet"
+
+
+@pytest.fixture(scope="module")
+def app():
+    return load_handler("statesmachine/calculate_text_metrics")
+
+
+def test_split_transcript_short_text(app):
+    assert app.split_transcript("Olá. Tudo bem?", 100) == ["Olá. Tudo bem?"]
+
+
+def test_split_transcript_keeps_sentences_whole(app):
+    sentences = [f"Frase número {n} da entrevista." for n in range(50)]
+    text = " ".join(sentences)
+    segments = app.split_transcript(text, 200)
+
+    assert len(segments) > 1
+    assert all(len(segment) <= 200 for segment in segments)
+    assert " ".join(segments) == text
+    for segment in segments:
+        assert segment.endswith(".")
+
+
+def test_split_transcript_cuts_long_sentences(app):
+    text = "a" * 250
+    segments = app.split_transcript(text, 100)
+    assert [len(segment) for segment in segments] == [100, 100, 50]
+    assert "".join(segments) == text
+
+
+def test_split_transcript_empty(app):
+    assert app.split_transcript("", 100) == []
+
+
+@pytest.fixture
+def bedrock_app(monkeypatch):
+    # New module per test, so the profile and feedback caches start empty
+    module = load_handler("statesmachine/calculate_text_metrics")
+    monkeypatch.delenv("INFERENCE_PROFILE_ARN", raising=False)
+    module.bedrock = FakeBedrock(
+        profiles=[
+            {"name": "interview-simulator-claude-sonnet-4-default", "inferenceProfileArn": PROFILE_ARN}
+        ]
+    )
+    module.bedrock_runtime = FakeBedrockRuntime()
+    return module
+
+
+def test_failed_profile_lookup_is_not_memoized(bedrock_app):
+    bedrock_app.bedrock.throttle_rate = 1
+    assert bedrock_app.get_inference_profile() is None
+
+    bedrock_app.bedrock.throttle_rate = 0
+    assert bedrock_app.get_inference_profile() == PROFILE_ARN
+    assert bedrock_app.get_inference_profile() == PROFILE_ARN
+    assert bedrock_app.bedrock.count("list_inference_profiles") == 2
+
+
+def test_feedback_comes_from_the_inference_profile(bedrock_app):
+    request = bedrock_app.feedback_request("prompt")
+    assert "<avaliação>" in bedrock_app.generate(request)
+    assert bedrock_app.bedrock_runtime.models == [PROFILE_ARN]
+
+    # Served from the cache the second time
+    bedrock_app.generate(request)
+    assert bedrock_app.bedrock_runtime.models == [PROFILE_ARN]
+
+
+def test_fallback_feedback_is_not_cached(bedrock_app):
+    runtime = bedrock_app.bedrock_runtime
+    runtime.unavailable = {PROFILE_ARN}
+    request = bedrock_app.feedback_request("prompt")
+
+    bedrock_app.generate(request)
+    assert runtime.models == [PROFILE_ARN, bedrock_app.FALLBACK_MODEL_ID]
+
+    # The retry reaches the main model again, and only its answer is cached
+    runtime.unavailable = set()
+    bedrock_app.generate(request)
+    bedrock_app.generate(request)
+    assert runtime.models == [PROFILE_ARN, bedrock_app.FALLBACK_MODEL_ID, PROFILE_ARN]
+
+
+def test_missing_profile_falls_back_without_caching(bedrock_app):
+    bedrock_app.bedrock.throttle_rate = 1
+    request = bedrock_app.feedback_request("prompt")
+
+    bedrock_app.generate(request)
+    bedrock_app.generate(request)
+    assert bedrock_app.bedrock_runtime.models == [bedrock_app.FALLBACK_MODEL_ID] * 2
+
+
+def test_streamed_feedback_is_saved_as_a_preview(bedrock_app, monkeypatch):
+    records = FakeTable("record_id")
+    records.put_item(Item={"record_id": "r1", "video": ""})
+    bedrock_app.dynamodb = FakeDynamoDB(records=records)
+    monkeypatch.setattr(bedrock_app, "FEEDBACK_STREAMING", True)
+    monkeypatch.setattr(bedrock_app, "FEEDBACK_FLUSH_SECONDS", 0)
+
+    feedback = bedrock_app.generate(bedrock_app.feedback_request("prompt"), "r1")
+
+    assert "<correção>" in feedback
+    assert records.items["r1"]["preview"] is True
+    assert records.items["r1"]["partial_feedback"] == {
+        "avaliacao": "Boa apresentação.",
+        "correcao": "Respostas corretas.",
+    }
+    assert records.count("update_item") > 1
+
+
+def test_delivery_metrics_are_saved_as_a_preview(app):
+    records = FakeTable("record_id")
+    records.put_item(Item={"record_id": "r1", "video": ""})
+    app.dynamodb = FakeDynamoDB(records=records)
+
+    app.save_delivery("r1", {"words": 120, "words_per_minute": 114.6})
+
+    assert records.items["r1"]["preview"] is True
+    assert records.items["r1"]["delivery"]["words"] == 120
+
+
+def test_long_interviews_get_a_single_feedback_call(bedrock_app):
+    # About 40 minutes of speech, well within the model's context
+    transcript = "Eu trabalhei com a migração de sistemas para a nuvem. " * 900
+    assert len(transcript) > 48000
+    bedrock_app.bedrock_feedback("Fale sobre você.", transcript)
+    assert bedrock_app.bedrock_runtime.count() == 1
@@ -0,0 +1,263 @@
+import contextlib
+import random
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from handlers import load_handler
+from stubs import FakeRekognition, FakeS3
+
+
+@pytest.fixture(scope="module")
+def app():
+    return load_handler("statesmachine/calculate_video_metrics", REKOGNITION_CACHE="none")
+
+
+def jpeg(image):
+    stream = BytesIO()
+    image.save(stream, format="JPEG")
+    return stream.getvalue()
+
+
+def solid(value):
+    return jpeg(Image.new("RGB", (320, 240), (value, value, value)))
+
+
+def scene(seed):
+    # Large random blocks, so different seeds differ after downscaling
+    blocks = np.random.default_rng(seed).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    return jpeg(Image.fromarray(blocks).resize((320, 240), Image.NEAREST))
+
+
+def stats():
+    return {"analyzed": 0, "skipped": 0, "filtered": 0}
+
+
+def test_attention_without_poses(app):
+    result = app.calculate_attention([], [])
+    assert result["attention"] is True
+    assert result["attentive_percentage"] == 100.0
+    assert result["timeline"] == []
+
+
+def test_attention_steady_head(app):
+    timestamps = list(range(0, 60, 5))
+    result = app.calculate_attention(timestamps, [[0, 0, 0]] * len(timestamps))
+    assert result["attention"] is True
+    assert result["attentive_percentage"] == 100.0
+    assert result["longest_distraction_seconds"] == 0
+    assert result["timeline"] == [{"start": 0, "score": 1.0}]
+
+
+def test_attention_ignores_a_single_noisy_frame(app):
+    timestamps = list(range(0, 60, 5))
+    poses = [[0, 0, 0]] * len(timestamps)
+    poses[5] = [80, 0, 0]
+    result = app.calculate_attention(timestamps, poses)
+    assert result["attention"] is True
+    assert result["attentive_percentage"] == 100.0
+
+
+def test_attention_sustained_distraction(app):
+    timestamps = list(range(0, 60, 5))
+    poses = [[60, 0, 0] if 4 <= i <= 7 else [0, 0, 0] for i in range(len(timestamps))]
+    result = app.calculate_attention(timestamps, poses)
+    assert result["attention"] is False
+    assert result["attentive_percentage"] == 66.7
+    # Frames at 20, 25, 30 and 35 seconds, up to the next frame at 40
+    assert result["longest_distraction_seconds"] == 20
+    assert result["timeline"] == [{"start": 0, "score": 0.67}]
+
+
+def test_attention_weights_frames_by_time(app):
+    # Adaptive sampling: 9 steady minutes kept every 30 seconds, then a
+    # minute turned away with a frame every 5 seconds
+    steady = list(range(0, 540, 30))
+    away = list(range(540, 600, 5))
+    poses = [[0, 0, 0]] * len(steady) + [[60, 0, 0]] * len(away)
+    result = app.calculate_attention(steady + away, poses)
+    assert result["attentive_percentage"] == 90.0
+    assert result["longest_distraction_seconds"] == 60
+    assert result["timeline"][-2:] == [{"start": 480, "score": 1.0}, {"start": 540, "score": 0.0}]
+
+
+def test_attention_timeline_segments(app):
+    timestamps = list(range(0, 130, 5))
+    result = app.calculate_attention(timestamps, [[0, 0, 0]] * len(timestamps))
+    assert [segment["start"] for segment in result["timeline"]] == [0, 60, 120]
+
+
+def test_select_frames_skips_unchanged_frames(app):
+    first, second = scene(1), scene(2)
+    frames = [(0, first), (5, first), (10, first), (15, second), (20, second)]
+    counts = stats()
+    kept = [t for t, _ in app.select_frames(frames, counts)]
+    assert kept == [0, 15]
+    assert counts["skipped"] == 3
+
+
+def test_select_frames_keeps_a_frame_every_keep_alive(app, monkeypatch):
+    monkeypatch.setattr(app, "KEEP_ALIVE_SECONDS", 30)
+    frame = scene(1)
+    counts = stats()
+    kept = [t for t, _ in app.select_frames([(t, frame) for t in range(0, 40, 5)], counts)]
+    assert kept == [0, 30]
+    assert counts["skipped"] == 6
+
+
+def test_prefilter_drops_dark_and_flat_frames(app):
+    frames = [(0, solid(0)), (5, solid(128)), (10, scene(1))]
+    counts = stats()
+    kept = [t for t, _ in app.prefilter_frames(frames, counts)]
+    assert kept == [10]
+    assert counts["filtered"] == 2
+
+
+def test_analyze_frames_against_rekognition_stub(app, monkeypatch):
+    frames = [(t, scene(t)) for t in range(0, 50, 5)]
+    yaw = {frame: float(t) for t, frame in frames}
+    hat = frames[3][1]
+    rekognition = FakeRekognition(
+        faces=lambda image: [{"Pose": {"Yaw": yaw[image], "Pitch": 0.0, "Roll": 0.0}}],
+        labels=lambda image: [{"Name": "Hat"}] if image == hat else [{"Name": "Person"}],
+        # Responses arrive out of order
+        latency=lambda operation, kwargs: random.uniform(0, 0.01),
+    )
+    monkeypatch.setattr(app, "rekognition", rekognition)
+
+    result = app.analyze_frames(iter(frames))
+
+    assert result["frames"] == len(frames)
+    assert result["objects"] == ["Hat"]
+    assert result["timestamps"] == [t for t, _ in frames]
+    assert [pose[0] for pose in result["poses"]] == [float(t) for t, _ in frames]
+    assert rekognition.count("detect_faces") == len(frames)
+    assert rekognition.count("detect_labels") == len(frames)
+    assert rekognition.peak_in_flight <= app.REKOGNITION_CONCURRENCY
+
+
+def test_analyze_frames_retries_throttled_requests(app, monkeypatch):
+    rekognition = FakeRekognition(throttle_rate=0.3, seed=1)
+    monkeypatch.setattr(app, "rekognition", rekognition)
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+
+    result = app.analyze_frames((t, scene(t)) for t in range(0, 50, 5))
+
+    assert rekognition.throttled > 0
+    assert result["frames"] == 10
+    assert len(result["poses"]) == 10
+
+
+def test_prefilter_saves_rekognition_calls(app, monkeypatch):
+    rekognition = FakeRekognition()
+    monkeypatch.setattr(app, "rekognition", rekognition)
+    frames = [(0, solid(0)), (5, scene(1)), (10, solid(0)), (15, scene(2))]
+    counts = stats()
+
+    result = app.analyze_frames(app.prefilter_frames(frames, counts))
+
+    assert result["frames"] == 2
+    assert counts["filtered"] == 2
+    assert rekognition.count() == 4
+
+
+def segment(start, timestamps, objects=()):
+    return {
+        "statusCode": 200,
+        "body": {
+            "start": start,
+            "objects": list(objects),
+            "timestamps": timestamps,
+            "poses": [[0.0, 0.0, 0.0]] * len(timestamps),
+            "frames": {"analyzed": len(timestamps), "skipped": 0, "filtered": 0},
+        },
+    }
+
+
+def test_merge_counts_failed_segments(app):
+    segments = [
+        segment(120, [120, 125], ["Hat"]),
+        # Caught by the Map state's SegmentFailed
+        {"body": {"start": 60, "failed": True, "error": "States.Timeout"}},
+        segment(0, [0, 5]),
+        # Tolerated child failure, without a body
+        {"Error": "States.Runtime", "Cause": "..."},
+    ]
+    result = app.merge_segments(segments)["body"]
+
+    assert result["frames"]["segments"] == 4
+    assert result["frames"]["failed"] == 2
+    assert result["frames"]["analyzed"] == 4
+    assert result["objects"] == ["Hat"]
+
+
+def test_merge_of_only_failed_segments(app):
+    result = app.merge_segments([{"body": {"start": 0, "failed": True}}])["body"]
+    assert result["objects"] == []
+    assert result["frames"]["failed"] == 1
+
+
+def test_segment_errors_fail_the_invocation(app, monkeypatch):
+    # Raised so the Map state retries and catches it, not reported as empty
+    monkeypatch.setattr(app, "video_source", lambda key: contextlib.nullcontext(key))
+
+    def broken(*args):
+        raise RuntimeError("decode failed")
+
+    monkeypatch.setattr(app, "analyze_video", broken)
+    event = {"Action": "segment", "Video": "r1.mp4", "Start": 0, "End": 120}
+    with pytest.raises(RuntimeError):
+        app.lambda_handler(event, None)
+
+
+def test_rekognition_engine_plans_without_reading_the_video(app, monkeypatch):
+    monkeypatch.setattr(app, "s3", FakeS3())
+    event = {"Action": "plan", "Video": "r1.mp4", "Engine": "rekognition"}
+    assert app.lambda_handler(event, None)["body"] == {"engine": "rekognition", "segments": []}
+    assert app.s3.count() == 0
+
+
+def test_fallback_plan_reads_the_video(app, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(app, "s3", s3)
+    try:
+        # Not a video, so its duration is unknown and it gets one segment
+        event = {"Action": "plan", "Video": "r1.mp4", "Engine": "frames"}
+        body = app.lambda_handler(event, None)["body"]
+    finally:
+        s3.close()
+    assert body == {"engine": "frames", "segments": [{"video": "r1.mp4", "start": 0, "end": None}]}
+    assert s3.count("generate_presigned_url") == 1
+
+
+def test_collect_jobs_pages_through_the_results(app, monkeypatch):
+    def faces(t):
+        # Looking away from 20 to 40 seconds, no face after 50
+        if t >= 50:
+            return []
+        yaw = 80.0 if 20 <= t < 40 else 0.0
+        return [{"Pose": {"Yaw": yaw, "Pitch": 0.0, "Roll": 0.0}, "Confidence": 99.0}]
+
+    def labels(t):
+        names = ["Person", "Hat"] if t == 30 else ["Person"]
+        return [{"Name": name, "Confidence": 90.0} for name in names]
+
+    rekognition = FakeRekognition(faces=faces, labels=labels, video_seconds=lambda bucket, name: 60)
+    monkeypatch.setattr(app, "rekognition", rekognition)
+    monkeypatch.setattr(app, "REKOGNITION_PAGE_SIZE", 7)
+    video = {"S3Object": {"Bucket": "media", "Name": "r1.mp4"}}
+    face_job = rekognition.start_face_detection(Video=video)["JobId"]
+    label_job = rekognition.start_label_detection(Video=video)["JobId"]
+
+    event = {"Action": "collect", "FaceJobId": face_job, "LabelJobId": label_job}
+    body = app.lambda_handler(event, None)["body"]
+
+    assert body["objects"] == ["Hat"]
+    # One detection per FRAME_STEP_SECONDS step, 0 to 60 seconds
+    assert body["frames"]["analyzed"] == 13
+    assert body["attention"] is False
+    # 100 faces and 122 labels, 7 per page
+    assert rekognition.count("get_face_detection") == 15
+    assert rekognition.count("get_label_detection") == 18
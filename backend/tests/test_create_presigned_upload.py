@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeS3
+
+BUCKET = "interview-simulator-media"
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def app(s3):
+    module = load_handler("api/create_presigned_upload", BUCKET=BUCKET)
+    module.s3 = s3
+    return module
+
+
+def post(app, body):
+    event = {"httpMethod": "POST", "body": body if isinstance(body, str) else json.dumps(body)}
+    response = app.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def start(app, s3, parts):
+    response = app.lambda_handler(
+        {"httpMethod": "GET", "queryStringParameters": {"filename": "a.webm", "action": "start"}}, None
+    )
+    upload_id = json.loads(response["body"])["upload_id"]
+    for part_number in parts:
+        s3.upload_part(Bucket=BUCKET, Key="a.webm", UploadId=upload_id, PartNumber=part_number, Body=b"x")
+    return upload_id
+
+
+def test_complete_waits_for_every_part(app, s3):
+    upload_id = start(app, s3, [1, 3])
+    status, body = post(app, {"filename": "a.webm", "action": "complete", "upload_id": upload_id, "parts": 3})
+    assert status == 409
+    assert body["missing"] == [2]
+    # Nothing was written, so the analysis did not start
+    assert (BUCKET, "a.webm") not in s3.objects
+    assert s3.count("complete_multipart_upload") == 0
+
+    s3.upload_part(Bucket=BUCKET, Key="a.webm", UploadId=upload_id, PartNumber=2, Body=b"y")
+    status, body = post(app, {"filename": "a.webm", "action": "complete", "upload_id": upload_id, "parts": 3})
+    assert status == 200
+    assert body == {"key": "a.webm", "parts": 3}
+    assert s3.objects[(BUCKET, "a.webm")] == b"xyx"
+
+
+def test_complete_needs_the_part_count(app, s3):
+    upload_id = start(app, s3, [1])
+    for parts in (None, 0, "many"):
+        body = {"filename": "a.webm", "action": "complete", "upload_id": upload_id, "parts": parts}
+        assert post(app, body)[0] == 400
+    assert s3.count("complete_multipart_upload") == 0
+
+
+def test_complete_unknown_upload(app, s3):
+    status, _ = post(app, {"filename": "a.webm", "action": "complete", "upload_id": "gone", "parts": 1})
+    assert status == 404
+
+
+@pytest.mark.parametrize("body", ["{not json", "[1, 2]", '"a.webm"'])
+def test_malformed_body_is_a_bad_request(app, body):
+    status, response = post(app, body)
+    assert status == 400
+    assert response == {"error": "Invalid JSON body"}
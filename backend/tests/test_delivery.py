@@ -0,0 +1,71 @@
+import pytest
+
+from handlers import load_handler
+
+
+@pytest.fixture(scope="module")
+def delivery_metrics():
+    return load_handler("statesmachine/calculate_text_metrics").delivery_metrics
+
+
+def word(content, start, end, confidence=0.99):
+    return {
+        "type": "pronunciation",
+        "start_time": str(start),
+        "end_time": str(end),
+        "alternatives": [{"content": content, "confidence": str(confidence)}],
+    }
+
+
+def punctuation(content):
+    return {"type": "punctuation", "alternatives": [{"content": content}]}
+
+
+def interview():
+    # 120 words, one every half second, with a 3 second pause after the 60th
+    items = []
+    t = 0.0
+    for n in range(120):
+        content = {10: "né", 20: "hum", 30: "né"}.get(n, f"palavra{n}")
+        confidence = 0.2 if 40 <= n <= 42 else 0.99
+        items.append(word(content, round(t, 2), round(t + 0.4, 2), confidence))
+        t += 3.4 if n == 59 else 0.5
+        if n % 10 == 9:
+            items.append(punctuation("."))
+    return items
+
+
+def test_no_words(delivery_metrics):
+    assert delivery_metrics([punctuation(".")]) == {"words": 0}
+
+
+def test_words_per_minute(delivery_metrics):
+    result = delivery_metrics(interview())
+    assert result["words"] == 120
+    assert result["duration_seconds"] == 62.8
+    assert result["words_per_minute"] == round(120 / (62.8 / 60), 1)
+    assert result["words_per_minute_timeline"] == [115, 5]
+
+
+def test_pauses(delivery_metrics):
+    pauses = delivery_metrics(interview())["pauses"]
+    assert pauses["count"] == 1
+    assert pauses["long"] == 1
+    assert pauses["max_seconds"] == 3.0
+    # Bins from PAUSE_SECONDS to 1, 1 to 2, 2 to 5 and 5 or more seconds
+    assert pauses["histogram"] == [0, 0, 1, 0]
+
+
+def test_fillers(delivery_metrics):
+    fillers = delivery_metrics(interview())["fillers"]
+    assert fillers["count"] == 3
+    assert fillers["words"] == {"hum": 1, "né": 2}
+    assert fillers["per_100_words"] == 2.5
+
+
+def test_low_confidence_segments(delivery_metrics):
+    low_confidence = delivery_metrics(interview())["low_confidence"]
+    assert low_confidence["words"] == 3
+    assert low_confidence["segments"] == [
+        {"start": 20.0, "end": 21.4, "text": "palavra40 palavra41 palavra42"}
+    ]
@@ -0,0 +1,88 @@
+import base64
+import json
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeDynamoDB, FakeTable
+
+
+@pytest.fixture(scope="module")
+def app():
+    return load_handler("api/list_records")
+
+
+def test_cursor_round_trip(app):
+    key = {"record_id": "9b2f/+==", "email": "aluno@example.com"}
+    cursor = app.encode_cursor(key)
+    assert "/" not in cursor and "+" not in cursor
+    assert app.decode_cursor(cursor) == key
+
+
+def test_no_cursor_on_the_last_page(app):
+    assert app.encode_cursor(None) is None
+    assert app.encode_cursor({}) is None
+
+
+@pytest.fixture
+def records():
+    return FakeTable("record_id", indexes={"user_created_index": ("email", "created_at")})
+
+
+@pytest.fixture
+def api(records):
+    module = load_handler("api/list_records")
+    module.dynamodb = FakeDynamoDB(records=records)
+    return module
+
+
+def add_records(records, count):
+    add_record = load_handler("api/add_record")
+    add_record.dynamodb = FakeDynamoDB(records=records)
+    for n in range(count):
+        body = {"record_id": f"r{n}", "email": "aluno@example.com", "duration": "1:00"}
+        add_record.lambda_handler({"httpMethod": "POST", "body": json.dumps(body)}, None)
+    # Written in order, at least a microsecond apart
+    created = [records.items[f"r{n}"]["created_at"] for n in range(count)]
+    assert created == sorted(created)
+
+
+def list_page(api, cursor=None, limit=2):
+    params = {"email": "aluno@example.com", "limit": str(limit)}
+    if cursor:
+        params["cursor"] = cursor
+    response = api.lambda_handler({"httpMethod": "GET", "queryStringParameters": params}, None)
+    assert response["statusCode"] == 200
+    return json.loads(response["body"])
+
+
+def test_records_are_listed_newest_first(api, records):
+    add_records(records, 5)
+
+    pages = [list_page(api)]
+    while pages[-1]["cursor"]:
+        pages.append(list_page(api, pages[-1]["cursor"]))
+
+    listed = [record["record_id"] for page in pages for record in page["results"]]
+    assert listed == ["r4", "r3", "r2", "r1", "r0"]
+    assert [len(page["results"]) for page in pages] == [2, 2, 1]
+    assert set(pages[0]["results"][0]) <= set(api.SUMMARY_ATTRIBUTES)
+
+
+def list_error(api, **params):
+    params["email"] = "aluno@example.com"
+    response = api.lambda_handler({"httpMethod": "GET", "queryStringParameters": params}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_limit_below_one_is_rejected(api, records):
+    add_records(records, 1)
+    for limit in ("0", "-5"):
+        assert list_error(api, limit=limit) == (400, {"error": "Invalid limit or cursor parameter"})
+
+
+def test_cursor_must_decode_to_a_key(api, records):
+    add_records(records, 1)
+    for value in ([1, 2], "r0", 7, None):
+        cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+        assert list_error(api, cursor=cursor) == (400, {"error": "Invalid limit or cursor parameter"})
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "load"))
+import run_load  # noqa: E402
+import workflow  # noqa: E402
+
+
+def test_workflow_analyzes_every_upload(monkeypatch):
+    collector = run_load.Collector()
+    monkeypatch.setattr(run_load.instrumentation, "flush", collector.flush)
+    services = workflow.Services({})
+    run = workflow.Workflow(
+        services,
+        collector,
+        {"MAX_IN_FLIGHT": "1", "REKOGNITION_CACHE": "none"},
+        transcribe_seconds=0.1,
+        speech_seconds=5,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        video = run_load.make_video(os.path.join(directory, "interview.mp4"), 6)
+
+    try:
+        for n in range(2):
+            run.upload(f"interview-{n}", video)
+        # MAX_IN_FLIGHT is 1, the second upload waits for the first to finish
+        run.poll(retry_seconds=0)
+        executions = run.new_executions()
+        assert len(executions) == 1
+        run.run(executions[0])
+        run.poll(retry_seconds=0)
+        executions = run.new_executions()
+        assert len(executions) == 1
+        run.run(executions[0])
+    finally:
+        services.close()
+
+    assert run.errors == []
+    assert set(run.finished.values()) == {"SUCCEEDED"}
+    for n in range(2):
+        record = services.records.items[f"interview-{n}"]
+        assert record["video"] == f"interview-{n}.mp4"
+        assert record["report"]["avaliacao"] == "Boa apresentação."
+        assert record["frames"]["analyzed"] == 2
+    assert collector.samples["video_metrics.segment"]
+    assert collector.counts["executions.deferred"] == [1, 0]
@@ -0,0 +1,166 @@
+import re
+import json
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeSQS, FakeStepFunctions
+
+
+@pytest.fixture(scope="module")
+def app():
+    return load_handler("statesmachine/start_machine")
+
+
+def s3_record(key, etag="abc123"):
+    return {"s3": {"bucket": {"name": "media"}, "object": {"key": key, "eTag": etag}}}
+
+
+def test_execution_name_is_deterministic(app):
+    record = s3_record("interview-1.webm")
+    assert app.execution_name(record) == app.execution_name(s3_record("interview-1.webm"))
+
+
+def test_execution_name_changes_with_the_object(app):
+    name = app.execution_name(s3_record("interview-1.webm"))
+    assert name != app.execution_name(s3_record("interview-1.webm", etag="def456"))
+    assert name != app.execution_name(s3_record("interview-2.webm"))
+
+
+def test_execution_name_is_valid(app):
+    name = app.execution_name(s3_record("uploads/Minha entrevista (1)" + "x" * 100 + ".webm"))
+    assert name.startswith("Minha-entrevista--1-")
+    # Step Functions accepts up to 80 characters
+    assert re.fullmatch(r"[0-9A-Za-z_-]{1,80}", name)
+
+
+def load_start_machine(**settings):
+    return load_handler("statesmachine/start_machine", **settings)
+
+
+def test_default_quotas_bound_rekognition_calls():
+    app = load_start_machine()
+    # Rekognition allows 32 // 8 executions, Bedrock 40 // 4
+    assert app.EXECUTION_LIMIT == 4
+    assert app.segment_concurrency(app.EXECUTION_LIMIT) == 1
+    calls = app.EXECUTION_LIMIT * app.segment_concurrency(app.EXECUTION_LIMIT) * app.REKOGNITION_CONCURRENCY
+    assert calls <= app.REKOGNITION_BUDGET
+
+
+def test_fewer_executions_get_more_segments():
+    app = load_start_machine()
+    assert [app.segment_concurrency(n) for n in (1, 2, 3, 4)] == [4, 2, 1, 1]
+
+
+def test_tightest_quota_wins():
+    app = load_start_machine(REKOGNITION_BUDGET="800", BEDROCK_BUDGET="12")
+    assert app.execution_limits()["bedrock"] == 3
+    assert app.EXECUTION_LIMIT == 3
+    assert app.segment_concurrency(3) == 800 // (3 * 8)
+
+    app = load_start_machine(REKOGNITION_BUDGET="800", VIDEO_ENGINE="rekognition")
+    # Two Rekognition Video jobs per execution
+    assert app.EXECUTION_LIMIT == 10
+
+
+def test_budget_below_one_segment_still_runs():
+    app = load_start_machine(REKOGNITION_BUDGET="4")
+    assert (app.EXECUTION_LIMIT, app.segment_concurrency(1)) == (1, 1)
+
+
+def upload_event(*keys):
+    return {
+        "Records": [
+            {"messageId": f"m{n}", "body": json.dumps({"Records": [s3_record(key)]})}
+            for n, key in enumerate(keys)
+        ]
+    }
+
+
+def segments_started(app):
+    return sorted(
+        execution["input"]["SegmentConcurrency"]
+        for execution in app.step_functions.executions.values()
+        if execution["status"] == "RUNNING"
+    )
+
+
+def test_segment_concurrency_follows_the_executions_in_flight():
+    app = load_start_machine()
+    app.step_functions = FakeStepFunctions()
+
+    # Alone, the upload gets the whole budget
+    app.lambda_handler(upload_event("interview-1.webm"), None)
+    assert segments_started(app) == [4]
+
+    # Two uploads arriving with one execution running share it three ways
+    app.lambda_handler(upload_event("interview-2.webm", "interview-3.webm"), None)
+    assert segments_started(app) == [1, 1, 4]
+
+    # Once the others finish, the next one gets it all again
+    for name in list(app.step_functions.executions):
+        app.step_functions.finish(name)
+    app.lambda_handler(upload_event("interview-4.webm"), None)
+    assert segments_started(app) == [4]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_waiting_uploads_back_off():
+    queue = "https://sqs.us-east-1.amazonaws.com/123456789012/start"
+    app = load_start_machine(MAX_IN_FLIGHT="1", START_QUEUE_URL=queue)
+    app.step_functions = FakeStepFunctions()
+    app.step_functions.start_execution(stateMachineArn=app.STATE_MACHINE_ARN, name="running")
+    clock = Clock()
+    sqs = app.sqs = FakeSQS(clock=clock)
+    sqs.send_message(QueueUrl=app.QUEUE_URL, MessageBody=upload_event("interview-1.webm")["Records"][0]["body"])
+
+    delays = []
+    for _ in range(20):
+        (message,) = sqs.receive_message(QueueUrl=app.QUEUE_URL, VisibilityTimeout=60)["Messages"]
+        event = {
+            "Records": [
+                {
+                    "messageId": message["MessageId"],
+                    "receiptHandle": message["ReceiptHandle"],
+                    "body": message["Body"],
+                    "attributes": message["Attributes"],
+                }
+            ]
+        }
+        assert app.lambda_handler(event, None)["batchItemFailures"] == [{"itemIdentifier": message["MessageId"]}]
+        visible_at = sqs.messages[message["MessageId"]]["visible_at"]
+        delays.append(visible_at - clock.now)
+        clock.now = visible_at
+
+    assert delays[:3] == [60, 120, 180]
+    assert delays[-1] == app.DEFER_MAX_SECONDS
+
+
+def test_duplicate_events_start_one_execution():
+    app = load_start_machine()
+    step_functions = app.step_functions = FakeStepFunctions()
+    started = app.lambda_handler(upload_event("interview-1.webm"), None)
+    assert started == {"batchItemFailures": []}
+
+    # StartExecution alone would return the running execution as a new start
+    record = s3_record("interview-1.webm")
+    name = app.execution_name(record)
+    (execution,) = step_functions.executions.values()
+    response = step_functions.start_execution(
+        stateMachineArn=app.STATE_MACHINE_ARN, name=name, input=json.dumps(execution["input"])
+    )
+    assert response["startDate"] == execution["startDate"]
+
+    # The duplicate event, while it runs and once it finished
+    assert app.start(record, 4) is False
+    step_functions.finish(name)
+    assert app.start(record, 4) is False
+    assert step_functions.count("start_execution") == 2
+    assert list(step_functions.executions) == [name]
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeDynamoDB, FakeStepFunctions, FakeTable, FakeTranscribe
+
+JOB = "transcribe-r1.webm"
+
+
+@pytest.fixture
+def app():
+    module = load_handler("statesmachine/transcription_callback")
+    module.dynamodb = FakeDynamoDB(records=FakeTable("job_name"))
+    module.transcribe = FakeTranscribe()
+    module.step_functions = FakeStepFunctions()
+    module.transcribe.start_transcription_job(TranscriptionJobName=JOB)
+    return module
+
+
+def wait(app, token="token-1"):
+    app.lambda_handler({"TaskToken": token, "TranscriptionJobName": JOB}, None)
+
+
+def job_event(status="COMPLETED"):
+    return {
+        "detail-type": "Transcribe Job State Change",
+        "detail": {"TranscriptionJobName": JOB, "TranscriptionJobStatus": status},
+    }
+
+
+def test_token_waits_for_the_job_event(app):
+    wait(app)
+    assert app.step_functions.tasks == {}
+    assert "task_token" in app.dynamodb.Table("records").items[JOB]
+
+    app.transcribe.finish(JOB)
+    app.lambda_handler(job_event(), None)
+
+    task = app.step_functions.tasks["token-1"]
+    assert task["status"] == "SUCCEEDED"
+    assert task["output"]["TranscriptionJob"]["TranscriptionJobStatus"] == "COMPLETED"
+    assert app.dynamodb.Table("records").items == {}
+
+
+def test_failed_job_fails_the_task(app):
+    wait(app)
+    app.transcribe.finish(JOB, "FAILED")
+    app.lambda_handler(job_event("FAILED"), None)
+    assert app.step_functions.tasks["token-1"]["status"] == "FAILED"
+
+
+def test_job_finished_before_the_token_was_stored(app):
+    # The event arrives first and finds nothing waiting
+    app.transcribe.finish(JOB)
+    app.lambda_handler(job_event(), None)
+    assert app.step_functions.tasks == {}
+
+    # The status check after storing the token resumes the execution
+    wait(app)
+    assert app.step_functions.tasks["token-1"]["status"] == "SUCCEEDED"
+    assert app.dynamodb.Table("records").items == {}
+
+
+def test_event_and_status_check_resume_once(app):
+    app.transcribe.finish(JOB)
+    for n in range(20):
+        token = f"token-{n}"
+        threads = [
+            threading.Thread(target=wait, args=(app, token)),
+            threading.Thread(target=app.lambda_handler, args=(job_event(), None)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert app.step_functions.tasks[token]["status"] == "SUCCEEDED"
+
+    assert app.step_functions.count("send_task_success") == 20
+
+
+def test_timed_out_task_is_ignored(app):
+    wait(app)
+    app.step_functions.tasks["token-1"] = {"status": "TIMED_OUT"}
+    app.transcribe.finish(JOB)
+    app.lambda_handler(job_event(), None)
+    assert app.step_functions.tasks["token-1"] == {"status": "TIMED_OUT"}
@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import pytest
+
+from handlers import load_handler
+from stubs import FakeDynamoDB, FakeTable
+
+
+@pytest.fixture
+def records():
+    table = FakeTable("record_id")
+    table.put_item(
+        Item={
+            "record_id": "r1",
+            "video": "",
+            "preview": True,
+            "partial_feedback": {"avaliacao": "Boa"},
+            "delivery": {"words": 120},
+        }
+    )
+    return table
+
+
+@pytest.fixture
+def app(records):
+    module = load_handler("statesmachine/update_table")
+    module.dynamodb = FakeDynamoDB(records=records)
+    return module
+
+
+def event():
+    video = {
+        "objects": ["Hat"],
+        "attention": False,
+        "attention_score": {"attentive_percentage": 66.7, "timeline": []},
+        "frames": {"analyzed": 20, "skipped": 0, "filtered": 0, "segments": 3, "failed": 1},
+    }
+    text = {"transcription": "Olá", "avaliacao": "Boa", "correcao": "Certo"}
+    return [
+        {
+            "Records": [{"s3": {"object": {"key": "r1.webm"}}}],
+            "VideoMetrics": {"body": video},
+        },
+        {"TextMetrics": {"body": {"metrics": text}}},
+    ]
+
+
+def test_report_replaces_the_preview(app, records):
+    app.lambda_handler(event(), None)
+
+    item = records.items["r1"]
+    assert "partial_feedback" not in item
+    assert "preview" not in item
+    # The report has its own copy of the delivery metrics
+    assert "delivery" not in item
+    assert item["video"] == "r1.webm"
+    assert item["report"]["avaliacao"] == "Boa"
+    assert item["objects"] == ["Hat"]
+    assert item["attention"] is False
+    assert item["attention_score"]["attentive_percentage"] == Decimal("66.7")
+    assert item["frames"]["failed"] == 1
@@ -6,6 +6,66 @@ import axios from "axios";
 import api from "../services/api";
 import { v4 as uuidv4 } from "uuid";
 
+// gravações maiores que uma parte são enviadas em partes paralelas
+const PART_SIZE = 8 * 1024 * 1024;
+const PARALLEL_PARTS = 4;
+const MAX_ATTEMPTS = 5;
+
+const uploadSingle = (file, filename) =>
+  api.get("upload", { params: { filename: filename } }).then((response) => {
+    // separar os campos da url assinada
+    let formData = new FormData();
+    Object.keys(response.data.fields).forEach((key) => {
+      formData.append(key, response.data.fields[key]);
+    });
+    formData.append("file", file);
+    return axios.post(response.data.url, formData);
+  });
+
+const uploadMultipart = async (file, filename) => {
+  const started = await api.get("upload", {
+    params: { filename: filename, action: "start" },
+  });
+  const uploadId = started.data.upload_id;
+  const totalParts = Math.ceil(file.size / PART_SIZE);
+
+  for (let attempt = 1; ; attempt++) {
+    // a cada tentativa só as partes que ainda não estão no S3 são enviadas
+    const response = await api.get("upload", {
+      params: {
+        filename: filename,
+        action: "parts",
+        upload_id: uploadId,
+        parts: totalParts,
+      },
+    });
+    const pending = [...response.data.parts];
+    const sendParts = async () => {
+      while (pending.length) {
+        const part = pending.shift();
+        const start = (part.part_number - 1) * PART_SIZE;
+        await axios.put(part.url, file.slice(start, start + PART_SIZE));
+      }
+    };
+
+    try {
+      await Promise.all(Array.from({ length: PARALLEL_PARTS }, sendParts));
+      break;
+    } catch (error) {
+      if (attempt >= MAX_ATTEMPTS) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 2000 * attempt));
+    }
+  }
+
+  // a análise só começa quando o upload é concluído
+  return api.post("upload", {
+    filename: filename,
+    action: "complete",
+    upload_id: uploadId,
+    parts: totalParts,
+  });
+};
+
 function Recorder() {
   const { user } = useAuth();
   const audioConstraints = {
@@ -82,33 +142,25 @@ function Recorder() {
         let file = new File([blob], filename);
 
         // enviar gravação para o S3
-        api
-          .get("upload", {
-            params: { filename: filename },
-          })
-          .then((response) => {
-            // separar os campos da url assinada
-            let formData = new FormData();
-            Object.keys(response.data.fields).forEach((key) => {
-              formData.append(key, response.data.fields[key]);
+        const upload =
+          file.size > PART_SIZE
+            ? uploadMultipart(file, filename)
+            : uploadSingle(file, filename);
+
+        upload.then((response) => {
+          // envia metadados da gravação para o DynamoDB
+          api
+            .post("record", {
+              record_id: record_id,
+              email: user["userEmail"],
+              duration: `${timer[0]}:${timer[1]}:${timer[2]}`,
+              video: filename,
+            })
+            .then((response) => {
+              setUploading(false);
+              setRecordedChunks([]);
             });
-            formData.append("file", file);
-
-            axios.post(response.data.url, formData).then((response) => {
-              // envia metadados da gravação para o DynamoDB
-              api
-                .post("record", {
-                  record_id: record_id,
-                  email: user["userEmail"],
-                  duration: `${timer[0]}:${timer[1]}:${timer[2]}`,
-                  video: filename,
-                })
-                .then((response) => {
-                  setUploading(false);
-                  setRecordedChunks([]);
-                });
-            });
-          });
+        });
       }
     };
 
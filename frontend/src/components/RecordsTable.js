@@ -39,7 +39,9 @@ const modalStyle = {
 function RecordsTable() {
   const { user } = useAuth();
   const [records, setRecords] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [reportModal, setReportModal] = useState(false);
+  const [openRecord, setOpenRecord] = useState(null);
   const [metrics, setMetrics] = useState({
     transcription: "",
     feedback_bedrock: "",
@@ -61,8 +63,17 @@ function RecordsTable() {
   //   setMetrics(JSON.parse(record.report.replace(/'/g, '"')));
   //   setReportModal(true);
   // };
-  const handleOpenReport = (record) => {
-  const parsedReport = JSON.parse(record.report.replace(/'/g, '"'));
+  const showReport = useCallback((record) => {
+  // registros antigos guardam o relatório como texto, e ele fica vazio até o fim da análise
+  const parsedReport =
+    typeof record.report === "string"
+      ? record.report
+        ? JSON.parse(record.report.replace(/'/g, '"'))
+        : {}
+      : record.report;
+  // enquanto a análise roda, mostra as seções do feedback já geradas
+  const pending = !record.video;
+  const partial = (pending && record.partial_feedback) || {};
   
   // Handle objects safely
   let objects = [];
@@ -81,23 +92,60 @@ function RecordsTable() {
 
   setMetrics({
     ...parsedReport,
+    avaliacao: parsedReport?.avaliacao || partial.avaliacao,
+    correcao: parsedReport?.correcao || partial.correcao,
+    // métricas de fala ficam prontas antes do feedback
+    delivery: parsedReport?.delivery || record.delivery,
     attention: record.attention,
     objects: objects,
+    pending: pending,
   });
-  setReportModal(true);
-};
+}, []);
+  const fetchReport = useCallback(
+    (recordId) =>
+      // a listagem traz apenas o resumo, o relatório completo é buscado sob demanda
+      api
+        .get("records", {
+          params: { email: user["userEmail"], record_id: recordId },
+        })
+        .then((response) => {
+          showReport(response.data.result);
+        }),
+    [user, showReport]
+  );
+  const handleOpenReport = (summary) => {
+    setOpenRecord(summary.record_id);
+    fetchReport(summary.record_id).then(() => setReportModal(true));
+  };
   const getAttentionString = (attentionValue) => {
-    return attentionValue === "True" ? "Sim" : "Não";
+    return attentionValue === true || attentionValue === "True" ? "Sim" : "Não";
+  };
+  const handleCloseReport = () => {
+    setReportModal(false);
+    setOpenRecord(null);
   };
-  const handleCloseReport = () => setReportModal(false);
 
-  const refreshTable = useCallback((email) => {
+  // atualiza o relatório aberto até a análise terminar
+  useEffect(() => {
+    if (!reportModal || !metrics.pending || !openRecord) {
+      return undefined;
+    }
+    const timer = setInterval(() => fetchReport(openRecord), 5000);
+    return () => clearInterval(timer);
+  }, [reportModal, metrics.pending, openRecord, fetchReport]);
+
+  const refreshTable = useCallback((email, nextCursor = null) => {
     api
       .get("records", {
-        params: { email: email },
+        params: { email: email, cursor: nextCursor || undefined },
       })
       .then((response) => {
-        setRecords(response.data.results);
+        setRecords((current) =>
+          nextCursor
+            ? [...current, ...response.data.results]
+            : response.data.results
+        );
+        setCursor(response.data.cursor || null);
       })
       .catch((error) => {
         console.error("Error fetching records:", error);
@@ -191,9 +239,11 @@ function RecordsTable() {
                       </TableCell>
                     );
                   } else if (column.id === "report") {
+                    // o relatório fica pronto junto com o vídeo, mas resultados
+                    // parciais podem ser vistos antes
                     return (
                       <TableCell key={column.id} align={column.align}>
-                        {value !== "" ? (
+                        {row.video !== "" || row.preview ? (
                           <Button
                             onClick={() => {
                               handleOpenReport(row);
@@ -221,6 +271,17 @@ function RecordsTable() {
           </TableBody>
         </Table>
       </TableContainer>
+      {cursor && (
+        <Box sx={{ display: "flex", justifyContent: "center" }}>
+          <Button
+            onClick={() => {
+              refreshTable(user["userEmail"], cursor);
+            }}
+          >
+            Carregar mais
+          </Button>
+        </Box>
+      )}
 
       <Modal
         open={reportModal}
@@ -232,6 +293,11 @@ function RecordsTable() {
           <Typography id="modal-modal-title" variant="h4">
             Resultado da simulação
           </Typography>
+          {metrics.pending && (
+            <Typography sx={{ mt: 1 }} color="text.secondary">
+              Análise em andamento, o relatório é atualizado automaticamente.
+            </Typography>
+          )}
           <Typography id="modal-modal-title" variant="h5" sx={{ mt: 2 }}>
             Feedback
           </Typography>
@@ -244,12 +310,31 @@ function RecordsTable() {
           <Typography id="modal-modal-description" sx={{ mt: 2 }}>
             {metrics.correcao}
           </Typography>
+          {metrics.delivery?.words > 0 && (
+            <>
+              <Typography id="modal-modal-title" variant="h5" sx={{ mt: 2 }}>
+                Comunicação
+              </Typography>
+              <Typography id="modal-modal-description" sx={{ mt: 2 }}>
+                Ritmo: {metrics.delivery.words_per_minute} palavras por minuto
+                <br />
+                Pausas longas: {metrics.delivery.pauses.long}
+                <br />
+                Vícios de linguagem: {metrics.delivery.fillers.count} (
+                {metrics.delivery.fillers.per_minute} por minuto)
+                <br />
+                Trechos pouco claros: {metrics.delivery.low_confidence.segments.length}
+              </Typography>
+            </>
+          )}
           <Typography id="modal-modal-title" variant="h5" sx={{ mt: 2 }}>
             Transcrição
           </Typography>
           <Typography id="modal-modal-description" sx={{ mt: 2 }}>
             {metrics.transcription}
           </Typography>
+          {!metrics.pending && (
+          <>
           <Typography id="modal-modal-title" variant="h5" sx={{ mt: 2 }}>
             Objetos [Óculos escudos e/ou Boné]
           </Typography>
@@ -271,6 +356,8 @@ function RecordsTable() {
           <Typography id="modal-modal-description" sx={{ mt: 2 }}>
             {getAttentionString(metrics.attention)}
           </Typography>
+          </>
+          )}
         </Box>
       </Modal>
     </Paper>